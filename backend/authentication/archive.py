@@ -0,0 +1,203 @@
+"""
+Archival of soft-deleted users.
+
+Users deactivated longer than ARCHIVE_RETENTION_DAYS ago are moved, with
+their items, from users / items into users_archive / items_archive. Their
+refresh tokens are deleted along with them. Every batch is one statement in
+its own short transaction: it locks at most ARCHIVE_BATCH_SIZE rows with
+FOR UPDATE SKIP LOCKED, so it never waits on rows another transaction holds,
+and several workers (or the CLI next to them) can run at the same time.
+Items go first, a user is moved once none of its items are left.
+
+    python -m backend.authentication.archive              # archive everything due
+    python -m backend.authentication.archive --dry-run    # only count it
+
+With ARCHIVE_ENABLED=true every worker also runs it every ARCHIVE_INTERVAL
+seconds. Archived emails and usernames can be registered again.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import text
+
+from config import (ARCHIVE_RETENTION_DAYS, ARCHIVE_INTERVAL, ARCHIVE_BATCH_SIZE, ARCHIVE_BATCH_PAUSE,
+                    ARCHIVE_LOCK_TIMEOUT_MS)
+from .database import async_session
+
+logger = logging.getLogger(__name__)
+
+DUE = 'users.is_active = false AND users.deactivated_at < statement_timestamp() - make_interval(secs => :retention)'
+
+MOVE_ITEMS = text(
+    'WITH batch AS ('
+    ' SELECT items.id FROM items JOIN users ON users.id = items.owner_id'
+    f' WHERE {DUE}'
+    ' LIMIT :batch_size FOR UPDATE OF items SKIP LOCKED'
+    '), moved AS ('
+    ' DELETE FROM items WHERE id IN (SELECT id FROM batch) RETURNING id, title, content, owner_id'
+    ') '
+    'INSERT INTO items_archive (id, title, content, owner_id, archived_at) '
+    'SELECT id, title, content, owner_id, statement_timestamp() FROM moved'
+)
+MOVE_USERS = text(
+    'WITH batch AS ('
+    ' SELECT users.id FROM users'
+    f' WHERE {DUE}'
+    ' AND NOT EXISTS (SELECT 1 FROM items WHERE items.owner_id = users.id)'
+    ' ORDER BY users.deactivated_at LIMIT :batch_size FOR UPDATE SKIP LOCKED'
+    '), moved AS ('
+    ' DELETE FROM users WHERE id IN (SELECT id FROM batch)'
+    ' RETURNING id, username, email, hashed_password, role_mask, token_version, deactivated_at'
+    ') '
+    'INSERT INTO users_archive (id, username, email, hashed_password, role_mask, token_version, deactivated_at, '
+    'archived_at) '
+    'SELECT id, username, email, hashed_password, role_mask, token_version, deactivated_at, statement_timestamp() '
+    'FROM moved'
+)
+COUNT_DUE = text(
+    f'SELECT (SELECT count(*) FROM users WHERE {DUE}), '
+    f'(SELECT count(*) FROM items JOIN users ON users.id = items.owner_id WHERE {DUE})'
+)
+
+
+class ArchiveReport:
+    def __init__(self):
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.batches = 0
+        self.users = 0
+        self.items = 0
+        self.error: Optional[str] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    def as_dict(self) -> dict:
+        rows = self.users + self.items
+        return {
+            'finished': self.finished_at is not None,
+            'error': self.error,
+            'batches': self.batches,
+            'users': self.users,
+            'items': self.items,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(rows / self.elapsed, 1) if self.elapsed else 0.0,
+        }
+
+
+async def _move_batch(statement, retention: float, batch_size: int) -> int:
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(text(f'SET LOCAL lock_timeout = {int(ARCHIVE_LOCK_TIMEOUT_MS)}'))
+            res = await session.execute(statement, {'retention': retention, 'batch_size': batch_size})
+            return res.rowcount
+
+
+async def archive_users(
+        retention_days: float = ARCHIVE_RETENTION_DAYS,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        pause: float = ARCHIVE_BATCH_PAUSE,
+        report: Optional[ArchiveReport] = None,
+        on_batch: Optional[Callable[[ArchiveReport], None]] = None,
+) -> ArchiveReport:
+    """move everything due in batches until a batch comes back short"""
+    report = report or ArchiveReport()
+    retention = retention_days * 86400
+    try:
+        for statement, counter in ((MOVE_ITEMS, 'items'), (MOVE_USERS, 'users')):
+            while True:
+                moved = await _move_batch(statement, retention, batch_size)
+                report.batches += 1
+                setattr(report, counter, getattr(report, counter) + moved)
+                if on_batch is not None:
+                    on_batch(report)
+                if moved < batch_size:
+                    break
+                await asyncio.sleep(pause)
+    except Exception as err:
+        report.error = str(err) or type(err).__name__
+        raise
+    finally:
+        report.finished_at = time.time()
+    return report
+
+
+async def count_due(retention_days: float = ARCHIVE_RETENTION_DAYS) -> dict:
+    async with async_session() as session:
+        async with session.begin():
+            users, items = (await session.execute(COUNT_DUE, {'retention': retention_days * 86400})).one()
+    return {'users': users, 'items': items}
+
+
+class Archiver:
+    """periodic archival inside a worker, see ARCHIVE_ENABLED"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.last_report: Optional[ArchiveReport] = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.last_report = ArchiveReport()
+            try:
+                await archive_users(report=self.last_report)
+            except Exception as err:
+                logger.warning('archival failed: %r', err)
+            self.runs += 1
+            if self.last_report.users or self.last_report.items:
+                logger.info('archived %s', self.last_report.as_dict())
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'running': self._task is not None,
+            'interval': self.interval,
+            'runs': self.runs,
+            'last_run': self.last_report.as_dict() if self.last_report else None,
+        }
+
+
+archiver = Archiver(ARCHIVE_INTERVAL)
+
+
+async def _main(args: argparse.Namespace):
+    if args.dry_run:
+        print(json.dumps(await count_due(args.retention_days)))
+        return
+
+    def on_batch(report: ArchiveReport):
+        progress = report.as_dict()
+        print(f"batches {progress['batches']} users {progress['users']} items {progress['items']} "
+              f"({progress['rows_per_second']} rows/s)", flush=True)
+
+    report = await archive_users(args.retention_days, args.batch_size, args.pause, on_batch=on_batch)
+    print(json.dumps(report.as_dict()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--retention-days', type=float, default=ARCHIVE_RETENTION_DAYS)
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=ARCHIVE_BATCH_PAUSE, help='seconds between batches')
+    parser.add_argument('--dry-run', action='store_true', help='count users and items due, move nothing')
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
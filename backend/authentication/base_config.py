@@ -1,38 +1,45 @@
-from typing import Union
+from datetime import datetime
+from typing import AsyncIterator, Union
 from uuid import UUID
 
+from sqlalchemy import Row, true
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from backend.secure import hash_password
-from .manager import UserDAL, PortalRole
+from backend.mail.manager import OutboxDAL
+from backend.mail.messages import VERIFY, RESET, verification_mail, password_reset_mail
+from backend.secure import password_hasher
+from .database import read_session
+from .manager import UserDAL, PortalRole, RefreshTokenDAL
 from .models import User
-from .schemas import UserCreate, ShowUser
+from .schemas import UserCreate
 
 
-async def _create_new_user(body: UserCreate, session) -> ShowUser:
+async def _create_new_user(body: UserCreate, session) -> User:
+    hashed_password = await password_hasher.hash(body.password)
     async with session.begin():
         user_dal = UserDAL(session)
         user = await user_dal.create_user(
             username=body.username,
             email=body.email,
-            hashed_password=hash_password(body.password),
+            hashed_password=hashed_password,
             roles=[PortalRole.ROLE_PORTAL_USER, ]
         )
-        return ShowUser(
-            user_id=user.id,
-            username=user.username,
-            email=user.email,
-            is_active=user.is_active,
-        )
+        # same transaction: no mail for a signup that rolls back, no signup without its mail
+        await OutboxDAL(session).enqueue(VERIFY, user.email, *verification_mail(user))
+        return user
 
 
-async def _delete_user(user_id, session) -> Union[UUID, None]:
+async def _update_user_if(
+        user_id: UUID, values: dict, session, allowed=true(), applicable=true()
+) -> Union[Row, None]:
     async with session.begin():
         user_dal = UserDAL(session)
-        deleted_user_id = await user_dal.delete_user(
+        return await user_dal.update_user_if(
             user_id=user_id,
+            values=values,
+            allowed=allowed,
+            applicable=applicable,
         )
-        return deleted_user_id
 
 
 async def _get_user_by_id(user_id, session) -> Union[User, None]:
@@ -63,3 +70,124 @@ async def _get_user_by_email_for_auth(email: str, db: AsyncSession):
             return await user_dal.get_user_by_email(
                 email=email,
             )
+
+
+async def _get_token_version(user_id: UUID, db: AsyncSession) -> Union[int, None]:
+    async with db as session:
+        async with session.begin():
+            user_dal = UserDAL(session)
+            return await user_dal.get_token_version(
+                user_id=user_id,
+            )
+
+
+async def _list_users(limit: int, filters: dict, db: AsyncSession) -> list[Row]:
+    async with db as session:
+        async with session.begin():
+            user_dal = UserDAL(session)
+            return await user_dal.list_users(
+                limit=limit,
+                **filters,
+            )
+
+
+async def _stream_users(filters: dict, batch_size: int) -> AsyncIterator[Row]:
+    # owns its session: the response body is produced after the endpoint returned
+    async with read_session() as session:
+        async with session.begin():
+            user_dal = UserDAL(session)
+            async for row in user_dal.stream_users(batch_size=batch_size, **filters):
+                yield row
+
+
+async def _create_refresh_token(
+        token_hash: bytes, family_id: UUID, user_id: UUID, expires_at: datetime, db: AsyncSession
+):
+    async with db as session:
+        async with session.begin():
+            token_dal = RefreshTokenDAL(session)
+            await token_dal.create(
+                token_hash=token_hash,
+                family_id=family_id,
+                user_id=user_id,
+                expires_at=expires_at,
+            )
+
+
+async def _rotate_refresh_token(
+        token_hash: bytes, new_token_hash: bytes, expires_at: datetime, db: AsyncSession
+) -> Union[tuple[User, UUID], None]:
+    """use a refresh token and store its successor, None when it is not valid (any more)"""
+    async with db as session:
+        async with session.begin():
+            token_dal = RefreshTokenDAL(session)
+            used = await token_dal.use(token_hash=token_hash)
+            if used is None:
+                return
+            user = await UserDAL(session).get_user_by_id(user_id=used.user_id)
+            if user is None or not user.is_active:
+                await token_dal.revoke_family(family_id=used.family_id)
+                return
+            await token_dal.create(
+                token_hash=new_token_hash,
+                family_id=used.family_id,
+                user_id=used.user_id,
+                expires_at=expires_at,
+            )
+            return user, used.family_id
+
+
+async def _revoke_refresh_family(token_hash: bytes, db: AsyncSession, only_used: bool = False) -> Union[UUID, None]:
+    async with db as session:
+        async with session.begin():
+            token_dal = RefreshTokenDAL(session)
+            return await token_dal.revoke_family_of(
+                token_hash=token_hash,
+                only_used=only_used,
+            )
+
+
+async def _is_family_revoked(family_id: UUID, db: AsyncSession) -> bool:
+    async with db as session:
+        async with session.begin():
+            token_dal = RefreshTokenDAL(session)
+            return await token_dal.is_family_revoked(
+                family_id=family_id,
+            )
+
+
+async def _verify_email(user_id: UUID, email: str, db: AsyncSession) -> Union[UUID, None]:
+    async with db as session:
+        async with session.begin():
+            user_dal = UserDAL(session)
+            return await user_dal.verify_email(
+                user_id=user_id,
+                email=email,
+            )
+
+
+async def _enqueue_password_reset(email: str, db: AsyncSession) -> bool:
+    """queue a reset mail when an active user has this address, False when none has"""
+    async with db as session:
+        async with session.begin():
+            user = await UserDAL(session).get_user_by_email(email=email)
+            if user is None:
+                return False
+            await OutboxDAL(session).enqueue(RESET, user.email, *password_reset_mail(user))
+            return True
+
+
+async def _reset_password(
+        user_id: UUID, token_version: int, hashed_password: str, db: AsyncSession
+) -> Union[list[UUID], None]:
+    """new password and every refresh family of the user revoked, None when the link was used or outdated"""
+    async with db as session:
+        async with session.begin():
+            reset_user_id = await UserDAL(session).reset_password(
+                user_id=user_id,
+                token_version=token_version,
+                hashed_password=hashed_password,
+            )
+            if reset_user_id is None:
+                return
+            return await RefreshTokenDAL(session).revoke_user(user_id=reset_user_id)
@@ -0,0 +1,375 @@
+"""
+Streaming bulk import of users from NDJSON or CSV.
+
+Rows are read incrementally, validated with UserCreate, hashed in parallel on a
+dedicated pool and loaded batch by batch with COPY into a temporary staging
+table, from which they are inserted with ON CONFLICT DO NOTHING so that a
+duplicate email / username rejects only its own row. Memory use depends on the
+batch size, not on the size of the input: lines (and CSV rows, whose quoted
+fields may span lines) longer than BULK_IMPORT_MAX_LINE_BYTES are rejected.
+
+    python -m backend.authentication.bulk_import users.ndjson --rejected rejected.ndjson
+"""
+import argparse
+import asyncio
+import csv
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Optional
+
+import orjson
+from pydantic import ValidationError
+from sqlalchemy import text
+
+from backend.secure.hashing import PasswordHasher, password_hasher
+from config import (BULK_IMPORT_BATCH_SIZE, BULK_IMPORT_HASH_POOL_KIND, BULK_IMPORT_HASH_WORKERS,
+                    BULK_IMPORT_MAX_REPORTED_REJECTIONS, BULK_IMPORT_MAX_LINE_BYTES)
+from .database import async_session
+from .models import PortalRole, role_mask
+from .schemas import UserCreate
+
+FORMATS = ('ndjson', 'csv')
+
+STAGING_TABLE = 'users_import'
+STAGING_COLUMNS = ('line', 'id', 'username', 'email', 'hashed_password')
+
+CREATE_STAGING_TABLE = text(
+    f'CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} '
+    '(line bigint, id uuid, username varchar, email varchar, hashed_password varchar) '
+    'ON COMMIT DELETE ROWS'
+)
+INSERT_FROM_STAGING = text(
+    'INSERT INTO users (id, username, email, hashed_password, is_active, role_mask) '
+    'SELECT id, username, email, hashed_password, true, :role_mask '
+    f'FROM {STAGING_TABLE} ORDER BY line '
+    'ON CONFLICT DO NOTHING '
+    'RETURNING id'
+)
+
+bulk_hasher = PasswordHasher(
+    kind=BULK_IMPORT_HASH_POOL_KIND,
+    workers=BULK_IMPORT_HASH_WORKERS,
+    max_queue=BULK_IMPORT_BATCH_SIZE,
+    retry_after=1,
+)
+
+
+class ImportReport:
+    """progress of one import, keeps only the first rejected rows"""
+
+    def __init__(
+            self,
+            job_id: Optional[str] = None,
+            max_reported_rejections: int = BULK_IMPORT_MAX_REPORTED_REJECTIONS,
+    ):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.rows_read = 0
+        self.imported = 0
+        self.rejected = 0
+        self.max_reported_rejections = max_reported_rejections
+        self.rejected_rows: list[dict] = []
+        self.error: Optional[str] = None
+
+    def reject(self, line: int, reason: str, record: Optional[dict] = None):
+        self.rejected += 1
+        if len(self.rejected_rows) < self.max_reported_rejections:
+            rejection = {'line': line, 'reason': reason}
+            if isinstance(record, dict):
+                rejection.update({key: record.get(key) for key in ('username', 'email')})
+            self.rejected_rows.append(rejection)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    def as_dict(self) -> dict:
+        return {
+            'job_id': self.job_id,
+            'finished': self.finished_at is not None,
+            'error': self.error,
+            'rows_read': self.rows_read,
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_read / self.elapsed, 1) if self.elapsed else 0.0,
+            'rejected_rows': self.rejected_rows,
+        }
+
+
+class ImportJobs:
+    """reports of the most recent imports of this worker"""
+
+    def __init__(self, maxsize: int = 100):
+        self.maxsize = maxsize
+        self._jobs: OrderedDict[str, ImportReport] = OrderedDict()
+
+    def add(self, report: ImportReport):
+        self._jobs[report.job_id] = report
+        while len(self._jobs) > self.maxsize:
+            self._jobs.popitem(last=False)
+
+    def get(self, job_id: str) -> Optional[ImportReport]:
+        return self._jobs.get(job_id)
+
+
+import_jobs = ImportJobs()
+
+
+async def iter_lines(
+        chunks: AsyncIterator[bytes], max_line_bytes: int = BULK_IMPORT_MAX_LINE_BYTES
+) -> AsyncIterator[tuple[int, Optional[bytes]]]:
+    """
+    (line number, line) pairs from an async stream of byte chunks. A line longer
+    than max_line_bytes is discarded while it streams in and yielded as None, so
+    an upload without newlines cannot grow the buffer without bound.
+    """
+    line_no = 0
+    buffer = b''
+    oversized = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            line_no += 1
+            yield line_no, None if oversized or len(line) > max_line_bytes else line
+            oversized = False
+        if len(buffer) > max_line_bytes:
+            oversized = True
+            buffer = b''
+    if oversized:
+        yield line_no + 1, None
+    elif buffer.strip():
+        yield line_no + 1, buffer
+
+
+def _quoted_field_open(text: str, open_before: bool) -> bool:
+    """
+    Whether a quoted field is still open at the end of `text`. As in the csv
+    module's default dialect a field is quoted only when it starts with a quote,
+    a quote elsewhere in an unquoted field is a plain character and a doubled
+    quote inside a quoted field is an escaped one.
+    """
+    if '"' not in text:
+        return open_before
+    quoted, field_start = open_before, not open_before
+    position, end = 0, len(text)
+    while position < end:
+        char = text[position]
+        if quoted:
+            if char == '"':
+                if text.startswith('"', position + 1):
+                    position += 1
+                else:
+                    quoted, field_start = False, False
+        elif char == '"' and field_start:
+            quoted = True
+        else:
+            field_start = char == ','
+        position += 1
+    return quoted
+
+
+async def iter_records(
+        chunks: AsyncIterator[bytes], fmt: str, max_line_bytes: int = BULK_IMPORT_MAX_LINE_BYTES
+) -> AsyncIterator[tuple[int, object]]:
+    """
+    (line number, dict) per row, or (line number, error message) for unparsable rows.
+    A CSV row goes on over the following lines while a quoted field is open; it
+    is numbered by its first line.
+    """
+    header: Optional[list[str]] = None
+    # CSV row with a quoted field still open, and the line it started on
+    row: Optional[str] = None
+    row_line = 0
+    async for line_no, line in iter_lines(chunks, max_line_bytes):
+        if line is None:
+            if row is not None:
+                row = None
+                yield row_line, 'quoted field not closed before an over-long line'
+            yield line_no, f'line longer than {max_line_bytes} bytes'
+            continue
+        if fmt == 'ndjson':
+            if line.strip():
+                try:
+                    yield line_no, orjson.loads(line)
+                except orjson.JSONDecodeError as err:
+                    yield line_no, f'unparsable row: {err}'
+            continue
+        try:
+            text_line = line.decode('utf-8-sig').rstrip('\r')
+        except UnicodeDecodeError as err:
+            yield line_no, f'unparsable row: {err}'
+            continue
+        if row is None:
+            if not text_line.strip():
+                continue
+            row, row_line = text_line, line_no
+            still_open = _quoted_field_open(text_line, False)
+        else:
+            row += '\n' + text_line
+            still_open = _quoted_field_open(text_line, True)
+        if still_open:
+            if len(row) > max_line_bytes:
+                row = None
+                yield row_line, f'row longer than {max_line_bytes} bytes'
+            continue
+        complete, row = row, None
+        try:
+            values = next(csv.reader([complete]))
+        except csv.Error as err:
+            yield row_line, f'unparsable row: {err}'
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield row_line, f'expected {len(header)} columns, got {len(values)}'
+            continue
+        yield row_line, dict(zip(header, values))
+    if row is not None:
+        yield row_line, 'quoted field not closed at the end of the input'
+
+
+def _validate(record: object) -> tuple[Optional[UserCreate], Optional[str]]:
+    if not isinstance(record, dict):
+        return None, record if isinstance(record, str) else 'row is not an object'
+    try:
+        return UserCreate(**record), None
+    except ValidationError as err:
+        return None, '; '.join(
+            f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in err.errors()
+        )
+    except TypeError as err:
+        return None, str(err)
+
+
+async def _load_batch(batch: list[tuple[int, UserCreate]], hasher: PasswordHasher) -> set:
+    """COPY one validated batch into users, returns the lines that were inserted"""
+    hashed_passwords = await asyncio.gather(*(hasher.hash(user.password) for _, user in batch))
+    ids = {}
+    records = []
+    for (line, user), hashed_password in zip(batch, hashed_passwords):
+        user_id = uuid.uuid4()
+        ids[user_id] = line
+        records.append((line, user_id, user.username, user.email, hashed_password))
+
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(CREATE_STAGING_TABLE)
+            connection = await session.connection()
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                STAGING_TABLE, records=records, columns=STAGING_COLUMNS
+            )
+            res = await session.execute(INSERT_FROM_STAGING, {'role_mask': role_mask([PortalRole.ROLE_PORTAL_USER])})
+            # textual SQL, not seen by the write detection in database.py
+            session.info['wrote'] = True
+            return {ids[row[0]] for row in res.fetchall()}
+
+
+async def import_users(
+        chunks: AsyncIterator[bytes],
+        fmt: str = 'ndjson',
+        report: Optional[ImportReport] = None,
+        batch_size: int = BULK_IMPORT_BATCH_SIZE,
+        hasher: PasswordHasher = bulk_hasher,
+        on_reject: Optional[Callable[[int, str, object], None]] = None,
+        on_batch: Optional[Callable[[ImportReport], None]] = None,
+) -> ImportReport:
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown import format: {fmt}')
+    if report is None:
+        report = ImportReport()
+    import_jobs.add(report)
+    hasher.max_queue = max(hasher.max_queue, batch_size)
+    if hasher.rounds is None and password_hasher.rounds is not None:
+        hasher.configure(password_hasher.rounds)
+
+    def reject(line: int, reason: str, record: object = None):
+        report.reject(line, reason, record if isinstance(record, dict) else None)
+        if on_reject is not None:
+            on_reject(line, reason, record)
+
+    async def flush(batch: list[tuple[int, UserCreate]]):
+        inserted = await _load_batch(batch, hasher)
+        report.imported += len(inserted)
+        for line, user in batch:
+            if line not in inserted:
+                reject(line, 'user with this email or username already exists',
+                       {'username': user.username, 'email': user.email})
+        if on_batch is not None:
+            on_batch(report)
+
+    batch: list[tuple[int, UserCreate]] = []
+    try:
+        async for line, record in iter_records(chunks, fmt):
+            report.rows_read += 1
+            user, reason = _validate(record)
+            if user is None:
+                reject(line, reason, record)
+                continue
+            batch.append((line, user))
+            if len(batch) >= batch_size:
+                await flush(batch)
+                batch = []
+        if batch:
+            await flush(batch)
+    except Exception as err:
+        report.error = str(err)
+        raise
+    finally:
+        report.finished_at = time.time()
+    return report
+
+
+async def _read_file(path: str, chunk_size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, 'rb') as file:
+        while chunk := await asyncio.to_thread(file.read, chunk_size):
+            yield chunk
+
+
+async def _main(args: argparse.Namespace):
+    fmt = args.format or ('csv' if args.path.endswith('.csv') else 'ndjson')
+    await bulk_hasher.setup()
+    rejected_file = open(args.rejected, 'w') if args.rejected else None
+
+    def on_reject(line: int, reason: str, record: object):
+        if rejected_file is not None:
+            row = {'line': line, 'reason': reason}
+            if isinstance(record, dict):
+                row.update({key: record.get(key) for key in ('username', 'email')})
+            rejected_file.write(json.dumps(row) + '\n')
+
+    def on_batch(report: ImportReport):
+        progress = report.as_dict()
+        print(f"read {progress['rows_read']} imported {progress['imported']} "
+              f"rejected {progress['rejected']} ({progress['rows_per_second']} rows/s)", flush=True)
+
+    try:
+        report = await import_users(
+            _read_file(args.path), fmt, batch_size=args.batch_size, on_reject=on_reject, on_batch=on_batch
+        )
+    finally:
+        if rejected_file is not None:
+            rejected_file.close()
+        bulk_hasher.shutdown()
+    summary = report.as_dict()
+    summary.pop('rejected_rows')
+    print(json.dumps(summary))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS, help='defaults to csv for *.csv, ndjson otherwise')
+    parser.add_argument('--batch-size', type=int, default=BULK_IMPORT_BATCH_SIZE)
+    parser.add_argument('--rejected', help='write rejected rows to this NDJSON file')
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
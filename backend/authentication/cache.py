@@ -0,0 +1,163 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+from uuid import UUID
+
+from config import PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL, TOKEN_VERSION_CACHE_SIZE, TOKEN_VERSION_CACHE_TTL
+
+
+class InvalidationLog:
+    """
+    Recent invalidations by key, numbered by a generation counter: a value
+    loaded while its key was invalidated is stale and must not be cached.
+    Only the last maxsize keys are remembered, loads that started before the
+    oldest forgotten one count as stale.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = max(maxsize, 1)
+        self.generation = 0
+        self._floor = 0
+        self._recent: OrderedDict[Hashable, int] = OrderedDict()
+
+    def invalidate(self, key: Hashable):
+        self.generation += 1
+        self._recent[key] = self.generation
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.maxsize:
+            _, self._floor = self._recent.popitem(last=False)
+
+    def invalidate_all(self):
+        self.generation += 1
+        self._floor = self.generation
+        self._recent.clear()
+
+    def stale(self, key: Hashable, since: int) -> bool:
+        """was key invalidated after generation `since`"""
+        return since < self._floor or self._recent.get(key, 0) > since
+
+
+class TTLCache:
+    """bounded LRU mapping whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        # while False every get misses and set is ignored
+        self.enabled = True
+        self._invalidations = InvalidationLog(maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key) if self.enabled else None
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def generation(self) -> int:
+        """pass to set() to ignore a value that was loaded while its key was popped"""
+        return self._invalidations.generation
+
+    def set(self, key: Hashable, value: Any, since: Optional[int] = None):
+        if self.maxsize <= 0 or not self.enabled:
+            return
+        if since is not None and self._invalidations.stale(key, since):
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        self._invalidations.invalidate(key)
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            return entry[1]
+
+    def clear(self):
+        self._invalidations.invalidate_all()
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class PrincipalCache:
+    """authenticated users keyed by token subject, invalidated by user id on mutation"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._subject_by_user_id: dict[UUID, Hashable] = {}
+        self._invalidations = InvalidationLog(maxsize)
+
+    @property
+    def enabled(self) -> bool:
+        return self._cache.enabled
+
+    @enabled.setter
+    def enabled(self, enabled: bool):
+        self._cache.enabled = enabled
+
+    def get(self, subject: Hashable):
+        return self._cache.get(subject)
+
+    def generation(self) -> int:
+        """read before loading a principal, pass to set()"""
+        return self._invalidations.generation
+
+    def set(self, subject: Hashable, user, since: Optional[int] = None):
+        if not self._cache.enabled:
+            return
+        if since is not None and self._invalidations.stale(user.id, since):
+            # the user changed while it was loaded, the row may predate the change
+            return
+        self._cache.set(subject, user)
+        self._subject_by_user_id[user.id] = subject
+        if len(self._subject_by_user_id) > 2 * max(self._cache.maxsize, 1):
+            # drop index entries whose principal was already evicted
+            self._subject_by_user_id = {
+                user_id: key for user_id, key in self._subject_by_user_id.items() if key in self._cache
+            }
+
+    def invalidate_user(self, user_id: UUID):
+        self._invalidations.invalidate(user_id)
+        subject = self._subject_by_user_id.pop(user_id, None)
+        if subject is not None:
+            self._cache.pop(subject)
+
+    def clear(self):
+        self._invalidations.invalidate_all()
+        self._cache.clear()
+        self._subject_by_user_id.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+principal_cache = PrincipalCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+# user id -> current token_version, -1 for users that may not authenticate
+token_version_cache = TTLCache(maxsize=TOKEN_VERSION_CACHE_SIZE, ttl=TOKEN_VERSION_CACHE_TTL)
@@ -1,15 +1,182 @@
+import time
 from typing import Generator
+from weakref import WeakKeyDictionary
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.dml import UpdateBase
 
-from config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER, DB_CLIENT, DB_DRIVER
+from backend.observability.sql import instrument_engine
+from backend.observability.stats import LatencyStats
+from backend.observability.timing import record
+from config import (DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER, DB_CLIENT, DB_DRIVER, DB_ECHO,
+                    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+                    DB_STATEMENT_CACHE_SIZE, DB_QUERY_CACHE_SIZE, DB_REPLICA_HOSTS, REPLICA_CHECK_INTERVAL, REPLICA_CHECK_TIMEOUT)
+from .replicas import Replica, ReplicaSet, note_write
 
 DATABASE_URL = f"{DB_CLIENT}+{DB_DRIVER}://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+REPLICA_URLS = [f"{DB_CLIENT}+{DB_DRIVER}://{DB_USER}:{DB_PASS}@{host}/{DB_NAME}" for host in DB_REPLICA_HOSTS]
 Base = declarative_base()
 
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+
+class PoolStats:
+    """checkout wait and connect latency collected by InstrumentedPool"""
+
+    def __init__(self):
+        self.checkout_wait = LatencyStats()
+        self.connect = LatencyStats()
+        self.timeouts = 0
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """queue pool that times how long checkouts wait and new connections take"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self) -> 'InstrumentedPool':
+        # dispose() swaps the pool, the figures belong to the engine
+        new_pool = super().recreate()
+        new_pool.stats = self.stats
+        return new_pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats.checkout_wait.observe(elapsed)
+            record('db_wait', elapsed)
+
+    def _create_connection(self):
+        started = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats.connect.observe(elapsed)
+            record('db_connect', elapsed)
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    new_engine = create_async_engine(
+        url,
+        echo=DB_ECHO,
+        future=True,
+        poolclass=InstrumentedPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        query_cache_size=DB_QUERY_CACHE_SIZE,
+        connect_args={'prepared_statement_cache_size': DB_STATEMENT_CACHE_SIZE},
+    )
+    instrument_engine(new_engine.sync_engine)
+    return new_engine
+
+
+engine = _create_engine(DATABASE_URL)
+replica_set = ReplicaSet(
+    [Replica(host, _create_engine(url)) for host, url in zip(DB_REPLICA_HOSTS, REPLICA_URLS)],
+    check_interval=REPLICA_CHECK_INTERVAL,
+    check_timeout=REPLICA_CHECK_TIMEOUT,
+)
+
+
+# statement -> whether it writes, prebuilt statements are only traversed once
+_writes: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def is_write(statement) -> bool:
+    """
+    INSERT / UPDATE / DELETE, also nested in a SELECT as a data-modifying CTE
+    (UserDAL.update_user_if). Textual SQL is not inspected: code writing
+    through text() sets session.info['wrote'] itself.
+    """
+    if statement is None:
+        return False
+    if isinstance(statement, UpdateBase):
+        return True
+    writes = _writes.get(statement)
+    if writes is None:
+        writes = _writes[statement] = any(isinstance(element, UpdateBase) for element in visitors.iterate(statement))
+    return writes
+
+
+class RoutingSession(Session):
+    """
+    Session for read-only work: binds to a replica chosen by replica_set on
+    first use and keeps it for the whole session, so one transaction never
+    spans two servers. Writes issued through it go to the primary.
+    """
+
+    _routed_bind = None
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or is_write(clause):
+            return engine.sync_engine
+        if self._routed_bind is None:
+            replica = replica_set.choose()
+            self._routed_bind = (replica.engine if replica is not None else engine).sync_engine
+        return self._routed_bind
+
+
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+read_session = sessionmaker(expire_on_commit=False, class_=AsyncSession, sync_session_class=RoutingSession)
+
+
+# read-your-writes: a committed write keeps the rest of the request, and the
+# token subject for a while, off the replicas
+
+@event.listens_for(Session, 'after_flush')
+def _flushed(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _executed(orm_execute_state):
+    if is_write(orm_execute_state.statement):
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _committed(session):
+    if session.info.pop('wrote', False):
+        note_write()
+
+
+def _pool_status(target: AsyncEngine) -> dict:
+    pool = target.pool
+    stats = pool.stats
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+        'max_overflow': DB_MAX_OVERFLOW,
+        'timeout': DB_POOL_TIMEOUT,
+        'timeouts': stats.timeouts,
+        'checkout_wait': stats.checkout_wait.as_dict(),
+        'connect': stats.connect.as_dict(),
+    }
+
+
+def pool_status() -> dict:
+    """the primary's pool and, by host, every replica's"""
+    return {
+        **_pool_status(engine),
+        'replicas': {replica.name: _pool_status(replica.engine) for replica in replica_set.replicas},
+    }
 
 
 async def get_db() -> Generator:
@@ -19,3 +186,12 @@ async def get_db() -> Generator:
         yield session
     finally:
         await session.close()
+
+
+async def get_read_db() -> Generator:
+    """Dependency for read-only endpoints, served by a replica when one is usable"""
+    try:
+        session: AsyncSession = read_session()
+        yield session
+    finally:
+        await session.close()
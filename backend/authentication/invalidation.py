@@ -0,0 +1,118 @@
+"""
+Principal cache invalidation across workers.
+
+The statement of every UserDAL mutation also calls pg_notify on
+principal_invalidation with the id of each row it changed, so a mutation that
+changes nothing (403, 404) sends nothing and no round trip is added. Postgres
+delivers it to all listeners once, and only if, the transaction commits. Each worker listens on a dedicated connection
+(outside the pool) and drops the user from its principal and token version
+caches as the notification arrives, so a deactivated or demoted user stops
+authenticating on every worker within the notification latency, not only on
+the one that made the change.
+
+A worker that is not listening (not connected yet, connection lost) cannot
+know what it missed: its caches are cleared and bypassed until it listens
+again, trading a lookup per request for correctness. With
+PRINCIPAL_CACHE_BROADCAST=false nothing is listened to and cached principals
+of other workers stay valid for up to PRINCIPAL_CACHE_TTL /
+TOKEN_VERSION_CACHE_TTL after a change.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+from uuid import UUID
+
+import asyncpg
+
+from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS, PRINCIPAL_CACHE_RECONNECT_INTERVAL
+from .cache import principal_cache, token_version_cache
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'principal_invalidation'
+
+
+def forget_user(user_id: UUID):
+    principal_cache.invalidate_user(user_id)
+    token_version_cache.pop(user_id)
+
+
+def _use_caches(enabled: bool):
+    if not enabled:
+        principal_cache.clear()
+        token_version_cache.clear()
+    principal_cache.enabled = enabled
+    token_version_cache.enabled = enabled
+
+
+class InvalidationListener:
+    def __init__(self, reconnect_interval: float):
+        self.reconnect_interval = reconnect_interval
+        self._task: Optional[asyncio.Task] = None
+        self.listening = False
+        self.received = 0
+        self.reconnects = 0
+        self.listening_since: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def _notified(self, connection, pid: int, channel: str, payload: str):
+        self.received += 1
+        try:
+            forget_user(UUID(payload))
+        except ValueError:
+            logger.warning('ignoring malformed %s payload %r', CHANNEL, payload)
+
+    async def _listen(self):
+        lost = asyncio.Event()
+        connection = await asyncpg.connect(
+            host=DB_HOST, port=int(DB_PORT) if DB_PORT else None, user=DB_USER, password=DB_PASS, database=DB_NAME,
+        )
+        try:
+            connection.add_termination_listener(lambda _: lost.set())
+            await connection.add_listener(CHANNEL, self._notified)
+            # caches were emptied when listening stopped, nothing went unnoticed since
+            _use_caches(True)
+            self.listening = True
+            self.listening_since = time.time()
+            self.last_error = None
+            await lost.wait()
+        finally:
+            self.listening = False
+            _use_caches(False)
+            if not connection.is_closed():
+                await connection.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+                self.last_error = 'connection lost'
+            except Exception as err:
+                self.last_error = str(err) or type(err).__name__
+            logger.warning('not listening for principal invalidations (%s), caches bypassed', self.last_error)
+            self.reconnects += 1
+            await asyncio.sleep(self.reconnect_interval)
+
+    async def start(self):
+        if self._task is None:
+            _use_caches(False)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'running': self._task is not None,
+            'listening': self.listening,
+            'listening_since': self.listening_since,
+            'received': self.received,
+            'reconnects': self.reconnects,
+            'last_error': self.last_error,
+        }
+
+
+invalidation_listener = InvalidationListener(reconnect_interval=PRINCIPAL_CACHE_RECONNECT_INTERVAL)
@@ -1,22 +1,126 @@
-from typing import Union
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import AsyncIterator, Optional, Union
 from uuid import UUID
 
 from fastapi import HTTPException
-from sqlalchemy import update, and_, select
+from sqlalchemy import (update, and_, or_, select, delete, exists, event, true, func, literal_column, bindparam,
+                        cast, Boolean, String, Row, ColumnElement, Select, Update)
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
-from .models import User, PortalRole
+from backend.observability.sql import label_statements
+from config import PRINCIPAL_CACHE_BROADCAST
+from .invalidation import CHANNEL, forget_user
+from .models import User, PortalRole, RefreshToken, ROLE_BITS, role_mask, role_index_predicate
 
 
 # business context #
 
+# columns embedded in stateless tokens, changing any of them bumps token_version
+TOKEN_CLAIM_FIELDS = {'email', 'username', 'role_mask', 'is_active'}
 
+
+LIST_ORDER_COLUMNS = {'id': User.id, 'email': User.email}
+
+ADMIN_BIT = ROLE_BITS[PortalRole.ROLE_PORTAL_ADMIN]
+SUPERADMIN_BIT = ROLE_BITS[PortalRole.ROLE_PORTAL_SUPERADMIN]
+PRIVILEGED_MASK = ADMIN_BIT | SUPERADMIN_BIT
+
+
+def is_privileged(current_user) -> bool:
+    """admin or super admin, one bit test"""
+    return bool(current_user.role_mask & PRIVILEGED_MASK)
+
+
+def has_role(role: PortalRole) -> ColumnElement[bool]:
+    """role filter written exactly like the predicate of its partial index (ix_users_role_*)"""
+    return literal_column(role_index_predicate(role), type_=Boolean)
+
+
+# Statements of the hot UserDAL methods are built once, values are bound per
+# call. The SQL string, and so SQLAlchemy's compiled cache entry and the
+# asyncpg prepared statement of each connection, is the same for every request.
+
+_IS_ACTIVE = User.is_active == True
+
+USER_BY_ID = select(User).where(User.id == bindparam('user_id'))
+ACTIVE_USER_BY_ID = USER_BY_ID.where(_IS_ACTIVE)
+# case-insensitive, through ux_users_email_lower / ix_users_active_email_lower
+USER_BY_EMAIL = select(User).where(func.lower(User.email) == func.lower(bindparam('email', type_=String)))
+ACTIVE_USER_BY_EMAIL = USER_BY_EMAIL.where(_IS_ACTIVE)
+# index-only scan of ix_users_active_id
+TOKEN_VERSION = select(User.token_version).where(and_(User.id == bindparam('user_id'), _IS_ACTIVE))
+
+
+def _notify_changed(user_id: ColumnElement) -> ColumnElement:
+    """NOTIFY for a changed user, delivered to every worker's InvalidationListener once committed"""
+    return func.pg_notify(CHANNEL, cast(user_id, String))
+
+
+def _notifying(statement: Update) -> Union[Update, Select]:
+    """
+    `statement` (RETURNING users.id) sending the invalidation for each row it
+    actually changed, in the same round trip: SELECT id, pg_notify(...) FROM changed
+    """
+    if not PRINCIPAL_CACHE_BROADCAST:
+        return statement
+    changed = statement.cte('changed')
+    return select(changed.c.id, _notify_changed(changed.c.id))
+
+
+DELETE_USER = _notifying(
+    update(User)
+    .where(and_(User.id == bindparam('user_id'), _IS_ACTIVE))
+    .values(is_active=False, deactivated_at=func.now(), token_version=User.token_version + 1)
+    .returning(User.id)
+)
+
+
+@lru_cache(maxsize=64)
+def _update_user_statement(columns: tuple[str, ...]) -> Union[Update, Select]:
+    """one statement per sorted set of updated columns, new values bound as :new_<column>"""
+    unknown = set(columns).difference(User.__table__.c.keys())
+    if unknown:
+        raise ValueError(f'not a users column: {", ".join(sorted(unknown))}')
+    values = {column: bindparam(f'new_{column}', type_=User.__table__.c[column].type) for column in columns}
+    if TOKEN_CLAIM_FIELDS.intersection(columns):
+        # outstanding stateless tokens carry the old values, revoke them
+        values['token_version'] = User.token_version + 1
+    return _notifying(
+        update(User)
+        .where(and_(User.id == bindparam('user_id'), _IS_ACTIVE))
+        .values(values)
+        .returning(User.id)
+    )
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_committed(session):
+    for user_id in session.info.pop('invalidated_users', ()):
+        forget_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidated(session):
+    session.info.pop('invalidated_users', None)
+
+
+@label_statements
 class UserDAL:
     """data access for users"""
 
     def __init__(self, db_session: AsyncSession):
         self.db_session = db_session
 
+    def _invalidate_principal(self, user_id: UUID):
+        """
+        The user's row was changed: drop it now and again once committed. The
+        statement that changed it sent the NOTIFY for the other workers.
+        """
+        forget_user(user_id)
+        self.db_session.info.setdefault('invalidated_users', set()).add(user_id)
+
     async def create_user(
             self, username: str, hashed_password: str, email: str, roles: list[PortalRole]
     ) -> User:
@@ -25,65 +129,267 @@ class UserDAL:
             hashed_password=hashed_password,
             email=email,
             is_active=True,
-            roles=roles
+            role_mask=role_mask(roles)
         )
         self.db_session.add(new_user)
         await self.db_session.flush()
         return new_user
 
     async def delete_user(self, user_id: UUID) -> Union[UUID, None]:
-        query = (
-            update(User)
-            .where(and_(User.id == user_id, User.is_active == True))
-            .values(is_active=False)
-            .returning(User.id)
-        )
-        res = await self.db_session.execute(query)
+        res = await self.db_session.execute(DELETE_USER, {'user_id': user_id})
         deleted_user_id_row = res.fetchone()
         if deleted_user_id_row is not None:
+            self._invalidate_principal(user_id)
             return deleted_user_id_row[0]
 
-    async def get_user_by_id(self, user_id: UUID) -> Union[User, None]:
-        query = select(User).where(User.id == user_id)
-        res = await self.db_session.execute(query)
+    async def get_user_by_id(self, user_id: UUID, include_inactive: bool = False) -> Union[User, None]:
+        query = USER_BY_ID if include_inactive else ACTIVE_USER_BY_ID
+        res = await self.db_session.execute(query, {'user_id': user_id})
         user_row = res.fetchone()
         if user_row is not None:
             return user_row[0]
 
     async def update_user(self, user_id: UUID, **kwargs) -> Union[User, None]:
-        query = (
-            update(User)
-            .where(and_(User.id == user_id, User.is_active == True))
-            .values(kwargs)
-            .returning(User.id)
-        )
-        res = await self.db_session.execute(query)
+        """plain values per users column, e.g. update_user(user_id, hashed_password=...)"""
+        query = _update_user_statement(tuple(sorted(kwargs)))
+        params = {f'new_{column}': value for column, value in kwargs.items()}
+        res = await self.db_session.execute(query, {'user_id': user_id, **params})
         update_user_id = res.fetchone()
         if update_user_id is not None:
+            self._invalidate_principal(user_id)
             return update_user_id[0]
 
-    async def get_user_by_email(self, email: str) -> Union[User, None]:
-        query = select(User).where(User.email == email)
+    async def update_user_if(
+            self,
+            user_id: UUID,
+            values: dict,
+            allowed: ColumnElement[bool] = true(),
+            applicable: ColumnElement[bool] = true(),
+    ) -> Union[Row, None]:
+        """
+        Update an active user in one statement, only if `allowed` (permission) and
+        `applicable` (state precondition) hold for the target row.
+
+        Returns None when there is no such active user, otherwise a row of
+        (allowed, applicable, updated_user_id) telling why nothing was updated.
+        """
+        if TOKEN_CLAIM_FIELDS.intersection(values):
+            values = {**values, 'token_version': User.token_version + 1}
+        is_target = and_(User.id == user_id, User.is_active == True)
+        target = (
+            select(User.id, allowed.label('allowed'), applicable.label('applicable'))
+            .where(is_target)
+            .cte('target')
+        )
+        # predicates are repeated on the live row so a concurrent change is re-checked
+        updated = (
+            update(User)
+            .where(and_(is_target, allowed, applicable))
+            .values(values)
+            .returning(User.id)
+            .cte('updated')
+        )
+        columns = [target.c.allowed, target.c.applicable, updated.c.id.label('updated_user_id')]
+        if PRINCIPAL_CACHE_BROADCAST:
+            # (SELECT pg_notify(...) FROM updated), nothing is sent when no row was updated
+            notify = select(_notify_changed(updated.c.id)).correlate(None).scalar_subquery()
+            columns.append(notify.label('notified'))
+        query = select(*columns).select_from(target.outerjoin(updated, true()))
         res = await self.db_session.execute(query)
+        result = res.fetchone()
+        if result is not None and result.updated_user_id is not None:
+            self._invalidate_principal(user_id)
+        return result
+
+    @staticmethod
+    def _list_users_query(
+            order_by: str = 'id',
+            after: Optional[str] = None,
+            is_active: Optional[bool] = None,
+            role: Optional[PortalRole] = None,
+    ) -> Select:
+        """keyset (seek) query: WHERE key > :after ORDER BY key, never OFFSET"""
+        key = LIST_ORDER_COLUMNS[order_by]
+        query = select(User.id, User.username, User.email, User.is_active).order_by(key)
+        if after is not None:
+            query = query.where(key > (UUID(after) if order_by == 'id' else after))
+        if is_active is not None:
+            query = query.where(User.is_active == is_active)
+        if role is not None:
+            query = query.where(has_role(role))
+        return query
+
+    async def list_users(self, limit: int, **filters) -> list[Row]:
+        res = await self.db_session.execute(self._list_users_query(**filters).limit(limit))
+        return res.fetchall()
+
+    async def stream_users(self, batch_size: int, **filters) -> AsyncIterator[Row]:
+        """rows through a server-side cursor, needs an open transaction"""
+        query = self._list_users_query(**filters).execution_options(yield_per=batch_size)
+        result = await self.db_session.stream(query)
+        async for row in result:
+            yield row
+
+    async def get_token_version(self, user_id: UUID) -> Union[int, None]:
+        res = await self.db_session.execute(TOKEN_VERSION, {'user_id': user_id})
+        return res.scalar_one_or_none()
+
+    async def get_user_by_email(self, email: str, include_inactive: bool = False) -> Union[User, None]:
+        query = USER_BY_EMAIL if include_inactive else ACTIVE_USER_BY_EMAIL
+        res = await self.db_session.execute(query, {'email': email})
         user_row = res.fetchone()
         if user_row is not None:
             return user_row[0]
 
+    async def verify_email(self, user_id: UUID, email: str) -> Union[UUID, None]:
+        """mark the address verified, only while it is still the user's address"""
+        query = (
+            update(User)
+            .where(and_(User.id == user_id, func.lower(User.email) == email.lower(), _IS_ACTIVE))
+            .values(email_verified_at=func.coalesce(User.email_verified_at, func.now()))
+            .returning(User.id)
+        )
+        res = await self.db_session.execute(query)
+        return res.scalar_one_or_none()
+
+    async def reset_password(self, user_id: UUID, token_version: int, hashed_password: str) -> Union[UUID, None]:
+        """
+        Set a new password if token_version is still the one the reset link was
+        made for. Bumping it makes the link single use and ends stateless sessions.
+        """
+        query = _notifying(
+            update(User)
+            .where(and_(User.id == user_id, User.token_version == token_version, _IS_ACTIVE))
+            .values(hashed_password=hashed_password, token_version=User.token_version + 1)
+            .returning(User.id)
+        )
+        res = await self.db_session.execute(query)
+        reset_user_id = res.scalar_one_or_none()
+        if reset_user_id is not None:
+            self._invalidate_principal(user_id)
+        return reset_user_id
 
-def check_user_permission(target_user: User, current_user: User) -> bool:
-    if PortalRole.ROLE_PORTAL_SUPERADMIN in current_user.roles:
+
+@label_statements
+class RefreshTokenDAL:
+    """data access for refresh_tokens, tokens are only ever looked up by their hash"""
+
+    def __init__(self, db_session: AsyncSession):
+        self.db_session = db_session
+
+    async def create(self, token_hash: bytes, family_id: UUID, user_id: UUID, expires_at: datetime):
+        self.db_session.add(RefreshToken(
+            token_hash=token_hash, family_id=family_id, user_id=user_id, expires_at=expires_at, used=False,
+        ))
+        await self.db_session.flush()
+
+    async def use(self, token_hash: bytes) -> Union[Row, None]:
+        """
+        Mark a valid token used, once: concurrent uses of the same token block on
+        the row and all but the first find it used. Returns (family_id, user_id).
+        """
+        query = (
+            update(RefreshToken)
+            .where(and_(
+                RefreshToken.token_hash == token_hash,
+                RefreshToken.used == False,
+                RefreshToken.revoked_at.is_(None),
+                RefreshToken.expires_at > func.now(),
+            ))
+            .values(used=True)
+            .returning(RefreshToken.family_id, RefreshToken.user_id)
+        )
+        res = await self.db_session.execute(query)
+        return res.fetchone()
+
+    async def revoke_family(self, family_id: UUID) -> bool:
+        query = (
+            update(RefreshToken)
+            .where(and_(RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None)))
+            .values(revoked_at=func.now())
+            .returning(RefreshToken.family_id)
+        )
+        res = await self.db_session.execute(query)
+        return res.first() is not None
+
+    async def revoke_family_of(self, token_hash: bytes, only_used: bool = False) -> Union[UUID, None]:
+        """revoke the family of a token, with only_used when it is replayed after rotation"""
+        family = select(RefreshToken.family_id).where(RefreshToken.token_hash == token_hash)
+        if only_used:
+            family = family.where(RefreshToken.used == True)
+        query = (
+            update(RefreshToken)
+            .where(and_(RefreshToken.family_id == family.scalar_subquery(), RefreshToken.revoked_at.is_(None)))
+            .values(revoked_at=func.now())
+            .returning(RefreshToken.family_id)
+        )
+        res = await self.db_session.execute(query)
+        return res.scalars().first()
+
+    async def revoke_user(self, user_id: UUID) -> list[UUID]:
+        """revoke every live family of a user, e.g. after a password reset"""
+        query = (
+            update(RefreshToken)
+            .where(and_(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None)))
+            .values(revoked_at=func.now())
+            .returning(RefreshToken.family_id)
+        )
+        res = await self.db_session.execute(query)
+        return list(set(res.scalars()))
+
+    async def is_family_revoked(self, family_id: UUID) -> bool:
+        query = select(exists().where(and_(
+            RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_not(None)
+        )))
+        res = await self.db_session.execute(query)
+        return bool(res.scalar())
+
+    async def revoked_families_since(self, seconds: float) -> list[UUID]:
+        query = (
+            select(RefreshToken.family_id)
+            .where(RefreshToken.revoked_at > func.now() - timedelta(seconds=seconds))
+            .distinct()
+        )
+        res = await self.db_session.execute(query)
+        return list(res.scalars())
+
+    async def purge_expired(self, grace_seconds: float) -> int:
+        """delete tokens expired and, when revoked, revoked longer ago than grace_seconds"""
+        cutoff = func.now() - timedelta(seconds=grace_seconds)
+        query = delete(RefreshToken).where(and_(
+            RefreshToken.expires_at < cutoff,
+            or_(RefreshToken.revoked_at.is_(None), RefreshToken.revoked_at < cutoff),
+        ))
+        res = await self.db_session.execute(query)
+        return res.rowcount
+
+
+def user_permission_clause(current_user) -> ColumnElement[bool]:
+    """who current_user may delete / update, as a predicate on the target users row"""
+    if current_user.is_super_admin:
         raise HTTPException(
             status_code=406, detail='Superadmin cannot be deleted via API'
         )
-    if target_user.id != current_user.id:
-        if not {
-            PortalRole.ROLE_PORTAL_ADMIN,
-            PortalRole.ROLE_PORTAL_SUPERADMIN,
-        }.intersection(current_user.roles):
-            return False
-        if (
-                PortalRole.ROLE_PORTAL_SUPERADMIN in target_user.roles
-                and PortalRole.ROLE_PORTAL_SUPERADMIN in current_user.roles
-        ):
-            return False
-    return True
+    if current_user.is_admin:
+        return true()
+    return User.id == current_user.id
+
+
+def deactivate_values() -> dict:
+    return {'is_active': False, 'deactivated_at': func.now()}
+
+
+def grant_admin_values() -> dict:
+    return {'role_mask': User.role_mask.op('|')(ADMIN_BIT)}
+
+
+def revoke_admin_values() -> dict:
+    return {'role_mask': User.role_mask.op('&')(~ADMIN_BIT)}
+
+
+def can_be_granted_admin() -> ColumnElement[bool]:
+    return User.role_mask.op('&')(PRIVILEGED_MASK) == 0
+
+
+def can_be_revoked_admin() -> ColumnElement[bool]:
+    return User.role_mask.op('&')(ADMIN_BIT) != 0
@@ -1,8 +1,10 @@
 import uuid
 from enum import Enum
+from typing import Iterable
 
-from sqlalchemy import Column, String, Integer, ForeignKey, Boolean
-from sqlalchemy.dialects.postgresql import UUID, ARRAY
+from sqlalchemy import (Column, String, Integer, SmallInteger, BigInteger, ForeignKey, Boolean, Index, Computed,
+                        LargeBinary, DateTime, func, text)
+from sqlalchemy.dialects.postgresql import UUID, TSVECTOR, DOUBLE_PRECISION
 from sqlalchemy.orm import relationship
 
 from backend.authentication.database import Base
@@ -13,46 +15,192 @@ class PortalRole(str, Enum):
     ROLE_PORTAL_ADMIN = "ROLE_PORTAL_ADMIN"
     ROLE_PORTAL_SUPERADMIN = "ROLE_PORTAL_SUPERADMIN"
 
+    @property
+    def bit(self) -> int:
+        return ROLE_BITS[self]
+
+
+# bit of each role in users.role_mask, stored: never renumber
+ROLE_BITS = {
+    PortalRole.ROLE_PORTAL_USER: 1,
+    PortalRole.ROLE_PORTAL_ADMIN: 2,
+    PortalRole.ROLE_PORTAL_SUPERADMIN: 4,
+}
+
+
+def role_mask(roles: Iterable[str]) -> int:
+    mask = 0
+    for role in roles:
+        mask |= ROLE_BITS[PortalRole(role)]
+    return mask
+
+
+def roles_of(mask: int) -> list[PortalRole]:
+    return [role for role, bit in ROLE_BITS.items() if mask & bit]
+
+
+def role_index_predicate(role: PortalRole) -> str:
+    # literal bit: the planner only uses a partial index for a query with the same predicate
+    return f'(role_mask & {role.bit}) <> 0'
+
 
 class User(Base):
     __tablename__ = 'users'
 
+    __table_args__ = (
+        # role filtered queries (`manager.has_role`) over the few privileged users
+        Index('ix_users_role_admin', 'id',
+              postgresql_where=text(role_index_predicate(PortalRole.ROLE_PORTAL_ADMIN))),
+        Index('ix_users_role_superadmin', 'id',
+              postgresql_where=text(role_index_predicate(PortalRole.ROLE_PORTAL_SUPERADMIN))),
+        # archival picks the users deactivated longest ago (backend/authentication/archive.py)
+        Index('ix_users_deactivated_at', 'deactivated_at', postgresql_where=text('deactivated_at IS NOT NULL')),
+    )
+
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
     username = Column(String, nullable=True, unique=True)
     email = Column(String, unique=True, nullable=False)
     hashed_password = Column(String)
     is_active = Column(Boolean(), nullable=True)
-    roles = Column(ARRAY(String), nullable=False)
+    # set when is_active is cleared, archived users were deactivated longer than ARCHIVE_RETENTION_DAYS ago
+    deactivated_at = Column(DateTime(timezone=True), nullable=True)
+    email_verified_at = Column(DateTime(timezone=True), nullable=True)
+    role_mask = Column(SmallInteger, nullable=False, default=1, server_default='1')
+    token_version = Column(Integer, nullable=False, default=0, server_default='0')
 
-    items = relationship("Item", back_populates="owner")
+    # lazy='raise': load items explicitly (ItemDAL), never one query per user
+    items = relationship("Item", back_populates="owner", lazy='raise')
+
+    @property
+    def roles(self) -> list[PortalRole]:
+        return roles_of(self.role_mask)
 
     @property
     def is_super_admin(self) -> bool:
-        return PortalRole.ROLE_PORTAL_SUPERADMIN in self.roles
+        return bool(self.role_mask & ROLE_BITS[PortalRole.ROLE_PORTAL_SUPERADMIN])
 
     @property
     def is_admin(self) -> bool:
-        return PortalRole.ROLE_PORTAL_ADMIN in self.roles
+        return bool(self.role_mask & ROLE_BITS[PortalRole.ROLE_PORTAL_ADMIN])
 
-    def add_admin_privilege(self):
-        if not self.is_admin:
-            return self.roles + [PortalRole.ROLE_PORTAL_ADMIN]
 
-    # def add_super_admin_privilege(self):
-    #    if not self.is_super_admin:
-    #        return self.roles + [PortalRole.ROLE_PORTAL_SUPERADMIN]
+# emails are unique regardless of case, and looked up as lower(email)
+Index('ux_users_email_lower', func.lower(User.email), unique=True)
+# auth lookups only ever want active users: these stay small however many users were soft-deleted
+Index('ix_users_active_email_lower', func.lower(User.email), postgresql_where=text('is_active'))
+# token_version included: the stateless token check is an index-only scan
+Index('ix_users_active_id', User.id, postgresql_include=['token_version'], postgresql_where=text('is_active'))
 
-    def remove_admin_privilege(self):
-        if self.is_admin:
-            return {role for role in self.roles if role != PortalRole.ROLE_PORTAL_ADMIN}
+
+ITEM_SEARCH_CONFIG = 'english'
+ITEM_SEARCH_VECTOR = (
+    f"setweight(to_tsvector('{ITEM_SEARCH_CONFIG}', coalesce(title, '')), 'A') || "
+    f"setweight(to_tsvector('{ITEM_SEARCH_CONFIG}', coalesce(content, '')), 'B')"
+)
 
 
 class Item(Base):
     __tablename__ = 'items'
 
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
-    content = Column(String, index=True)
-    owner_id = Column(UUID(as_uuid=True), ForeignKey('users.id'))
+    __table_args__ = (
+        # owner-scoped keyset listing: WHERE owner_id = :owner AND id > :after ORDER BY id
+        Index('ix_items_owner_id_id', 'owner_id', 'id'),
+        Index('ix_items_search_vector', 'search_vector', postgresql_using='gin'),
+        Index('ix_items_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}),
+    )
 
-    owner = relationship('User', back_populates='items')
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    content = Column(String)
+    owner_id = Column(UUID(as_uuid=True), ForeignKey('users.id'))
+    # maintained by Postgres from title / content, never written by the application
+    search_vector = Column(TSVECTOR, Computed(ITEM_SEARCH_VECTOR, persisted=True))
+
+    owner = relationship('User', back_populates='items', lazy='raise')
+
+
+class RateLimit(Base):
+    """
+    GCRA state of RATE_LIMIT_BACKEND=postgres, only written through the SQL in
+    backend.secure.ratelimit. Declared so autogenerate leaves the table alone.
+    """
+    __tablename__ = 'rate_limits'
+    # counters may be lost on a crash, no WAL for them
+    __table_args__ = {'prefixes': ['UNLOGGED']}
+
+    key = Column(LargeBinary, primary_key=True)
+    # theoretical arrival time, epoch seconds
+    tat = Column(DOUBLE_PRECISION, nullable=False)
+
+
+class RefreshToken(Base):
+    """one row per issued refresh token, the token itself is only known to the client"""
+    __tablename__ = 'refresh_tokens'
+
+    __table_args__ = (
+        Index('ix_refresh_tokens_family_id', 'family_id'),
+        Index('ix_refresh_tokens_user_id', 'user_id'),
+        Index('ix_refresh_tokens_expires_at', 'expires_at'),
+        # revocation filter rebuild only looks at the few revoked rows
+        Index('ix_refresh_tokens_revoked_at', 'revoked_at', postgresql_where=text('revoked_at IS NOT NULL')),
+    )
+
+    # sha256 of the opaque token
+    token_hash = Column(LargeBinary(32), primary_key=True)
+    # every token rotated from one login shares the family, so does the access token (fid claim)
+    family_id = Column(UUID(as_uuid=True), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    used = Column(Boolean, nullable=False, default=False, server_default='false')
+    revoked_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class UserArchive(Base):
+    """soft-deleted users moved out of users, no unique constraints: an email may be archived twice"""
+    __tablename__ = 'users_archive'
+
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    username = Column(String, nullable=True)
+    email = Column(String, nullable=False)
+    hashed_password = Column(String)
+    role_mask = Column(SmallInteger, nullable=False)
+    token_version = Column(Integer, nullable=False)
+    deactivated_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class ItemArchive(Base):
+    """items of archived users, search_vector is not kept"""
+    __tablename__ = 'items_archive'
+
+    __table_args__ = (
+        Index('ix_items_archive_owner_id', 'owner_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    content = Column(String)
+    owner_id = Column(UUID(as_uuid=True))
+    archived_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class EmailOutbox(Base):
+    """mail to send, written in the transaction that caused it and sent by backend.mail.dispatcher"""
+    __tablename__ = 'email_outbox'
+
+    __table_args__ = (
+        # the dispatcher claims due, unsent mail in send_after order
+        Index('ix_email_outbox_pending', 'send_after', postgresql_where=text('sent_at IS NULL')),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    kind = Column(String, nullable=False)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # not offered before, moved forward while claimed and on every retry
+    send_after = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    attempts = Column(Integer, nullable=False, default=0, server_default='0')
+    last_error = Column(String, nullable=True)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
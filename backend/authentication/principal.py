@@ -0,0 +1,50 @@
+from dataclasses import dataclass
+from uuid import UUID
+
+from .models import PortalRole, ROLE_BITS, role_mask, roles_of
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """authenticated user rebuilt from token claims, no database row behind it"""
+
+    id: UUID
+    email: str
+    username: str
+    role_mask: int
+    token_version: int
+    is_active: bool = True
+
+    @property
+    def roles(self) -> list[PortalRole]:
+        return roles_of(self.role_mask)
+
+    @property
+    def is_super_admin(self) -> bool:
+        return bool(self.role_mask & ROLE_BITS[PortalRole.ROLE_PORTAL_SUPERADMIN])
+
+    @property
+    def is_admin(self) -> bool:
+        return bool(self.role_mask & ROLE_BITS[PortalRole.ROLE_PORTAL_ADMIN])
+
+    @classmethod
+    def from_claims(cls, payload: dict) -> 'Principal':
+        return cls(
+            id=UUID(payload['uid']),
+            email=payload['sub'],
+            username=payload['name'],
+            # tokens issued before role_mask carry the role names
+            role_mask=role_mask(roles) if isinstance(roles := payload['roles'], list) else int(roles),
+            token_version=int(payload['ver']),
+        )
+
+
+def user_claims(user) -> dict:
+    """claims that let a token stand in for the users row in stateless mode"""
+    return {
+        'sub': user.email,
+        'uid': str(user.id),
+        'name': user.username,
+        'roles': user.role_mask,
+        'ver': user.token_version,
+    }
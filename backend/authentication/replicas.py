@@ -0,0 +1,183 @@
+"""
+Read replica selection and read-your-writes bookkeeping.
+
+Sessions from `read_session` pick their bind on first use: a healthy replica
+whose replay lag is within REPLICA_MAX_LAG_SECONDS, round robin, unless the
+current request already committed a write or its token subject wrote within
+the last READ_YOUR_WRITES_SECONDS on this worker; then, or when no replica is
+usable, the primary.
+
+    python -m backend.authentication.replicas
+prints the health and lag of every configured replica.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config import REPLICA_MAX_LAG_SECONDS, READ_YOUR_WRITES_SECONDS
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# seconds behind the primary, 0 when everything received has been replayed
+# (an idle primary would otherwise look like growing lag) or on a primary
+REPLICA_LAG = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 '
+    'WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+# token subject -> True for subjects that committed a write recently
+recent_writers = TTLCache(maxsize=100000, ttl=READ_YOUR_WRITES_SECONDS)
+
+# per request: {'subject': token subject or None, 'wrote': bool}
+_request_routing: ContextVar[Optional[dict]] = ContextVar('request_routing', default=None)
+
+
+def _routing_state() -> dict:
+    state = _request_routing.get()
+    if state is None:
+        state = {'subject': None, 'wrote': False}
+        _request_routing.set(state)
+    return state
+
+
+def set_request_subject(subject: str):
+    """remember who the current request acts for, called once the token is decoded"""
+    _routing_state()['subject'] = subject
+
+
+def note_write():
+    """the current request committed a write: keep it and its subject on the primary"""
+    state = _routing_state()
+    state['wrote'] = True
+    if state['subject'] is not None:
+        recent_writers.set(state['subject'], True)
+
+
+def prefers_primary() -> bool:
+    state = _request_routing.get()
+    if state is None:
+        return False
+    return state['wrote'] or (state['subject'] is not None and recent_writers.get(state['subject']) is not None)
+
+
+class Replica:
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        # unusable until the first check passed
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.reads = 0
+        event.listen(engine.sync_engine, 'handle_error', self._on_error)
+
+    def _on_error(self, exception_context):
+        if exception_context.is_disconnect:
+            # stop routing here right away, the next check decides when to come back
+            self.healthy = False
+            self.last_error = str(exception_context.original_exception)
+
+    async def _measure_lag(self) -> float:
+        async with self.engine.connect() as connection:
+            return float((await connection.execute(REPLICA_LAG)).scalar())
+
+    async def check(self, timeout: float):
+        try:
+            self.lag = await asyncio.wait_for(self._measure_lag(), timeout)
+            self.healthy = True
+            self.last_error = None
+        except Exception as err:
+            self.healthy = False
+            self.last_error = str(err) or type(err).__name__
+        self.checked_at = time.time()
+
+    @property
+    def usable(self) -> bool:
+        return self.healthy and self.lag is not None and self.lag <= REPLICA_MAX_LAG_SECONDS
+
+    def status(self) -> dict:
+        return {
+            'name': self.name,
+            'healthy': self.healthy,
+            'usable': self.usable,
+            'lag_seconds': self.lag,
+            'last_error': self.last_error,
+            'checked_at': self.checked_at,
+            'reads': self.reads,
+        }
+
+
+class ReplicaSet:
+    """replica engines with periodic health and lag checks"""
+
+    def __init__(self, replicas: list[Replica], check_interval: float, check_timeout: float):
+        self.replicas = replicas
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self._next = itertools.cycle(range(len(replicas))) if replicas else None
+        self._task: Optional[asyncio.Task] = None
+        self.primary_reads = 0
+
+    def choose(self) -> Optional[Replica]:
+        """next usable replica, None to read from the primary"""
+        if self._next is None or prefers_primary():
+            self.primary_reads += 1
+            return
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next)]
+            if replica.usable:
+                replica.reads += 1
+                return replica
+        self.primary_reads += 1
+
+    async def check(self):
+        await asyncio.gather(*(replica.check(self.check_timeout) for replica in self.replicas))
+        for replica in self.replicas:
+            if not replica.usable:
+                logger.warning('replica %s not used: lag %s, error %s', replica.name, replica.lag, replica.last_error)
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
+
+    async def start(self):
+        if self.replicas and self._task is None:
+            await self.check()
+            self._task = asyncio.create_task(self._monitor())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def status(self) -> dict:
+        return {
+            'max_lag_seconds': REPLICA_MAX_LAG_SECONDS,
+            'read_your_writes_seconds': READ_YOUR_WRITES_SECONDS,
+            'primary_reads': self.primary_reads,
+            'replicas': [replica.status() for replica in self.replicas],
+        }
+
+
+async def _main():
+    from .database import replica_set
+    await replica_set.check()
+    print(json.dumps(replica_set.status(), indent=2))
+    await replica_set.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(_main())
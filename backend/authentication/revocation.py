@@ -0,0 +1,169 @@
+"""
+Revoked refresh token families, checked on every authenticated request.
+
+Access tokens issued through login or refresh carry the family of their
+refresh token in the `fid` claim. Revoking the family (logout, or a rotated
+refresh token presented again) must also stop those access tokens, without
+a query per request: families revoked within the access token lifetime are
+kept in a Bloom filter. A miss is definitive. A hit may be a false positive
+(REVOCATION_FILTER_FP_RATE) and is confirmed against refresh_tokens once,
+then remembered until the next rebuild.
+
+Every worker rebuilds its filter from the table every
+REVOCATION_REFRESH_INTERVAL seconds, which drops families whose access
+tokens have expired since and picks up revocations made by other workers:
+those take up to one interval to apply here.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from typing import Iterable, Optional
+from uuid import UUID
+
+from config import (ACCESS_TOKEN_EXPIRE_MINUTES, REVOCATION_FILTER_CAPACITY, REVOCATION_FILTER_FP_RATE,
+                    REVOCATION_REFRESH_INTERVAL)
+from .database import async_session
+from .manager import RefreshTokenDAL
+
+logger = logging.getLogger(__name__)
+
+# expired refresh tokens are deleted once no access token of their family can be valid any more
+PURGE_INTERVAL = 3600
+
+
+class BloomFilter:
+    """fixed size set membership with false positives, never false negatives"""
+
+    def __init__(self, capacity: int, fp_rate: float):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(fp_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: bytes) -> Iterable[int]:
+        digest = hashlib.blake2b(value, digest_size=16).digest()
+        # double hashing: k positions from the two 64 bit halves of one digest
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value: bytes):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: bytes) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class RevocationFilter:
+    def __init__(self, capacity: int, fp_rate: float, refresh_interval: float):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.refresh_interval = refresh_interval
+        self._bloom = BloomFilter(capacity, fp_rate)
+        # family -> revoked, for filter hits confirmed against the table since the last rebuild
+        self._confirmed: dict[UUID, bool] = {}
+        # families added while sync() awaits the table, merged into what it read
+        self._added_during_sync: Optional[set[UUID]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._purged_at = time.monotonic()
+        self.checks = 0
+        self.hits = 0
+        self.false_positives = 0
+        self.rebuilt_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def add(self, family_id: UUID):
+        """a family revoked by this worker, effective here at once"""
+        if self._bloom.count >= self._bloom.capacity:
+            # past its capacity the false positive rate climbs, the next rebuild is sized up
+            self.capacity = 2 * self._bloom.capacity
+        self._bloom.add(family_id.bytes)
+        self._confirmed[family_id] = True
+        if self._added_during_sync is not None:
+            self._added_during_sync.add(family_id)
+
+    def check(self, family_id: UUID) -> Optional[bool]:
+        """False when not revoked, True when revoked, None when the table has to tell"""
+        self.checks += 1
+        if family_id.bytes not in self._bloom:
+            return False
+        self.hits += 1
+        return self._confirmed.get(family_id)
+
+    def confirm(self, family_id: UUID, revoked: bool):
+        if not revoked:
+            self.false_positives += 1
+        self._confirmed[family_id] = revoked
+
+    def rebuild(self, family_ids: list[UUID], revoked_here: Iterable[UUID] = ()):
+        """replace the filter, keeping families this worker revoked since the table was read"""
+        revoked_here = set(revoked_here)
+        bloom = BloomFilter(max(self.capacity, 2 * (len(family_ids) + len(revoked_here))), self.fp_rate)
+        for family_id in (*family_ids, *revoked_here):
+            bloom.add(family_id.bytes)
+        self._bloom = bloom
+        self._confirmed = dict.fromkeys(revoked_here, True)
+        self.rebuilt_at = time.time()
+
+    async def sync(self):
+        self._added_during_sync = set()
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    tokens = RefreshTokenDAL(session)
+                    family_ids = await tokens.revoked_families_since(ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+                    if time.monotonic() - self._purged_at > PURGE_INTERVAL:
+                        self._purged_at = time.monotonic()
+                        await tokens.purge_expired(grace_seconds=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+            self.rebuild(family_ids, self._added_during_sync)
+        finally:
+            self._added_during_sync = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.sync()
+                self.last_error = None
+            except Exception as err:
+                # keep the current filter, it only misses revocations made on other workers
+                self.last_error = str(err) or type(err).__name__
+                logger.warning('revocation filter rebuild failed: %r', err)
+
+    async def start(self):
+        if self._task is None:
+            await self.sync()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'revoked_families': self._bloom.count,
+            'capacity': self._bloom.capacity,
+            'bits': self._bloom.size,
+            'hashes': self._bloom.hashes,
+            'fp_rate': self.fp_rate,
+            'checks': self.checks,
+            'hits': self.hits,
+            'false_positives': self.false_positives,
+            'rebuilt_at': self.rebuilt_at,
+            'refresh_interval': self.refresh_interval,
+            'last_error': self.last_error,
+        }
+
+
+revocation_filter = RevocationFilter(
+    capacity=REVOCATION_FILTER_CAPACITY,
+    fp_rate=REVOCATION_FILTER_FP_RATE,
+    refresh_interval=REVOCATION_REFRESH_INTERVAL,
+)
@@ -1,67 +1,175 @@
+import datetime
+import uuid
 from datetime import timedelta
-from typing import Union
+from typing import Literal, Optional, Union
 from uuid import UUID
 
-import jwt
-from fastapi import APIRouter, Depends, HTTPException, status
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from fastapi.logger import logger
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from jose import JWTError
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import Row
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from backend.secure import hash_password, create_access_token
-from config import ACCESS_TOKEN_EXPIRE_MINUTES, SECRET_TOKEN, ALGORITHM
-from .base_config import _create_new_user, _delete_user, _get_user_by_id, _update_user, _get_user_by_email_for_auth
-from .database import get_db
-from .manager import check_user_permission
-from .models import User
+from backend.mail.dispatcher import dispatcher
+from backend.mail.messages import VERIFY, RESET
+from backend.secure import (password_hasher, create_access_token, decode_access_token, new_refresh_token,
+                            hash_refresh_token, decode_link_token)
+from backend.secure.ratelimit import Limit, rate_limiter
+from backend.serialization import orm_response
+from config import (ACCESS_TOKEN_EXPIRE_MINUTES, JWT_STATELESS, USER_LIST_MAX_LIMIT, USER_STREAM_BATCH_SIZE,
+                    LOGIN_LIMIT_PER_IP, LOGIN_LIMIT_PER_ACCOUNT, SIGNUP_LIMIT_PER_IP, REFRESH_TOKEN_EXPIRE_DAYS,
+                    PASSWORD_RESET_LIMIT_PER_IP, PASSWORD_RESET_LIMIT_PER_ACCOUNT)
+from .base_config import (_create_new_user, _get_user_by_id, _update_user, _update_user_if,
+                          _get_user_by_email_for_auth, _get_token_version, _list_users, _stream_users,
+                          _create_refresh_token, _rotate_refresh_token, _revoke_refresh_family, _is_family_revoked,
+                          _verify_email, _enqueue_password_reset, _reset_password)
+from .bulk_import import ImportReport, import_users, import_jobs
+from .cache import principal_cache, token_version_cache
+from .database import get_db, get_read_db
+from .manager import (user_permission_clause, grant_admin_values, revoke_admin_values,
+                      can_be_granted_admin, can_be_revoked_admin, is_privileged, deactivate_values)
+from .models import User, PortalRole
+from .principal import Principal, user_claims
+from .replicas import set_request_subject
+from .revocation import revocation_filter
 from .schemas import (ShowUser, UserCreate, DeleteUser,
-                      UpdateUserRequest, UpdatedUserResponse, Token)
+                      UpdateUserRequest, UpdatedUserResponse, Token, RefreshRequest, ImportResult, UserPage,
+                      PasswordForgotRequest, PasswordResetRequest)
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/user/token')
 
+login_limit_per_ip = Limit.parse(LOGIN_LIMIT_PER_IP)
+login_limit_per_account = Limit.parse(LOGIN_LIMIT_PER_ACCOUNT)
+signup_limit_per_ip = Limit.parse(SIGNUP_LIMIT_PER_IP)
+password_reset_limit_per_ip = Limit.parse(PASSWORD_RESET_LIMIT_PER_IP)
+password_reset_limit_per_account = Limit.parse(PASSWORD_RESET_LIMIT_PER_ACCOUNT)
+
+
+def _client_ip(request: Request) -> str:
+    return request.client.host if request.client else 'unknown'
+
+
+async def limit_login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    """429 over the per IP / per account login limits, 503 when hashing is saturated"""
+    await rate_limiter.hit('login:ip', _client_ip(request), login_limit_per_ip)
+    await rate_limiter.hit('login:account', form_data.username.strip().lower(), login_limit_per_account)
+    password_hasher.admit()
+
+
+async def limit_signup(request: Request):
+    await rate_limiter.hit('signup:ip', _client_ip(request), signup_limit_per_ip)
+    password_hasher.admit()
+
 
 async def get_current_user_from_token(
-        token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+        token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)
 ):
     cred_exceptions = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Could not validate'
     )
     try:
-        payload = jwt.decode(
-            token, SECRET_TOKEN, algorithms=[ALGORITHM]
-        )
+        payload = decode_access_token(token)
         email: str = payload.get('sub')
-        print('username/email extracted is', email)
-        if email is None:
+        # mailed link tokens are signed with the same key, they are no access tokens
+        if email is None or 'purpose' in payload:
             raise cred_exceptions
     except JWTError:
         raise cred_exceptions
-    user = await _get_user_by_email_for_auth(email=email, db=db)
+    if 'fid' in payload:
+        await _check_family_not_revoked(payload['fid'], db, cred_exceptions)
+    set_request_subject(email)
+    if JWT_STATELESS and 'uid' in payload:
+        return await _get_principal_from_claims(payload, db, cred_exceptions)
+    user = principal_cache.get(email)
     if user is None:
-        raise cred_exceptions
+        # a change committed while the row is loaded must not be undone by caching it
+        since = principal_cache.generation()
+        user = await _get_user_by_email_for_auth(email=email, db=db)
+        if user is None or not user.is_active:
+            raise cred_exceptions
+        principal_cache.set(email, user, since)
     return user
 
 
+async def _check_family_not_revoked(family_id: str, db: AsyncSession, cred_exceptions: HTTPException):
+    """no query unless the revocation filter reports the family, once per rebuild"""
+    try:
+        family_id = uuid.UUID(family_id)
+    except (TypeError, ValueError):
+        raise cred_exceptions
+    revoked = revocation_filter.check(family_id)
+    if revoked is None:
+        revoked = await _is_family_revoked(family_id, db)
+        revocation_filter.confirm(family_id, revoked)
+    if revoked:
+        raise cred_exceptions
+
+
+async def _get_principal_from_claims(payload: dict, db: AsyncSession, cred_exceptions: HTTPException) -> Principal:
+    try:
+        principal = Principal.from_claims(payload)
+    except (KeyError, TypeError, ValueError):
+        raise cred_exceptions
+    current_version = token_version_cache.get(principal.id)
+    if current_version is None:
+        since = token_version_cache.generation()
+        current_version = await _get_token_version(principal.id, db)
+        if current_version is None:
+            current_version = -1
+        token_version_cache.set(principal.id, current_version, since)
+    if current_version != principal.token_version:
+        raise cred_exceptions
+    return principal
+
+
+async def get_current_admin(current_user: User = Depends(get_current_user_from_token)) -> User:
+    if not is_privileged(current_user):
+        raise HTTPException(status_code=403, detail='Forbidden')
+    return current_user
+
+
+def _mutation_result(result: Union[Row, None], user_id: UUID, conflict_detail: str) -> UUID:
+    """map the outcome of a conditional update onto 404 / 403 / 409"""
+    if result is None:
+        raise HTTPException(status_code=404, detail=f'User with id {user_id} not found')
+    if not result.allowed:
+        raise HTTPException(status_code=403, detail='Forbidden')
+    if not result.applicable or result.updated_user_id is None:
+        raise HTTPException(status_code=409, detail=conflict_detail)
+    return result.updated_user_id
+
+
 async def authenticate_user(email: str, password: str, db: AsyncSession) -> Union[User, None]:
     user = await _get_user_by_email_for_auth(email=email, db=db)
     if user is None:
         return
-    if not hash_password(password):
+    verified, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not verified:
         return
+    if new_hash is not None:
+        # stored hash predates the calibrated cost, upgrade it while we know the password
+        try:
+            await _update_user(user_id=user.id, body={'hashed_password': new_hash}, db=db)
+        except SQLAlchemyError as err:
+            logger.error(err)
     return user
 
 
-@router.post("/", response_model=ShowUser)
+@router.post("/", response_model=ShowUser, dependencies=[Depends(limit_signup)])
 async def create_user(body: UserCreate, db: AsyncSession = Depends(get_db)) -> ShowUser:
     try:
-        return await _create_new_user(body, db)
+        user = await _create_new_user(body, db)
     except IntegrityError as err:
         logger.error(err)
         raise HTTPException(status_code=503, detail=f"Database error: {err}")
+    dispatcher.wake()
+    return orm_response(ShowUser, user)
 
 
 @router.delete('/', response_model=DeleteUser)
@@ -70,37 +178,23 @@ async def delete_user(
         db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_user_from_token)
 ):
-    user_for_deletion = await _get_user_by_id(user_id, db)
-    if user_for_deletion is None:
-        raise HTTPException(
-            status_code=404, detail=f'User with id {user_id} not found'
-        )
-    if not check_user_permission(
-            target_user=user_for_deletion,
-            current_user=current_user
-    ):
-        raise HTTPException(status_code=403, detail='Forbidden')
-
-    deleted_user_id = await _delete_user(user_id, db)
-    if deleted_user_id is None:
-        raise HTTPException(status_code=404, detail=f'{user_id} not found')
+    result = await _update_user_if(
+        user_id=user_id,
+        values=deactivate_values(),
+        session=db,
+        allowed=user_permission_clause(current_user),
+    )
+    deleted_user_id = _mutation_result(result, user_id, conflict_detail=f'User with id {user_id} changed concurrently')
     return DeleteUser(deleted_user_id=deleted_user_id)
 
 
 @router.get('/', response_model=ShowUser)
-async def get_user_by_id(user_id: UUID, db: AsyncSession = Depends(get_db),
+async def get_user_by_id(user_id: UUID, db: AsyncSession = Depends(get_read_db),
                          current_user: User = Depends(get_current_user_from_token)) -> ShowUser:
     user = await _get_user_by_id(user_id, db)
     if user is None:
         raise HTTPException(status_code=404, detail=f'User with {user_id} not found')
-    show_user = ShowUser(
-        user_id=user.id,
-        username=user.username,
-        email=user.email,
-        is_active=user.is_active
-    )
-
-    return show_user
+    return orm_response(ShowUser, user)
 
 
 @router.patch("/", response_model=UpdatedUserResponse)
@@ -116,27 +210,22 @@ async def update_user_by_id(
             status_code=422,
             detail="At least one parameter for user update info should be provided",
         )
-    user_for_update = await _get_user_by_id(user_id, db)
-    if user_for_update is None:
-        raise HTTPException(
-            status_code=404, detail=f"User with id {user_id} not found."
-        )
-    if not check_user_permission(
-            target_user=user_for_update,
-            current_user=current_user
-    ):
-        raise HTTPException(status_code=403, detail='Forbidden')
     try:
-        updated_user_id = await _update_user(user_id=user_id, body=body, db=db)
-
+        result = await _update_user_if(
+            user_id=user_id,
+            values=updated_user_params,
+            session=db,
+            allowed=user_permission_clause(current_user),
+        )
     except IntegrityError as err:
         logger.error(err)
         raise HTTPException(status_code=503, detail=f"Database error: {err}")
+    updated_user_id = _mutation_result(result, user_id, conflict_detail=f'User with id {user_id} changed concurrently')
     return UpdatedUserResponse(updated_user_id=updated_user_id)
 
 
 # updated_user_id = await _update_user(user_id=user_id, body=body, db=db)
-@router.post('/token', response_model=Token)
+@router.post('/token', response_model=Token, dependencies=[Depends(limit_login)])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
@@ -144,22 +233,101 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Incorrect username or password'
         )
+    family_id = uuid.uuid4()
+    refresh_token, refresh_token_hash = new_refresh_token()
+    await _create_refresh_token(refresh_token_hash, family_id, user.id, _refresh_token_expiry(), db)
+    return _token_response(user, family_id, refresh_token)
+
+
+def _refresh_token_expiry() -> datetime.datetime:
+    return datetime.datetime.now(datetime.UTC) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+
+
+def _token_response(user, family_id: uuid.UUID, refresh_token: str) -> dict:
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={'sub': user.email, 'custom': [1, 2, 3, 4]}, expires_delta=access_token_expires
+        data={**user_claims(user), 'fid': str(family_id)}, expires_delta=access_token_expires
     )
-    return {'access_token': access_token, 'token_type': 'bearer'}
+    return {'access_token': access_token, 'token_type': 'bearer', 'refresh_token': refresh_token}
+
+
+@router.post('/token/refresh', response_model=Token)
+async def refresh_access_token(body: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Trade a refresh token for a new access token and refresh token, no password
+    check. Each refresh token works once: presenting one again revokes every
+    token of its login, including access tokens issued from it.
+    """
+    cred_exceptions = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail='Invalid refresh token'
+    )
+    token_hash = hash_refresh_token(body.refresh_token)
+    refresh_token, refresh_token_hash = new_refresh_token()
+    rotated = await _rotate_refresh_token(token_hash, refresh_token_hash, _refresh_token_expiry(), db)
+    if rotated is None:
+        reused_family_id = await _revoke_refresh_family(token_hash, db, only_used=True)
+        if reused_family_id is not None:
+            logger.warning('refresh token of family %s reused, family revoked', reused_family_id)
+            revocation_filter.add(reused_family_id)
+        raise cred_exceptions
+    user, family_id = rotated
+    return _token_response(user, family_id, refresh_token)
+
+
+@router.post('/token/revoke', status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_refresh_token(body: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    """log out: revoke the refresh token and every token issued along with it"""
+    family_id = await _revoke_refresh_family(hash_refresh_token(body.refresh_token), db)
+    if family_id is not None:
+        revocation_filter.add(family_id)
+
+
+@router.get('/verify')
+async def verify_email(token: str, db: AsyncSession = Depends(get_db)):
+    """target of the link in the signup mail"""
+    invalid = HTTPException(status_code=400, detail='Invalid or expired verification link')
+    try:
+        payload = decode_link_token(token, VERIFY)
+        user_id, email = UUID(payload['uid']), payload['email']
+    except (JWTError, KeyError, TypeError, ValueError):
+        raise invalid
+    if await _verify_email(user_id, email, db) is None:
+        raise invalid
+    return {'verified': True}
+
+
+@router.post('/password/forgot', status_code=status.HTTP_202_ACCEPTED)
+async def forgot_password(request: Request, body: PasswordForgotRequest, db: AsyncSession = Depends(get_db)):
+    """mail a reset link, answers the same whether the address is registered or not"""
+    await rate_limiter.hit('reset:ip', _client_ip(request), password_reset_limit_per_ip)
+    await rate_limiter.hit('reset:account', body.email.strip().lower(), password_reset_limit_per_account)
+    if await _enqueue_password_reset(body.email, db):
+        dispatcher.wake()
+
+
+@router.post('/password/reset', status_code=status.HTTP_204_NO_CONTENT)
+async def reset_password(body: PasswordResetRequest, db: AsyncSession = Depends(get_db)):
+    """set a new password with a reset link, which then stops working along with every session of the user"""
+    invalid = HTTPException(status_code=400, detail='Invalid, expired or used reset link')
+    try:
+        payload = decode_link_token(body.token, RESET)
+        user_id, token_version = UUID(payload['uid']), int(payload['ver'])
+    except (JWTError, KeyError, TypeError, ValueError):
+        raise invalid
+    password_hasher.admit()
+    hashed_password = await password_hasher.hash(body.password)
+    family_ids = await _reset_password(user_id, token_version, hashed_password, db)
+    if family_ids is None:
+        raise invalid
+    for family_id in family_ids:
+        revocation_filter.add(family_id)
 
 
 @router.get('/auth_endpoint')
 async def under_jwt(current_user: User = Depends(get_current_user_from_token)):
-    user_response = ShowUser(
-        email=current_user.email,
-        is_active=current_user.is_active,
-        username=current_user.username,
-        user_id=current_user.id
-    )
-    return {'success': True, 'current_user': user_response}
+    user_response = ShowUser.model_validate(current_user)
+    return ORJSONResponse({'success': True, 'current_user': user_response.model_dump()})
 
 
 @router.patch('/admin', response_model=UpdatedUserResponse)
@@ -175,26 +343,19 @@ async def grant_admin(
         raise HTTPException(
             status_code=400, detail='Cannot manage to itself'
         )
-    user_for_promotion = await _get_user_by_id(user_id, db)
-    if user_for_promotion.is_super_admin or user_for_promotion.is_admin:
-        raise HTTPException(
-            status_code=409, detail=f'User with id {user_id} is already admin / super_admin'
-        )
-    if user_for_promotion is None:
-        raise HTTPException(
-            status_code=404, detail=f'User with {user_id} not found'
-        )
-    updated_user = {
-        'roles': {*user_for_promotion.add_admin_privilege()}
-    }
     try:
-        updated_user_id = await _update_user(
-            user_id=user_id, body=updated_user, db=db
+        result = await _update_user_if(
+            user_id=user_id,
+            values=grant_admin_values(),
+            session=db,
+            applicable=can_be_granted_admin(),
         )
     except IntegrityError as err:
         logger.error(err)
         raise HTTPException(status_code=503, detail=f'Database error: {err}')
-
+    updated_user_id = _mutation_result(
+        result, user_id, conflict_detail=f'User with id {user_id} is already admin / super_admin'
+    )
     return UpdatedUserResponse(updated_user_id=updated_user_id)
 
 
@@ -211,24 +372,79 @@ async def revoke_admin(
         raise HTTPException(
             status_code=400, detail='Cannot delete yourself'
         )
-    user_for_delete = await _get_user_by_id(user_id, db)
-    if not user_for_delete.is_admin:
-        raise HTTPException(
-            status_code=409, detail=f'User with id {user_id} has not admin privilege'
-        )
-    if user_for_delete is None:
-        raise HTTPException(
-            status_code=404, detail=f'User with {user_id} not found'
-        )
-    updated_user = {
-        'roles': user_for_delete.remove_admin_privilege()
-    }
     try:
-        updated_user_id = await _update_user(
-            user_id=user_id, body=updated_user, db=db
+        result = await _update_user_if(
+            user_id=user_id,
+            values=revoke_admin_values(),
+            session=db,
+            applicable=can_be_revoked_admin(),
         )
     except IntegrityError as err:
         logger.error(err)
         raise HTTPException(status_code=503, detail=f'Database error: {err}')
-
+    updated_user_id = _mutation_result(
+        result, user_id, conflict_detail=f'User with id {user_id} has not admin privilege'
+    )
     return UpdatedUserResponse(updated_user_id=updated_user_id)
+
+
+@router.post('/import', response_model=ImportResult)
+async def bulk_import_users(
+        request: Request,
+        format: Optional[Literal['ndjson', 'csv']] = None,
+        job_id: Optional[str] = None,
+        current_user: User = Depends(get_current_admin),
+):
+    """pass your own job_id to follow progress on GET /user/import/{job_id} while the upload runs"""
+    if format is None:
+        format = 'csv' if request.headers.get('content-type', '').startswith('text/csv') else 'ndjson'
+    report = ImportReport(job_id=job_id)
+    try:
+        await import_users(request.stream(), format, report=report)
+    except SQLAlchemyError as err:
+        logger.error(err)
+        raise HTTPException(status_code=503, detail=f'Database error: {err}')
+    return report.as_dict()
+
+
+@router.get('/import/{job_id}', response_model=ImportResult)
+async def bulk_import_progress(job_id: str, current_user: User = Depends(get_current_admin)):
+    report = import_jobs.get(job_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f'Import {job_id} not found')
+    return report.as_dict()
+
+
+async def _ndjson_users(filters: dict):
+    async for row in _stream_users(filters, batch_size=USER_STREAM_BATCH_SIZE):
+        yield orjson.dumps({
+            'user_id': row.id, 'username': row.username, 'email': row.email, 'is_active': row.is_active,
+        }) + b'\n'
+
+
+@router.get('/list', response_model=UserPage)
+async def list_users(
+        order_by: Literal['id', 'email'] = 'id',
+        after: Optional[str] = None,
+        limit: int = Query(100, ge=1, le=USER_LIST_MAX_LIMIT),
+        is_active: Optional[bool] = None,
+        role: Optional[PortalRole] = None,
+        stream: bool = False,
+        db: AsyncSession = Depends(get_read_db),
+        current_user: User = Depends(get_current_admin),
+):
+    """
+    Keyset pagination: pass next_cursor back as `after` to get the following page.
+    With stream=true every matching user is sent as NDJSON, `limit` is ignored.
+    """
+    if after is not None and order_by == 'id':
+        try:
+            UUID(after)
+        except ValueError:
+            raise HTTPException(status_code=422, detail='after must be a user id when ordering by id')
+    filters = {'order_by': order_by, 'after': after, 'is_active': is_active, 'role': role}
+    if stream:
+        return StreamingResponse(_ndjson_users(filters), media_type='application/x-ndjson')
+    rows = await _list_users(limit, filters, db)
+    next_cursor = str(getattr(rows[-1], order_by)) if len(rows) == limit else None
+    return orm_response(UserPage, {'items': rows, 'next_cursor': next_cursor})
@@ -1,23 +1,27 @@
 import uuid
 from typing import Optional
 
-from pydantic import BaseModel, EmailStr, constr, validator
+from pydantic import BaseModel, EmailStr, constr, validator, ConfigDict, Field, AliasChoices
 
 
 class TunedModel(BaseModel):
-    class Config:
-        """pydantic convert to json"""
+    """pydantic convert to json, readable straight from ORM objects and rows"""
 
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ShowUser(TunedModel):
-    user_id: uuid.UUID
+    user_id: uuid.UUID = Field(validation_alias=AliasChoices('user_id', 'id'))
     username: str
     email: EmailStr
     is_active: Optional[bool] = True
 
 
+class UserPage(TunedModel):
+    items: list[ShowUser]
+    next_cursor: Optional[str] = None
+
+
 class UserCreate(BaseModel):
     username: str
     email: EmailStr
@@ -56,3 +60,36 @@ class UpdatedUserResponse(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
+class PasswordForgotRequest(BaseModel):
+    email: EmailStr
+
+
+class PasswordResetRequest(BaseModel):
+    token: str
+    password: str
+
+
+class RejectedRow(BaseModel):
+    line: int
+    reason: str
+    username: Optional[str] = None
+    email: Optional[str] = None
+
+
+class ImportResult(BaseModel):
+    job_id: str
+    finished: bool
+    error: Optional[str] = None
+    rows_read: int
+    imported: int
+    rejected: int
+    elapsed_seconds: float
+    rows_per_second: float
+    rejected_rows: list[RejectedRow]
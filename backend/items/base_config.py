@@ -0,0 +1,69 @@
+from typing import Optional, Union
+from uuid import UUID
+
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .manager import ItemDAL
+
+
+async def _create_items(owner_id: UUID, items: list[dict], session: AsyncSession) -> list[Row]:
+    async with session.begin():
+        item_dal = ItemDAL(session)
+        return await item_dal.create_items(
+            owner_id=owner_id,
+            items=items,
+        )
+
+
+async def _list_items(owner_id: UUID, limit: int, after: Optional[int], session: AsyncSession) -> list[Row]:
+    async with session.begin():
+        item_dal = ItemDAL(session)
+        return await item_dal.list_items(
+            owner_id=owner_id,
+            limit=limit,
+            after=after,
+        )
+
+
+async def _get_item(item_id: int, owner_id: Optional[UUID], session: AsyncSession) -> Union[Row, None]:
+    async with session.begin():
+        item_dal = ItemDAL(session)
+        return await item_dal.get_item(
+            item_id=item_id,
+            owner_id=owner_id,
+        )
+
+
+async def _update_item(item_id: int, owner_id: Optional[UUID], body: dict, session: AsyncSession) -> Union[Row, None]:
+    async with session.begin():
+        item_dal = ItemDAL(session)
+        return await item_dal.update_item(
+            item_id=item_id,
+            owner_id=owner_id,
+            **body
+        )
+
+
+async def _delete_items(item_ids: list[int], owner_id: Optional[UUID], session: AsyncSession) -> list[int]:
+    async with session.begin():
+        item_dal = ItemDAL(session)
+        return await item_dal.delete_items(
+            item_ids=item_ids,
+            owner_id=owner_id,
+        )
+
+
+async def _search_items(
+        q: str, mode: str, limit: int, owner_id: Optional[UUID], after: Optional[tuple[float, int]],
+        session: AsyncSession,
+) -> list[Row]:
+    async with session.begin():
+        item_dal = ItemDAL(session)
+        return await item_dal.search_items(
+            q=q,
+            mode=mode,
+            limit=limit,
+            owner_id=owner_id,
+            after=after,
+        )
@@ -0,0 +1,97 @@
+from typing import Optional, Union
+from uuid import UUID
+
+from sqlalchemy import select, insert, update, delete, and_, Row, func, cast, tuple_, REAL
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.authentication.models import Item, ITEM_SEARCH_CONFIG
+from backend.observability.sql import label_statements
+
+# columns only: rows never go through the ORM identity map or the User relationship
+ITEM_COLUMNS = (Item.id, Item.title, Item.content, Item.owner_id)
+
+
+def _item_filter(item_id: int, owner_id: Optional[UUID]):
+    """owner_id None means unrestricted (admins)"""
+    if owner_id is None:
+        return Item.id == item_id
+    return and_(Item.id == item_id, Item.owner_id == owner_id)
+
+
+@label_statements
+class ItemDAL:
+    """data access for items"""
+
+    def __init__(self, db_session: AsyncSession):
+        self.db_session = db_session
+
+    async def create_items(self, owner_id: UUID, items: list[dict]) -> list[Row]:
+        query = (
+            insert(Item)
+            .values([{**item, 'owner_id': owner_id} for item in items])
+            .returning(*ITEM_COLUMNS)
+        )
+        res = await self.db_session.execute(query)
+        return res.fetchall()
+
+    async def list_items(self, owner_id: UUID, limit: int, after: Optional[int] = None) -> list[Row]:
+        """keyset page served by ix_items_owner_id_id"""
+        query = select(*ITEM_COLUMNS).where(Item.owner_id == owner_id)
+        if after is not None:
+            query = query.where(Item.id > after)
+        res = await self.db_session.execute(query.order_by(Item.id).limit(limit))
+        return res.fetchall()
+
+    async def get_item(self, item_id: int, owner_id: Optional[UUID] = None) -> Union[Row, None]:
+        query = select(*ITEM_COLUMNS).where(_item_filter(item_id, owner_id))
+        res = await self.db_session.execute(query)
+        return res.fetchone()
+
+    async def update_item(self, item_id: int, owner_id: Optional[UUID] = None, **kwargs) -> Union[Row, None]:
+        query = (
+            update(Item)
+            .where(_item_filter(item_id, owner_id))
+            .values(kwargs)
+            .returning(*ITEM_COLUMNS)
+        )
+        res = await self.db_session.execute(query)
+        return res.fetchone()
+
+    async def delete_items(self, item_ids: list[int], owner_id: Optional[UUID] = None) -> list[int]:
+        query = delete(Item).where(Item.id.in_(item_ids))
+        if owner_id is not None:
+            query = query.where(Item.owner_id == owner_id)
+        res = await self.db_session.execute(query.returning(Item.id))
+        return [row[0] for row in res.fetchall()]
+
+    async def search_items(
+            self,
+            q: str,
+            mode: str,
+            limit: int,
+            owner_id: Optional[UUID] = None,
+            after: Optional[tuple[float, int]] = None,
+    ) -> list[Row]:
+        """
+        Ranked matches, best first. `fulltext` matches the GIN-indexed search_vector,
+        `fuzzy` the trigram index on title. `after` is the (rank, id) of the last hit
+        of the previous page.
+        """
+        if mode == 'fulltext':
+            tsquery = func.websearch_to_tsquery(ITEM_SEARCH_CONFIG, q)
+            rank = func.ts_rank_cd(Item.search_vector, tsquery)
+            match = Item.search_vector.op('@@')(tsquery)
+        else:
+            rank = func.similarity(Item.title, q)
+            match = Item.title.op('%')(q)
+        query = select(*ITEM_COLUMNS, rank.label('rank')).where(match)
+        if owner_id is not None:
+            query = query.where(Item.owner_id == owner_id)
+        if after is not None:
+            after_rank, after_id = after
+            # ranks are float4 in Postgres, compare against the same type
+            query = query.where(tuple_(rank, Item.id) < tuple_(cast(after_rank, REAL), after_id))
+        res = await self.db_session.execute(
+            query.order_by(rank.desc(), Item.id.desc()).limit(limit)
+        )
+        return res.fetchall()
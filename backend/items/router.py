@@ -0,0 +1,128 @@
+from typing import Literal, Optional, Union
+from uuid import UUID
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.authentication.database import get_db, get_read_db
+from backend.authentication.manager import is_privileged
+from backend.authentication.models import User
+from backend.authentication.router import get_current_user_from_token
+from backend.serialization import orm_response, orm_list_response
+from config import ITEMS_BATCH_MAX, ITEMS_LIST_MAX_LIMIT, ITEMS_SEARCH_MAX_LIMIT
+from .base_config import _create_items, _list_items, _get_item, _update_item, _delete_items, _search_items
+from .schemas import ItemCreate, UpdateItemRequest, ShowItem, ItemPage, DeletedItems, ItemSearchPage
+
+router = APIRouter()
+
+
+def _owner_scope(current_user: User) -> Union[UUID, None]:
+    """admins act on every item, everybody else only on their own"""
+    if is_privileged(current_user):
+        return None
+    return current_user.id
+
+
+@router.post('/', response_model=list[ShowItem])
+async def create_items(
+        body: list[ItemCreate] = Body(..., min_length=1, max_length=ITEMS_BATCH_MAX),
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_user_from_token),
+) -> list[ShowItem]:
+    rows = await _create_items(current_user.id, [item.model_dump() for item in body], db)
+    return orm_list_response(ShowItem, rows)
+
+
+@router.get('/', response_model=ItemPage)
+async def list_items(
+        owner_id: Optional[UUID] = None,
+        after: Optional[int] = None,
+        limit: int = Query(100, ge=1, le=ITEMS_LIST_MAX_LIMIT),
+        db: AsyncSession = Depends(get_read_db),
+        current_user: User = Depends(get_current_user_from_token),
+) -> ItemPage:
+    """items of one owner (yourself by default), pass next_cursor back as `after`"""
+    if owner_id is None:
+        owner_id = current_user.id
+    elif owner_id != current_user.id and _owner_scope(current_user) is not None:
+        raise HTTPException(status_code=403, detail='Forbidden')
+    rows = await _list_items(owner_id, limit, after, db)
+    return orm_response(ItemPage, {'items': rows, 'next_cursor': rows[-1].id if len(rows) == limit else None})
+
+
+@router.delete('/', response_model=DeletedItems)
+async def delete_items(
+        item_ids: list[int] = Query(..., min_length=1, max_length=ITEMS_BATCH_MAX),
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_user_from_token),
+) -> DeletedItems:
+    """ids that do not exist or belong to somebody else are skipped"""
+    deleted_item_ids = await _delete_items(item_ids, _owner_scope(current_user), db)
+    return DeletedItems(deleted_item_ids=deleted_item_ids)
+
+
+def _parse_search_cursor(after: str) -> tuple[float, int]:
+    try:
+        rank, item_id = after.split(':')
+        return float(rank), int(item_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail='Malformed search cursor')
+
+
+@router.get('/search', response_model=ItemSearchPage)
+async def search_items(
+        q: str = Query(..., min_length=1),
+        mode: Literal['fulltext', 'fuzzy'] = 'fulltext',
+        owner_id: Optional[UUID] = None,
+        after: Optional[str] = None,
+        limit: int = Query(20, ge=1, le=ITEMS_SEARCH_MAX_LIMIT),
+        db: AsyncSession = Depends(get_read_db),
+        current_user: User = Depends(get_current_user_from_token),
+) -> ItemSearchPage:
+    """
+    `fulltext` ranks title / content keyword matches (web search syntax),
+    `fuzzy` ranks titles by trigram similarity. Pass next_cursor back as `after`.
+    Admins search every owner unless owner_id is given.
+    """
+    scope = _owner_scope(current_user)
+    if scope is not None:
+        if owner_id is not None and owner_id != scope:
+            raise HTTPException(status_code=403, detail='Forbidden')
+        owner_id = scope
+    cursor = _parse_search_cursor(after) if after is not None else None
+    rows = await _search_items(q, mode, limit, owner_id, cursor, db)
+    return orm_response(ItemSearchPage, {
+        'items': rows,
+        'next_cursor': f'{rows[-1].rank!r}:{rows[-1].id}' if len(rows) == limit else None,
+    })
+
+
+@router.get('/{item_id}', response_model=ShowItem)
+async def get_item(
+        item_id: int,
+        db: AsyncSession = Depends(get_read_db),
+        current_user: User = Depends(get_current_user_from_token),
+) -> ShowItem:
+    row = await _get_item(item_id, _owner_scope(current_user), db)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f'Item with id {item_id} not found')
+    return orm_response(ShowItem, row)
+
+
+@router.patch('/{item_id}', response_model=ShowItem)
+async def update_item(
+        item_id: int,
+        body: UpdateItemRequest,
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_user_from_token),
+) -> ShowItem:
+    updated_item_params = body.model_dump(exclude_none=True)
+    if not updated_item_params:
+        raise HTTPException(
+            status_code=422,
+            detail='At least one parameter for item update info should be provided',
+        )
+    row = await _update_item(item_id, _owner_scope(current_user), updated_item_params, db)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f'Item with id {item_id} not found')
+    return orm_response(ShowItem, row)
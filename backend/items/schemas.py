@@ -0,0 +1,41 @@
+import uuid
+from typing import Optional
+
+from pydantic import BaseModel, constr, Field, AliasChoices
+
+from backend.authentication.schemas import TunedModel
+
+
+class ItemCreate(BaseModel):
+    title: constr(min_length=1)
+    content: Optional[str] = None
+
+
+class UpdateItemRequest(BaseModel):
+    title: Optional[constr(min_length=1)] = None
+    content: Optional[str] = None
+
+
+class ShowItem(TunedModel):
+    item_id: int = Field(validation_alias=AliasChoices('item_id', 'id'))
+    title: Optional[str] = None
+    content: Optional[str] = None
+    owner_id: uuid.UUID
+
+
+class ItemPage(TunedModel):
+    items: list[ShowItem]
+    next_cursor: Optional[int] = None
+
+
+class DeletedItems(BaseModel):
+    deleted_item_ids: list[int]
+
+
+class ItemSearchHit(ShowItem):
+    rank: float
+
+
+class ItemSearchPage(TunedModel):
+    items: list[ItemSearchHit]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,147 @@
+"""
+Gunicorn launcher for backend.main:app.
+
+    python -m backend.launcher                 # serve
+    python -m backend.launcher --print-config  # show the resolved settings and exit
+
+Every setting comes from WEB_* variables in config.py. Without WEB_WORKERS the
+worker count is WEB_WORKERS_PER_CPU times the CPUs this process may actually
+use: the smaller of its CPU affinity and the cgroup CPU quota, rounded up, so
+a container limited to 2 CPUs on a 64 core host starts 2 workers, not 64.
+"""
+import argparse
+import importlib.util
+import json
+import math
+import os
+import sys
+from typing import Optional
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+from config import (WEB_BIND, WEB_WORKERS, WEB_WORKERS_PER_CPU, WEB_BACKLOG, WEB_KEEPALIVE, WEB_TIMEOUT,
+                    WEB_GRACEFUL_TIMEOUT, WEB_MAX_REQUESTS, WEB_MAX_REQUESTS_JITTER, WEB_PRELOAD, WEB_LOOP,
+                    WEB_HTTP, WEB_LIMIT_CONCURRENCY, WEB_LOG_LEVEL)
+
+APP = 'backend.main:app'
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    """CPUs allowed by the cgroup (v2 cpu.max or v1 cfs quota), None when unlimited"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as file:
+            quota, period = file.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as file:
+            quota = int(file.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as file:
+            period = int(file.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    return max(cpus, 1)
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def event_loop() -> str:
+    if WEB_LOOP != 'auto':
+        return WEB_LOOP
+    return 'uvloop' if _installed('uvloop') else 'asyncio'
+
+
+def http_parser() -> str:
+    if WEB_HTTP != 'auto':
+        return WEB_HTTP
+    return 'httptools' if _installed('httptools') else 'h11'
+
+
+class TunedUvicornWorker(UvicornWorker):
+    """UvicornWorker with the event loop, HTTP parser and concurrency limit from config"""
+
+    CONFIG_KWARGS = {
+        'loop': event_loop(),
+        'http': http_parser(),
+        'limit_concurrency': WEB_LIMIT_CONCURRENCY,
+    }
+
+
+def post_fork(server, worker):
+    # with WEB_PRELOAD the app, and so the engines, were created in the master.
+    # Connections must never be shared across processes: give every worker
+    # fresh pools, without closing the parent's connections from the child.
+    database = sys.modules.get('backend.authentication.database')
+    if database is None:
+        return
+    database.engine.sync_engine.dispose(close=False)
+    for replica in database.replica_set.replicas:
+        replica.engine.sync_engine.dispose(close=False)
+
+
+def gunicorn_options() -> dict:
+    workers = WEB_WORKERS or WEB_WORKERS_PER_CPU * available_cpus()
+    return {
+        'bind': WEB_BIND,
+        'workers': workers,
+        'worker_class': 'backend.launcher.TunedUvicornWorker',
+        'backlog': WEB_BACKLOG,
+        'keepalive': WEB_KEEPALIVE,
+        'timeout': WEB_TIMEOUT,
+        'graceful_timeout': WEB_GRACEFUL_TIMEOUT,
+        'max_requests': WEB_MAX_REQUESTS,
+        'max_requests_jitter': WEB_MAX_REQUESTS_JITTER,
+        'preload_app': WEB_PRELOAD,
+        'loglevel': WEB_LOG_LEVEL,
+        'post_fork': post_fork,
+    }
+
+
+class Launcher(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from backend.main import app
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--print-config', action='store_true')
+    args = parser.parse_args()
+    options = gunicorn_options()
+    if args.print_config:
+        printable = {key: value for key, value in options.items() if key != 'post_fork'}
+        printable.update({'app': APP, 'cpus': available_cpus(), **TunedUvicornWorker.CONFIG_KWARGS})
+        print(json.dumps(printable, indent=2))
+        return
+    Launcher(options).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""
+Delivery of the mail in email_outbox.
+
+Signup (and password reset) only insert a row in the transaction that
+creates the user, so a slow or unreachable SMTP server never holds a
+request, and mail is never sent for a signup that rolled back. Every worker
+with MAIL_DISPATCHER_ENABLED runs a dispatcher which, every
+MAIL_POLL_INTERVAL seconds or as soon as its own worker enqueued something:
+
+- claims up to MAIL_BATCH_SIZE due rows in one short transaction, skipping
+  rows other dispatchers hold, and leases them for MAIL_LEASE_SECONDS,
+- sends them over at most MAIL_POOL_SIZE reused SMTP connections at once,
+- marks the sent ones in one statement and reschedules failures with
+  exponential backoff (MAIL_BACKOFF_BASE doubling up to MAIL_BACKOFF_MAX,
+  with jitter). Permanent refusals (5xx) and mail that used up
+  MAIL_MAX_ATTEMPTS stay in the table as failed.
+
+Delivery is at least once: a dispatcher dying between the SMTP conversation
+and marking the row sends that mail again after the lease.
+
+    python -m backend.mail.dispatcher             # run a dispatcher on its own
+    python -m backend.mail.dispatcher --once      # one batch, then print stats
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+
+from backend.authentication.database import async_session
+from backend.observability.metrics import REGISTRY, Histogram
+from config import (MAIL_HOST, MAIL_PORT, MAIL_USER, MAIL_PASSWORD, MAIL_STARTTLS, MAIL_SSL, MAIL_TIMEOUT,
+                    MAIL_POOL_SIZE, MAIL_BATCH_SIZE, MAIL_POLL_INTERVAL, MAIL_MAX_ATTEMPTS, MAIL_BACKOFF_BASE,
+                    MAIL_BACKOFF_MAX, MAIL_LEASE_SECONDS, MAIL_KEEP_SENT_DAYS)
+from .manager import OutboxDAL
+from .messages import build_message
+from .smtp import PermanentMailError, SMTPPool
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL = 3600
+# sent mails counted by throughput()
+THROUGHPUT_WINDOW = 60
+# how long stop() lets the current batch finish before cancelling it
+STOP_TIMEOUT = 10
+
+queue_lag = Histogram(
+    'mail_queue_lag_seconds',
+    'Time from enqueueing a mail until it was sent.',
+    ('kind',),
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600),
+)
+send_duration = Histogram(
+    'mail_send_duration_seconds',
+    'Time one SMTP delivery took, by outcome (sent, retry, failed).',
+    ('kind', 'outcome'),
+)
+REGISTRY.extend((queue_lag, send_duration))
+
+
+def backoff(attempts: int, base: float = MAIL_BACKOFF_BASE, maximum: float = MAIL_BACKOFF_MAX) -> float:
+    """seconds before the next attempt after `attempts` failed ones, with up to 10% jitter"""
+    delay = min(base * 2 ** (attempts - 1), maximum)
+    return delay * random.uniform(0.9, 1.1)
+
+
+class Dispatcher:
+    def __init__(self, pool: SMTPPool, batch_size: int, poll_interval: float, max_attempts: int,
+                 lease_seconds: float, keep_sent_days: float):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.keep_sent_days = keep_sent_days
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._purged_at = time.monotonic()
+        # monotonic time of every batch's completion with its sent count, for throughput()
+        self._sent_window: deque[tuple[float, int]] = deque()
+        self.batches = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+
+    def wake(self):
+        """something was enqueued, claim it without waiting for the next poll"""
+        self._wake.set()
+
+    async def _send(self, mail) -> tuple[str, Optional[str]]:
+        started = time.perf_counter()
+        try:
+            await self.pool.send(build_message(mail.recipient, mail.subject, mail.body))
+        except PermanentMailError as err:
+            outcome, error = 'failed', str(err)
+        except Exception as err:
+            outcome, error = 'retry', str(err) or type(err).__name__
+            if mail.attempts >= self.max_attempts:
+                outcome = 'failed'
+        else:
+            outcome, error = 'sent', None
+            lag = (datetime.now(timezone.utc) - mail.created_at).total_seconds()
+            queue_lag.observe((mail.kind,), max(lag, 0.0))
+        send_duration.observe((mail.kind, outcome), time.perf_counter() - started)
+        return outcome, error
+
+    async def run_once(self) -> int:
+        """claim and send one batch, the number of claimed mails"""
+        async with async_session() as session:
+            async with session.begin():
+                mails = await OutboxDAL(session).claim(self.batch_size, self.lease_seconds, self.max_attempts)
+        if not mails:
+            return 0
+        # the pool's executor bounds how many of these talk to the server at once
+        results = await asyncio.gather(*(self._send(mail) for mail in mails))
+        sent = [mail.id for mail, (outcome, _) in zip(mails, results) if outcome == 'sent']
+        async with async_session() as session:
+            async with session.begin():
+                outbox = OutboxDAL(session)
+                if sent:
+                    await outbox.mark_sent(sent)
+                for mail, (outcome, error) in zip(mails, results):
+                    if outcome == 'retry':
+                        await outbox.retry_later(mail.id, backoff(mail.attempts), error)
+                    elif outcome == 'failed':
+                        await outbox.give_up(mail.id, error, self.max_attempts)
+                        logger.warning('giving up on mail %s to %s: %s', mail.id, mail.recipient, error)
+        self.batches += 1
+        self.sent += len(sent)
+        self.retried += sum(outcome == 'retry' for outcome, _ in results)
+        self.failed += sum(outcome == 'failed' for outcome, _ in results)
+        self._sent_window.append((time.monotonic(), len(sent)))
+        return len(mails)
+
+    async def _purge(self):
+        async with async_session() as session:
+            async with session.begin():
+                purged = await OutboxDAL(session).purge_sent(self.keep_sent_days * 86400)
+        if purged:
+            logger.info('purged %s sent mails', purged)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                # a full batch means more is due, go on without waiting
+                while not self._stopping and await self.run_once() == self.batch_size:
+                    pass
+                if time.monotonic() - self._purged_at > PURGE_INTERVAL:
+                    self._purged_at = time.monotonic()
+                    await self._purge()
+                self.last_error = None
+            except Exception as err:
+                self.last_error = str(err) or type(err).__name__
+                logger.warning('mail dispatch failed: %r', err)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """let the current batch finish, then close the SMTP connections"""
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            try:
+                await asyncio.wait_for(self._task, STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                # cancelled, its claimed mails are offered again once their lease ran out
+                pass
+            self._task = None
+        await asyncio.to_thread(self.pool.close)
+
+    def throughput(self) -> float:
+        """mails sent per second over the last THROUGHPUT_WINDOW seconds"""
+        horizon = time.monotonic() - THROUGHPUT_WINDOW
+        while self._sent_window and self._sent_window[0][0] < horizon:
+            self._sent_window.popleft()
+        return sum(count for _, count in self._sent_window) / THROUGHPUT_WINDOW
+
+    async def queue_status(self) -> dict:
+        async with async_session() as session:
+            async with session.begin():
+                pending, oldest, failed = await OutboxDAL(session).queue_status(self.max_attempts)
+        lag = (datetime.now(timezone.utc) - oldest).total_seconds() if oldest else 0.0
+        return {'pending': pending, 'failed': failed, 'oldest_pending_seconds': round(max(lag, 0.0), 3)}
+
+    def stats(self) -> dict:
+        return {
+            'running': self._task is not None,
+            'pool_size': self.pool.size,
+            'connects': self.pool.connects,
+            'batch_size': self.batch_size,
+            'batches': self.batches,
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'sent_per_second': round(self.throughput(), 3),
+            'last_error': self.last_error,
+        }
+
+
+dispatcher = Dispatcher(
+    pool=SMTPPool(
+        host=MAIL_HOST,
+        port=MAIL_PORT,
+        username=MAIL_USER,
+        password=MAIL_PASSWORD,
+        starttls=MAIL_STARTTLS,
+        use_ssl=MAIL_SSL,
+        timeout=MAIL_TIMEOUT,
+        size=MAIL_POOL_SIZE,
+    ),
+    batch_size=MAIL_BATCH_SIZE,
+    poll_interval=MAIL_POLL_INTERVAL,
+    max_attempts=MAIL_MAX_ATTEMPTS,
+    lease_seconds=MAIL_LEASE_SECONDS,
+    keep_sent_days=MAIL_KEEP_SENT_DAYS,
+)
+
+
+async def _main(args: argparse.Namespace):
+    if args.once:
+        await dispatcher.run_once()
+        await asyncio.to_thread(dispatcher.pool.close)
+        print(json.dumps({**dispatcher.stats(), **await dispatcher.queue_status()}))
+        return
+    await dispatcher.start()
+    try:
+        while True:
+            await asyncio.sleep(60)
+            logger.info('mail %s', {**dispatcher.stats(), **await dispatcher.queue_status()})
+    finally:
+        await dispatcher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--once', action='store_true', help='send one batch and exit')
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy import Row, and_, delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.authentication.models import EmailOutbox
+from backend.observability.sql import label_statements
+
+
+@label_statements
+class OutboxDAL:
+    """data access for email_outbox"""
+
+    def __init__(self, db_session: AsyncSession):
+        self.db_session = db_session
+
+    async def enqueue(self, kind: str, recipient: str, subject: str, body: str):
+        """add mail to the outbox, sent once the surrounding transaction committed"""
+        self.db_session.add(EmailOutbox(kind=kind, recipient=recipient, subject=subject, body=body, attempts=0))
+        await self.db_session.flush()
+
+    async def claim(self, limit: int, lease_seconds: float, max_attempts: int) -> list[Row]:
+        """
+        Take up to `limit` due mails, in send_after order. They are hidden from
+        other dispatchers for lease_seconds instead of staying locked while the
+        SMTP conversation runs; rows locked by a concurrent claim are skipped.
+        """
+        due = (
+            select(EmailOutbox.id)
+            .where(and_(
+                EmailOutbox.sent_at.is_(None),
+                EmailOutbox.send_after <= func.now(),
+                EmailOutbox.attempts < max_attempts,
+            ))
+            .order_by(EmailOutbox.send_after)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        query = (
+            update(EmailOutbox)
+            .where(EmailOutbox.id.in_(due))
+            .values(send_after=func.now() + timedelta(seconds=lease_seconds), attempts=EmailOutbox.attempts + 1)
+            .returning(EmailOutbox.id, EmailOutbox.kind, EmailOutbox.recipient, EmailOutbox.subject,
+                       EmailOutbox.body, EmailOutbox.attempts, EmailOutbox.created_at)
+            .execution_options(synchronize_session=False)
+        )
+        res = await self.db_session.execute(query)
+        return res.fetchall()
+
+    async def mark_sent(self, ids: list[int]):
+        query = (
+            update(EmailOutbox)
+            .where(EmailOutbox.id.in_(ids))
+            .values(sent_at=func.now(), last_error=None)
+            .execution_options(synchronize_session=False)
+        )
+        await self.db_session.execute(query)
+
+    async def retry_later(self, mail_id: int, delay_seconds: float, error: str):
+        query = (
+            update(EmailOutbox)
+            .where(EmailOutbox.id == mail_id)
+            .values(send_after=func.now() + timedelta(seconds=delay_seconds), last_error=error[:1000])
+            .execution_options(synchronize_session=False)
+        )
+        await self.db_session.execute(query)
+
+    async def give_up(self, mail_id: int, error: str, max_attempts: int):
+        """never offer the mail again, it stays in the table as failed"""
+        query = (
+            update(EmailOutbox)
+            .where(EmailOutbox.id == mail_id)
+            .values(attempts=func.greatest(EmailOutbox.attempts, max_attempts), last_error=error[:1000])
+            .execution_options(synchronize_session=False)
+        )
+        await self.db_session.execute(query)
+
+    async def queue_status(self, max_attempts: int) -> Row:
+        """(pending, oldest pending created_at, failed) over unsent mail"""
+        query = select(
+            func.count().filter(EmailOutbox.attempts < max_attempts),
+            func.min(EmailOutbox.created_at).filter(EmailOutbox.attempts < max_attempts),
+            func.count().filter(EmailOutbox.attempts >= max_attempts),
+        ).where(EmailOutbox.sent_at.is_(None))
+        res = await self.db_session.execute(query)
+        return res.one()
+
+    async def purge_sent(self, keep_seconds: float) -> Optional[int]:
+        query = delete(EmailOutbox).where(EmailOutbox.sent_at < func.now() - timedelta(seconds=keep_seconds))
+        res = await self.db_session.execute(query.execution_options(synchronize_session=False))
+        return res.rowcount
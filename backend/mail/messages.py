@@ -0,0 +1,45 @@
+from datetime import timedelta
+from email.message import EmailMessage
+from urllib.parse import urlencode
+
+from backend.secure import create_link_token
+from config import APP_BASE_URL, MAIL_FROM, RESET_TOKEN_EXPIRE_MINUTES, VERIFY_TOKEN_EXPIRE_HOURS
+
+VERIFY = 'verify'
+RESET = 'reset'
+
+
+def verification_mail(user) -> tuple[str, str]:
+    """subject and body asking `user` to confirm its email address"""
+    token = create_link_token(
+        VERIFY, {'uid': str(user.id), 'email': user.email}, timedelta(hours=VERIFY_TOKEN_EXPIRE_HOURS)
+    )
+    link = f'{APP_BASE_URL}/user/verify?{urlencode({"token": token})}'
+    return 'Confirm your email address', (
+        f'Hello {user.username},\n\n'
+        f'please confirm your email address by opening\n\n{link}\n\n'
+        f'The link expires in {VERIFY_TOKEN_EXPIRE_HOURS} hours.\n'
+    )
+
+
+def password_reset_mail(user) -> tuple[str, str]:
+    """subject and body with a single use link, the token is bound to the current token_version"""
+    token = create_link_token(
+        RESET, {'uid': str(user.id), 'ver': user.token_version}, timedelta(minutes=RESET_TOKEN_EXPIRE_MINUTES)
+    )
+    link = f'{APP_BASE_URL}/user/password/reset?{urlencode({"token": token})}'
+    return 'Reset your password', (
+        f'Hello {user.username},\n\n'
+        f'a password reset was requested for your account. Choose a new password at\n\n{link}\n\n'
+        f'The link expires in {RESET_TOKEN_EXPIRE_MINUTES} minutes. '
+        'If you did not ask for it, ignore this mail.\n'
+    )
+
+
+def build_message(recipient: str, subject: str, body: str) -> EmailMessage:
+    message = EmailMessage()
+    message['From'] = MAIL_FROM
+    message['To'] = recipient
+    message['Subject'] = subject
+    message.set_content(body)
+    return message
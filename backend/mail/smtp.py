@@ -0,0 +1,113 @@
+import asyncio
+import queue
+import smtplib
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from typing import Optional
+
+# a connection idle for longer is checked with NOOP before it is used again
+IDLE_CHECK_SECONDS = 30
+
+
+class PermanentMailError(Exception):
+    """the server refused the mail for good (5xx), retrying cannot help"""
+
+
+class SMTPPool:
+    """
+    Up to `size` reusable SMTP connections, each used by one thread of a
+    dedicated executor at a time: `size` mails are sent at once at most and
+    smtplib never blocks the event loop. Connections are opened lazily.
+    """
+
+    def __init__(self, host: str, port: int, username: Optional[str], password: Optional[str],
+                 starttls: bool, use_ssl: bool, timeout: float, size: int):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.size = size
+        self._idle: queue.LifoQueue[tuple[smtplib.SMTP, float]] = queue.LifoQueue()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.connects = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        context = ssl.create_default_context()
+        if self.use_ssl:
+            connection = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=context)
+        else:
+            connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                connection.starttls(context=context)
+        if self.username and self.password:
+            connection.login(self.username, self.password)
+        self.connects += 1
+        return connection
+
+    def _take(self) -> smtplib.SMTP:
+        try:
+            connection, released_at = self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+        if time.monotonic() - released_at > IDLE_CHECK_SECONDS:
+            try:
+                if connection.noop()[0] == 250:
+                    return connection
+            except (smtplib.SMTPException, OSError):
+                pass
+            _close(connection)
+            return self._connect()
+        return connection
+
+    def _send(self, message: EmailMessage):
+        connection = self._take()
+        try:
+            connection.send_message(message)
+        except smtplib.SMTPRecipientsRefused as err:
+            self._idle.put((connection, time.monotonic()))
+            # 4xx refusals (greylisting, full mailbox) are worth retrying
+            if all(500 <= code < 600 for code, _ in err.recipients.values()):
+                raise PermanentMailError(str(err.recipients)) from err
+            raise
+        except smtplib.SMTPResponseException as err:
+            # smtplib reset the transaction, the session is still usable unless the server is closing it (421)
+            if err.smtp_code == 421:
+                _close(connection)
+            else:
+                self._idle.put((connection, time.monotonic()))
+            if 500 <= err.smtp_code < 600:
+                raise PermanentMailError(f'{err.smtp_code} {err.smtp_error!r}') from err
+            raise
+        except BaseException:
+            _close(connection)
+            raise
+        self._idle.put((connection, time.monotonic()))
+
+    async def send(self, message: EmailMessage):
+        """raises PermanentMailError, or smtplib / OS errors worth retrying"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='smtp')
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._send, message)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            _close(connection)
+
+
+def _close(connection: smtplib.SMTP):
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        connection.close()
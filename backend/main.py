@@ -1,11 +1,68 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+
+from backend.authentication.archive import archiver
+from backend.authentication.database import replica_set
+from backend.authentication.invalidation import invalidation_listener
+from backend.authentication.revocation import revocation_filter
+from backend.authentication.router import router as user_router
+from backend.items.router import router as items_router
+from backend.mail.dispatcher import dispatcher
+from backend.observability.middleware import StatementCountMiddleware, TimingMiddleware
+from backend.observability.router import metrics_router, router as observability_router
+from backend.secure import password_hasher
+from backend.warmup import readiness, warm_up
+from config import (REQUEST_TIMING, SERVER_TIMING_HEADER, SQL_COUNT_STATEMENTS, SQL_MAX_STATEMENTS_PER_REQUEST,
+                    SQL_N_PLUS_ONE_THRESHOLD, WARMUP)
+
 
-from authentication.router import router as user_router
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up(enabled=WARMUP)
+    yield
+    readiness.shutting_down = True
+    await replica_set.stop()
+    await revocation_filter.stop()
+    await invalidation_listener.stop()
+    await archiver.stop()
+    await dispatcher.stop()
+    password_hasher.shutdown()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.include_router(
     router=user_router,
     prefix='/user',
     tags=['Registration']
 )
+app.include_router(
+    router=items_router,
+    prefix='/items',
+    tags=['Items']
+)
+app.include_router(
+    router=observability_router,
+    prefix='/observability',
+    tags=['Observability']
+)
+app.include_router(metrics_router)
+
+
+@app.get('/ready', include_in_schema=False)
+async def ready():
+    """503 until warm-up ran, while draining or when the primary does not answer"""
+    is_ready, state = await readiness.check()
+    return ORJSONResponse(state, status_code=200 if is_ready else 503)
+
+
+if REQUEST_TIMING:
+    app.add_middleware(TimingMiddleware, server_timing_header=SERVER_TIMING_HEADER)
+if SQL_COUNT_STATEMENTS:
+    app.add_middleware(
+        StatementCountMiddleware,
+        max_statements=SQL_MAX_STATEMENTS_PER_REQUEST,
+        repeat_threshold=SQL_N_PLUS_ONE_THRESHOLD,
+    )
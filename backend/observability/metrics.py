@@ -0,0 +1,67 @@
+from bisect import bisect_left
+from typing import Iterable
+
+# upper bounds in seconds, slower observations only count towards +Inf
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """cumulative-bucket histogram per label set, rendered in Prometheus text format"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...],
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> [per bucket counts..., +Inf count], sum
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, labels: tuple[str, ...], seconds: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = series
+        # counts are stored per bucket and accumulated only when rendering
+        counts[bisect_left(self.buckets, seconds)] += 1
+        total[0] += seconds
+
+    def clear(self):
+        self._series.clear()
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total) in self._series.items():
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+            cumulative += counts[-1]
+            yield f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}'
+            yield f'{self.name}_sum{{{label_text}}} {total[0]}'
+            yield f'{self.name}_count{{{label_text}}} {cumulative}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Time from receiving a request until the app returned.',
+    ('method', 'route', 'status'),
+)
+request_phase_duration = Histogram(
+    'http_request_phase_duration_seconds',
+    'Time a request spent in one phase (hash, jwt, db_wait, db, serialize).',
+    ('method', 'route', 'status', 'phase'),
+)
+
+REGISTRY = [request_duration, request_phase_duration]
+
+
+def render_metrics() -> str:
+    return '\n'.join(line for histogram in REGISTRY for line in histogram.render()) + '\n'
@@ -0,0 +1,118 @@
+import logging
+import time
+from typing import Callable, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import request_duration, request_phase_duration
+from .sql import end_statement_count, start_statement_count
+from .timing import end_request, start_request
+
+logger = logging.getLogger(__name__)
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+class TimingMiddleware:
+    """
+    Times each HTTP request and the phases recorded through observability.timing
+    while it runs, returns them in a Server-Timing header and observes them in the
+    request histograms labelled by method, route template and status.
+
+    Pure ASGI rather than BaseHTTPMiddleware, so it adds no task or stream copy
+    per request.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing_header: bool = True):
+        self.app = app
+        self.server_timing_header = server_timing_header
+        self._route_paths: dict[Callable, str] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        phases, token = start_request()
+        status_code = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                if self.server_timing_header:
+                    header = _server_timing(phases, time.perf_counter() - started)
+                    message['headers'] = [*message.get('headers', ()), (b'server-timing', header)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - started
+            end_request(token)
+            labels = (scope['method'], self._route_path(scope), str(status_code))
+            request_duration.observe(labels, elapsed)
+            for phase, seconds in phases.items():
+                request_phase_duration.observe((*labels, phase), seconds)
+
+    def _route_path(self, scope: Scope) -> str:
+        # the router stores the matched endpoint in the shared scope; label by its
+        # path template so /user/{id} style routes do not explode cardinality
+        endpoint: Optional[Callable] = scope.get('endpoint')
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            app = scope.get('app')
+            for route in getattr(app, 'routes', ()):
+                route_endpoint = getattr(route, 'endpoint', None)
+                if route_endpoint is not None:
+                    self._route_paths.setdefault(route_endpoint, route.path)
+            path = self._route_paths.setdefault(endpoint, UNMATCHED_ROUTE)
+        return path
+
+
+def _server_timing(phases: dict[str, float], total: float) -> bytes:
+    metrics = [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.items()]
+    metrics.append(f'app;dur={total * 1000:.2f}')
+    return ', '.join(metrics).encode('latin-1')
+
+
+class StatementCountMiddleware:
+    """
+    Development aid: counts the SQL statements each request runs, reports them
+    in an X-Statement-Count header and warns when a request runs more than
+    max_statements or repeats one statement label repeat_threshold times, the
+    usual shape of an N+1 query.
+    """
+
+    def __init__(self, app: ASGIApp, max_statements: int, repeat_threshold: int):
+        self.app = app
+        self.max_statements = max_statements
+        self.repeat_threshold = repeat_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        counter, token = start_statement_count()
+
+        async def send_with_count(message: Message):
+            if message['type'] == 'http.response.start':
+                count = str(sum(counter.values())).encode()
+                message['headers'] = [*message.get('headers', ()), (b'x-statement-count', count)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_count)
+        finally:
+            end_statement_count(token)
+            total = sum(counter.values())
+            repeated = {label: count for label, count in counter.items() if count >= self.repeat_threshold}
+            if repeated or total > self.max_statements:
+                logger.warning(
+                    '%s %s ran %s SQL statements, repeated: %s',
+                    scope['method'], scope['path'], total, repeated or 'none',
+                )
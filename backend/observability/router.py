@@ -0,0 +1,76 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from backend.authentication.archive import archiver
+from backend.authentication.cache import principal_cache
+from backend.authentication.database import pool_status, replica_set
+from backend.authentication.invalidation import invalidation_listener
+from backend.authentication.revocation import revocation_filter
+from backend.authentication.router import get_current_admin
+from backend.mail.dispatcher import dispatcher
+from backend.secure import password_hasher, verified_token_cache
+from backend.secure.ratelimit import rate_limiter
+from .metrics import render_metrics
+from .sql import statement_stats
+
+# worker internals (pool, replica errors, statements, mail queue) are for admins only
+router = APIRouter(dependencies=[Depends(get_current_admin)])
+metrics_router = APIRouter()
+
+
+@router.get('/hashing')
+async def hashing_stats():
+    return password_hasher.stats()
+
+
+@router.get('/principal_cache')
+async def principal_cache_stats():
+    return {**principal_cache.stats(), 'invalidation': invalidation_listener.stats()}
+
+
+@router.get('/token_cache')
+async def token_cache_stats():
+    return verified_token_cache.stats()
+
+
+@router.get('/pool')
+async def database_pool_stats():
+    return pool_status()
+
+
+@router.get('/ratelimit')
+async def rate_limit_stats():
+    return rate_limiter.stats()
+
+
+@router.get('/replicas')
+async def replica_stats():
+    return replica_set.status()
+
+
+@router.get('/revocation')
+async def revocation_filter_stats():
+    return revocation_filter.stats()
+
+
+@router.get('/archive')
+async def archive_stats():
+    return archiver.stats()
+
+
+@router.get('/mail')
+async def mail_stats():
+    """dispatcher counters of this worker and the outbox backlog shared by all of them"""
+    return {**dispatcher.stats(), **await dispatcher.queue_status()}
+
+
+@router.get('/sql')
+async def sql_statement_stats(limit: int = 50):
+    """statement labels of this worker ordered by total time"""
+    return statement_stats.as_dict(limit)
+
+
+@metrics_router.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """request histograms of this worker in Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
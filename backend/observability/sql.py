@@ -0,0 +1,203 @@
+"""
+SQL statement instrumentation through engine events.
+
+Statements are grouped by the data access method that issued them
+(`UserDAL.get_user_by_email`) when it is decorated with label_statements,
+otherwise by a normalized `<verb> <table>` form of the SQL. Per group it keeps
+latency and row counts, observes latency in the /metrics histograms, logs a
+sample of statements slower than SLOW_QUERY_MS with redacted parameters and,
+when statement counting is on, counts statements per request to flag N+1
+patterns.
+"""
+import functools
+import inspect
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import SLOW_QUERY_MS, SLOW_QUERY_SAMPLE_RATE, SLOW_QUERY_LOG_PARAMETERS
+from .metrics import REGISTRY, Histogram
+from .stats import LatencyStats
+from .timing import record
+
+logger = logging.getLogger('backend.sql')
+
+# values of bind parameters whose name matches are never logged
+SENSITIVE_PARAMETER = re.compile(r'password|hash|token|secret|email', re.IGNORECASE)
+STATEMENT_TARGET = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+("?[\w.]+"?)', re.IGNORECASE)
+MAX_LOGGED_STATEMENT = 1000
+
+_statement_label: ContextVar[Optional[str]] = ContextVar('statement_label', default=None)
+# statement label -> executions in the current request, None when not counting
+_request_statements: ContextVar[Optional[Counter]] = ContextVar('request_statements', default=None)
+
+statement_duration = Histogram(
+    'db_statement_duration_seconds',
+    'Time spent executing SQL statements, by data access method or normalized statement.',
+    ('statement',),
+)
+REGISTRY.append(statement_duration)
+
+
+def label_statements(cls):
+    """label the SQL issued by each public coroutine of a DAL class with `Class.method`"""
+    for name, member in list(vars(cls).items()):
+        if name.startswith('_'):
+            continue
+        if inspect.isasyncgenfunction(member):
+            setattr(cls, name, _label_async_generator(member, f'{cls.__name__}.{name}'))
+        elif inspect.iscoroutinefunction(member):
+            setattr(cls, name, _label_coroutine(member, f'{cls.__name__}.{name}'))
+    return cls
+
+
+def _label_coroutine(fn: Callable, label: str) -> Callable:
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        token = _statement_label.set(label)
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            _statement_label.reset(token)
+    return wrapper
+
+
+def _label_async_generator(fn: Callable, label: str) -> Callable:
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        generator = fn(*args, **kwargs)
+        try:
+            while True:
+                # set and reset within one step, the consumer may resume us from another context
+                token = _statement_label.set(label)
+                try:
+                    item = await generator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    _statement_label.reset(token)
+                yield item
+        finally:
+            await generator.aclose()
+    return wrapper
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_statement(statement: str) -> str:
+    """`<verb> <table>` for statements issued outside a labelled method"""
+    verb = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else 'empty'
+    target = STATEMENT_TARGET.search(statement)
+    return f'{verb} {target.group(1).strip(chr(34))}' if target else verb
+
+
+def redact(parameters: Any, log_values: bool = SLOW_QUERY_LOG_PARAMETERS) -> Any:
+    """bind parameters safe to log: types only, or values except sensitive names"""
+    if isinstance(parameters, dict):
+        return {
+            key: type(value).__name__ if not log_values
+            else '***' if SENSITIVE_PARAMETER.search(str(key)) else _truncate(value)
+            for key, value in parameters.items()
+        }
+    if isinstance(parameters, (list, tuple)):
+        if not log_values:
+            return [type(value).__name__ for value in parameters]
+        # positional parameters carry no names, never log their values
+        return ['***' for _ in parameters]
+    return '***'
+
+
+def _truncate(value: Any, limit: int = 100) -> Any:
+    if isinstance(value, (str, bytes)) and len(value) > limit:
+        return value[:limit] + ('...' if isinstance(value, str) else b'...')
+    return value
+
+
+class StatementStats:
+    """latency and rows per statement label"""
+
+    def __init__(self):
+        self.latency: dict[str, LatencyStats] = {}
+        self.rows: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.slow = 0
+
+    def observe(self, label: str, seconds: float, rows: int):
+        stats = self.latency.get(label)
+        if stats is None:
+            stats = self.latency[label] = LatencyStats()
+        stats.observe(seconds)
+        if rows > 0:
+            self.rows[label] += rows
+
+    def as_dict(self, limit: int = 50) -> dict:
+        top = sorted(self.latency.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+        return {
+            'slow_threshold_ms': SLOW_QUERY_MS,
+            'slow': self.slow,
+            'statements': {
+                label: {**stats.as_dict(), 'total_ms': stats.total * 1000, 'rows': self.rows[label],
+                        'errors': self.errors[label]}
+                for label, stats in top
+            },
+        }
+
+
+statement_stats = StatementStats()
+
+
+def _label_for(statement: str) -> str:
+    return _statement_label.get() or normalize_statement(statement)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._statement_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._statement_started
+    label = _label_for(statement)
+    rows = getattr(cursor, 'rowcount', -1)
+    record('db', elapsed)
+    statement_stats.observe(label, elapsed, rows)
+    statement_duration.observe((label,), elapsed)
+    counter = _request_statements.get()
+    if counter is not None:
+        counter[label] += 1
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        statement_stats.slow += 1
+        if random.random() < SLOW_QUERY_SAMPLE_RATE:
+            # named parameters of the compiled statement, the DBAPI only sees positional ones
+            compiled = getattr(context, 'compiled_parameters', None)
+            logger.warning(
+                'slow query %s %.1f ms rows=%s: %s params=%s',
+                label, elapsed * 1000, rows, ' '.join(statement.split())[:MAX_LOGGED_STATEMENT],
+                redact(compiled[0] if compiled else parameters),
+            )
+
+
+def _handle_error(exception_context):
+    statement = exception_context.statement
+    if statement is not None:
+        statement_stats.errors[_label_for(statement)] += 1
+
+
+def instrument_engine(engine: Engine):
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+def start_statement_count() -> tuple[Counter, Token]:
+    counter: Counter = Counter()
+    return counter, _request_statements.set(counter)
+
+
+def end_statement_count(token: Token):
+    _request_statements.reset(token)
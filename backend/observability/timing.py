@@ -0,0 +1,33 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Optional
+
+# phase name -> seconds spent in it by the current request, None outside a request
+_request_phases: ContextVar[Optional[dict[str, float]]] = ContextVar('request_phases', default=None)
+
+
+def start_request() -> tuple[dict[str, float], Token]:
+    """start collecting phases in the current context, returns them and a token for end_request"""
+    phases: dict[str, float] = {}
+    return phases, _request_phases.set(phases)
+
+
+def end_request(token: Token):
+    _request_phases.reset(token)
+
+
+def record(phase: str, seconds: float):
+    """add `seconds` to `phase` of the current request, no-op outside a request"""
+    phases = _request_phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
@@ -1,21 +1,20 @@
 import datetime
+import hashlib
+import secrets
 from datetime import timedelta
 from typing import Optional
 
 from fastapi.security import APIKeyHeader
-from jose import jwt
-from passlib.context import CryptContext
+from jose import JWTError, jwt
 
+from backend.observability.timing import timed
 from config import ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, SECRET_TOKEN
+from .hashing import password_hasher
+from .tokens import verified_token_cache
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 apikey_scheme = APIKeyHeader(name='auth')
 
 
-def hash_password(password: str):
-    return pwd_context.hash(password)
-
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -26,3 +25,32 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encode_jwt = jwt.encode(to_encode, SECRET_TOKEN, algorithm=ALGORITHM)
     return encode_jwt
 
+
+def decode_access_token(token: str) -> dict:
+    """verified payload of an access token, raises JWTError when it is invalid"""
+    with timed('jwt'):
+        return verified_token_cache.decode(token, SECRET_TOKEN, ALGORITHM)
+
+
+def new_refresh_token() -> tuple[str, bytes]:
+    """opaque refresh token for the client and the hash stored in its place"""
+    token = secrets.token_urlsafe(32)
+    return token, hash_refresh_token(token)
+
+
+def hash_refresh_token(token: str) -> bytes:
+    # 256 random bits need no salt nor a slow hash
+    return hashlib.sha256(token.encode()).digest()
+
+
+def create_link_token(purpose: str, data: dict, expires_delta: timedelta) -> str:
+    """token for a mailed link, never accepted as an access token (see `purpose`)"""
+    return create_access_token({**data, 'purpose': purpose}, expires_delta=expires_delta)
+
+
+def decode_link_token(token: str, purpose: str) -> dict:
+    """payload of a link token made for `purpose`, raises JWTError otherwise"""
+    payload = jwt.decode(token, SECRET_TOKEN, algorithms=[ALGORITHM])
+    if payload.get('purpose') != purpose:
+        raise JWTError('token was issued for another purpose')
+    return payload
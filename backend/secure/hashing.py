@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from backend.observability.stats import LatencyStats
+from backend.observability.timing import record
+from config import (HASH_POOL_KIND, HASH_POOL_WORKERS, HASH_QUEUE_SIZE, HASH_RETRY_AFTER,
+                    BCRYPT_ROUNDS, BCRYPT_TARGET_MS, BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS)
+
+logger = logging.getLogger(__name__)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def configure_bcrypt_rounds(rounds: int):
+    """hash with `rounds` and mark every stored hash below it as deprecated"""
+    pwd_context.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+
+
+def measure_bcrypt_cost(rounds: int, samples: int = 3) -> float:
+    """average seconds for a single bcrypt hash at the given cost on this CPU"""
+    handler = pwd_context.handler('bcrypt').using(rounds=rounds)
+    started = time.perf_counter()
+    for _ in range(samples):
+        handler.hash('calibration-password')
+    return (time.perf_counter() - started) / samples
+
+
+def calibrate_bcrypt_rounds(target_ms: float, min_rounds: int, max_rounds: int) -> int:
+    """highest cost whose hash latency stays within target_ms, never below min_rounds"""
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        if measure_bcrypt_cost(rounds) * 1000 > target_ms:
+            break
+        chosen = rounds
+    return chosen
+
+
+# worker functions live at module level so a process pool can pickle them #
+
+
+def _timed_hash(password: str) -> tuple[str, float]:
+    started = time.perf_counter()
+    hashed = pwd_context.hash(password)
+    return hashed, time.perf_counter() - started
+
+
+def _timed_verify(password: str, hashed_password: str) -> tuple[bool, float]:
+    started = time.perf_counter()
+    verified = pwd_context.verify(password, hashed_password)
+    return verified, time.perf_counter() - started
+
+
+def _timed_verify_and_update(
+        password: str, hashed_password: str
+) -> tuple[tuple[bool, Optional[str]], float]:
+    started = time.perf_counter()
+    result = pwd_context.verify_and_update(password, hashed_password)
+    return result, time.perf_counter() - started
+
+
+class PasswordHasher:
+    """runs bcrypt hash / verify in a bounded worker pool instead of the event loop"""
+
+    def __init__(self, kind: str, workers: int, max_queue: int, retry_after: int):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f'Unknown hash pool kind: {kind}')
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.rounds: Optional[int] = None
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self.rejected = 0
+        self.hash_latency = LatencyStats()
+        self.wait_latency = LatencyStats()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=configure_bcrypt_rounds if self.rounds is not None else None,
+                    initargs=(self.rounds,) if self.rounds is not None else (),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='password-hasher'
+                )
+        return self._executor
+
+    def admit(self):
+        """
+        raise 503 now if hashing work would be rejected, before spending anything on
+        the request: max_queue bounds the work waiting for a worker, not the running one
+        """
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Password hashing queue is full, retry later',
+                headers={'Retry-After': str(self.retry_after)},
+            )
+
+    async def _submit(self, fn: Callable, *args):
+        self.admit()
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, hash_seconds = await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._pending -= 1
+        wait_seconds = time.perf_counter() - started - hash_seconds
+        self.hash_latency.observe(hash_seconds)
+        self.wait_latency.observe(wait_seconds)
+        record('hash', hash_seconds)
+        record('hash_wait', wait_seconds)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_timed_hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._submit(_timed_verify, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+        """verify and, if the stored hash is below the configured cost, return a replacement"""
+        return await self._submit(_timed_verify_and_update, password, hashed_password)
+
+    def configure(self, rounds: int):
+        configure_bcrypt_rounds(rounds)
+        self.rounds = rounds
+        if self.kind == 'process':
+            # worker processes only pick the cost up through the pool initializer
+            self.shutdown()
+
+    async def setup(self):
+        """apply BCRYPT_ROUNDS or calibrate the cost against BCRYPT_TARGET_MS"""
+        rounds = BCRYPT_ROUNDS
+        if rounds is None:
+            rounds = await asyncio.to_thread(
+                calibrate_bcrypt_rounds, BCRYPT_TARGET_MS, BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS
+            )
+            logger.info('bcrypt cost calibrated to %s rounds for a %s ms target', rounds, BCRYPT_TARGET_MS)
+        self.configure(rounds)
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self._pending - self.workers, 0)
+
+    def stats(self) -> dict:
+        return {
+            'kind': self.kind,
+            'rounds': self.rounds,
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'in_flight': min(self._pending, self.workers),
+            'queue_depth': self.queue_depth,
+            'rejected': self.rejected,
+            'hash_latency': self.hash_latency.as_dict(),
+            'queue_wait': self.wait_latency.as_dict(),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    kind=HASH_POOL_KIND,
+    workers=HASH_POOL_WORKERS,
+    max_queue=HASH_QUEUE_SIZE,
+    retry_after=HASH_RETRY_AFTER,
+)
@@ -0,0 +1,169 @@
+"""
+Rate limits for the endpoints that spend CPU on bcrypt.
+
+Limits are GCRA (a token bucket kept as one timestamp per key): `count/period`
+lets `count` requests through at once and one more every period/count seconds
+after that. Every decision is a dict lookup and a few float operations.
+
+The per-worker memory backend is always consulted first so floods are
+rejected without a database round trip. With RATE_LIMIT_BACKEND=postgres
+the same limits are then enforced across workers through the unlogged
+rate_limits table, failing open when Postgres is unavailable.
+"""
+import hashlib
+import logging
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Protocol
+
+from fastapi import HTTPException, status
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import RATE_LIMIT_ENABLED, RATE_LIMIT_BACKEND, RATE_LIMIT_MAX_KEYS
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+@dataclass(frozen=True, slots=True)
+class Limit:
+    count: int
+    period: float
+
+    @classmethod
+    def parse(cls, value: str) -> 'Limit':
+        """'10/minute' style"""
+        count, period = value.split('/')
+        return cls(count=int(count), period=PERIODS[period.strip()])
+
+    @property
+    def interval(self) -> float:
+        return self.period / self.count
+
+
+class RateLimitBackend(Protocol):
+    async def hit(self, key: bytes, limit: Limit) -> float:
+        """0 when allowed, otherwise seconds until the key may try again"""
+
+
+class MemoryBackend:
+    """theoretical arrival time per key in an LRU bounded to maxsize keys"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._tat: OrderedDict[bytes, float] = OrderedDict()
+
+    async def hit(self, key: bytes, limit: Limit) -> float:
+        now = time.monotonic()
+        tat = max(self._tat.get(key, now), now) + limit.interval
+        retry_after = tat - now - limit.period
+        if retry_after > 0:
+            return retry_after
+        self._tat[key] = tat
+        self._tat.move_to_end(key)
+        if len(self._tat) > self.maxsize:
+            # the least recently allowed key, evicting it only forgets a limit
+            self._tat.popitem(last=False)
+        return 0.0
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+
+# statement_timestamp() keeps every worker on the database clock
+POSTGRES_HIT = text(
+    'INSERT INTO rate_limits AS r (key, tat) '
+    'VALUES (:key, extract(epoch FROM statement_timestamp()) + :interval) '
+    'ON CONFLICT (key) DO UPDATE '
+    'SET tat = greatest(r.tat, extract(epoch FROM statement_timestamp())) + :interval '
+    'WHERE greatest(r.tat, extract(epoch FROM statement_timestamp())) + :interval '
+    '<= extract(epoch FROM statement_timestamp()) + :period '
+    'RETURNING tat'
+)
+POSTGRES_RETRY_AFTER = text(
+    'SELECT greatest(tat + :interval - extract(epoch FROM statement_timestamp()) - :period, 0) '
+    'FROM rate_limits WHERE key = :key'
+)
+POSTGRES_PURGE = text('DELETE FROM rate_limits WHERE tat < extract(epoch FROM statement_timestamp())')
+
+
+class PostgresBackend:
+    """limits shared by every worker, expired keys are purged every purge_interval seconds"""
+
+    def __init__(self, session_factory, purge_interval: float = 60):
+        self.session_factory = session_factory
+        self.purge_interval = purge_interval
+        self._purged_at = time.monotonic()
+
+    async def hit(self, key: bytes, limit: Limit) -> float:
+        params = {'key': key, 'interval': limit.interval, 'period': limit.period}
+        async with self.session_factory() as session:
+            async with session.begin():
+                if (await session.execute(POSTGRES_HIT, params)).first() is not None:
+                    retry_after = 0.0
+                else:
+                    retry_after = float((await session.execute(POSTGRES_RETRY_AFTER, params)).scalar() or 0)
+                if time.monotonic() - self._purged_at > self.purge_interval:
+                    self._purged_at = time.monotonic()
+                    await session.execute(POSTGRES_PURGE)
+        return retry_after
+
+
+class RateLimiter:
+    def __init__(self, memory: MemoryBackend, shared: Optional[RateLimitBackend] = None, enabled: bool = True):
+        self.memory = memory
+        self.shared = shared
+        self.enabled = enabled
+        self.allowed: Counter = Counter()
+        self.denied: Counter = Counter()
+        self.shared_errors = 0
+
+    @staticmethod
+    def _key(name: str, identifier: str) -> bytes:
+        # fixed size keys, and no addresses or emails kept in memory or in the table
+        return hashlib.blake2b(f'{name}:{identifier}'.encode(), digest_size=16).digest()
+
+    async def hit(self, name: str, identifier: str, limit: Limit):
+        """count one request of `identifier` against limit `name`, raises 429 when over it"""
+        if not self.enabled:
+            return
+        key = self._key(name, identifier)
+        retry_after = await self.memory.hit(key, limit)
+        if not retry_after and self.shared is not None:
+            try:
+                retry_after = await self.shared.hit(key, limit)
+            except (SQLAlchemyError, OSError) as err:
+                self.shared_errors += 1
+                logger.warning('shared rate limit backend unavailable, allowing: %s', err)
+        if retry_after:
+            self.denied[name] += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail='Too many requests, retry later',
+                headers={'Retry-After': str(max(int(retry_after + 0.999), 1))},
+            )
+        self.allowed[name] += 1
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'backend': 'memory' if self.shared is None else f'memory+{RATE_LIMIT_BACKEND}',
+            'memory_keys': len(self.memory),
+            'memory_max_keys': self.memory.maxsize,
+            'allowed': dict(self.allowed),
+            'denied': dict(self.denied),
+            'shared_errors': self.shared_errors,
+        }
+
+
+def _shared_backend() -> Optional[RateLimitBackend]:
+    if RATE_LIMIT_BACKEND == 'postgres':
+        from backend.authentication.database import async_session
+        return PostgresBackend(async_session)
+    return None
+
+
+rate_limiter = RateLimiter(MemoryBackend(RATE_LIMIT_MAX_KEYS), _shared_backend(), enabled=RATE_LIMIT_ENABLED)
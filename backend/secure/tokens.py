@@ -0,0 +1,66 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from jose import jwt
+
+from config import TOKEN_CACHE_SIZE, TOKEN_CACHE_MAX_TTL
+
+
+class VerifiedTokenCache:
+    """decoded payloads of already verified tokens, kept until their exp claim"""
+
+    def __init__(self, maxsize: int, max_ttl: float):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self._fingerprint: Optional[bytes] = None
+        self._data: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def _check_fingerprint(self, secret: str, algorithm: str):
+        # entries were verified with one key/algorithm pair, a rotation voids all of them
+        fingerprint = hashlib.sha256(f'{algorithm}:{secret}'.encode()).digest()
+        if fingerprint != self._fingerprint:
+            self._data.clear()
+            self._fingerprint = fingerprint
+
+    def decode(self, token: str, secret: str, algorithm: str) -> dict:
+        self._check_fingerprint(secret, algorithm)
+        key = self._key(token)
+        now = time.time()
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, payload = entry
+            if expires_at > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return payload
+            del self._data[key]
+        self.misses += 1
+        payload = jwt.decode(token, secret, algorithms=[algorithm])
+        if self.maxsize > 0:
+            expires_at = min(float(payload.get('exp', now)), now + self.max_ttl)
+            self._data[key] = (expires_at, payload)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return payload
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+verified_token_cache = VerifiedTokenCache(maxsize=TOKEN_CACHE_SIZE, max_ttl=TOKEN_CACHE_MAX_TTL)
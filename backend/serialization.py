@@ -0,0 +1,29 @@
+from functools import lru_cache
+from typing import Any, Iterable
+
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, TypeAdapter
+
+from backend.observability.timing import timed
+
+
+def orm_response(schema: type[BaseModel], obj: Any, status_code: int = 200) -> ORJSONResponse:
+    """
+    Validate an ORM object / Row straight into `schema` (from_attributes) and
+    write it with orjson. Returning a Response skips FastAPI's second pass
+    through response_model, which then only documents the endpoint.
+    """
+    with timed('serialize'):
+        return ORJSONResponse(schema.model_validate(obj, from_attributes=True).model_dump(), status_code=status_code)
+
+
+@lru_cache
+def _list_adapter(schema: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[schema])
+
+
+def orm_list_response(schema: type[BaseModel], objs: Iterable[Any], status_code: int = 200) -> ORJSONResponse:
+    adapter = _list_adapter(schema)
+    with timed('serialize'):
+        return ORJSONResponse(adapter.dump_python(adapter.validate_python(objs, from_attributes=True)),
+                              status_code=status_code)
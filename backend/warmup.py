@@ -0,0 +1,156 @@
+"""
+Work a worker does once before it takes traffic, and the readiness state
+behind GET /ready.
+
+Without it every new worker pays on its first requests for opening database
+connections, compiling and preparing the UserDAL statements, loading the
+bcrypt backend and starting the hash pool. Background tasks (replica checks,
+revocation filter rebuilds, cache invalidation, archival, mail dispatch) are started here too.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from backend.authentication.archive import archiver
+from backend.authentication.database import async_session, engine, replica_set
+from backend.authentication.invalidation import invalidation_listener
+from backend.authentication.manager import UserDAL, RefreshTokenDAL
+from backend.authentication.revocation import revocation_filter
+from backend.items.manager import ItemDAL
+from backend.mail.dispatcher import dispatcher
+from backend.secure import create_access_token, decode_access_token, password_hasher
+from config import (ARCHIVE_ENABLED, MAIL_DISPATCHER_ENABLED, PRINCIPAL_CACHE_BROADCAST, DB_POOL_WARM_CONNECTIONS,
+                    READY_CHECK_TIMEOUT, WARMUP_TIMEOUT, validate_config)
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """state behind GET /ready"""
+
+    def __init__(self):
+        self.started = False
+        self.shutting_down = False
+        self.warmup_seconds: Optional[float] = None
+        # step name -> seconds, or the error that stopped it
+        self.steps: dict[str, object] = {}
+
+    async def check(self) -> tuple[bool, dict]:
+        """ready once warm-up ran, while not draining and the primary answers"""
+        database = 'ok'
+        try:
+            await asyncio.wait_for(_ping(engine), READY_CHECK_TIMEOUT)
+        except Exception as err:
+            database = str(err) or type(err).__name__
+        ready = self.started and not self.shutting_down and database == 'ok'
+        return ready, {
+            'ready': ready,
+            'started': self.started,
+            'shutting_down': self.shutting_down,
+            'database': database,
+            'warmup_seconds': self.warmup_seconds,
+            'warmup_steps': self.steps,
+        }
+
+
+readiness = Readiness()
+
+
+async def _ping(target: AsyncEngine):
+    async with target.connect() as connection:
+        await connection.execute(text('SELECT 1'))
+
+
+async def fill_pool(target: AsyncEngine, connections: int):
+    """open `connections` at once and hand them back, the pool keeps up to pool_size"""
+    async def hold(ready: asyncio.Event):
+        async with target.connect() as connection:
+            await connection.execute(text('SELECT 1'))
+            await ready.wait()
+
+    ready = asyncio.Event()
+    holders = [asyncio.create_task(hold(ready)) for _ in range(connections)]
+    try:
+        while not all(task.done() for task in holders) and target.pool.checkedout() < connections:
+            await asyncio.sleep(0.01)
+    finally:
+        ready.set()
+        await asyncio.gather(*holders)
+
+
+async def warm_statements():
+    """run every read and conditional write of the DALs once in a rolled back transaction"""
+    missing = uuid.UUID(int=0)
+    async with async_session() as session:
+        transaction = await session.begin()
+        try:
+            users = UserDAL(session)
+            await users.get_user_by_id(missing)
+            await users.get_user_by_email('warmup@example.invalid')
+            await users.get_token_version(missing)
+            await users.list_users(limit=1)
+            await users.update_user_if(missing, {'username': 'warmup'})
+            await users.update_user(missing, hashed_password='warmup')
+            await users.delete_user(missing)
+            items = ItemDAL(session)
+            await items.list_items(missing, limit=1)
+            await items.get_item(0, missing)
+            tokens = RefreshTokenDAL(session)
+            await tokens.use(bytes(32))
+            await tokens.is_family_revoked(missing)
+        finally:
+            await transaction.rollback()
+
+
+async def warm_crypto():
+    hashed = await password_hasher.hash('warmup-password')
+    await password_hasher.verify('warmup-password', hashed)
+    decode_access_token(create_access_token({'sub': 'warmup@example.invalid'}))
+
+
+async def _step(name: str, coro):
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(coro, WARMUP_TIMEOUT)
+    except Exception as err:
+        readiness.steps[name] = f'failed: {err or type(err).__name__}'
+        logger.warning('warm-up step %s failed: %r', name, err)
+        return
+    readiness.steps[name] = round(time.perf_counter() - started, 3)
+
+
+async def warm_up(enabled: bool = True):
+    """
+    Validate config (raises on problems) and, when enabled, warm the worker.
+    A failed step is logged and reported on /ready but does not stop the
+    worker, which then warms up on its first requests as before.
+    """
+    problems = validate_config()
+    if problems:
+        raise RuntimeError('invalid configuration: ' + '; '.join(problems))
+    started = time.perf_counter()
+    await _step('crypto', password_hasher.setup())
+    if enabled:
+        await _step('crypto_warm', warm_crypto())
+        await _step('pool', fill_pool(engine, DB_POOL_WARM_CONNECTIONS))
+        await _step('statements', warm_statements())
+    await _step('replicas', replica_set.start())
+    await _step('revocation', revocation_filter.start())
+    if PRINCIPAL_CACHE_BROADCAST:
+        await _step('invalidation', invalidation_listener.start())
+    if ARCHIVE_ENABLED:
+        await _step('archiver', archiver.start())
+    if MAIL_DISPATCHER_ENABLED:
+        await _step('mail', dispatcher.start())
+    if enabled:
+        for replica in replica_set.replicas:
+            if replica.usable:
+                await _step(f'pool_{replica.name}', fill_pool(replica.engine, DB_POOL_WARM_CONNECTIONS))
+    readiness.warmup_seconds = round(time.perf_counter() - started, 3)
+    readiness.started = True
+    logger.info('warm-up finished in %ss: %s', readiness.warmup_seconds, readiness.steps)
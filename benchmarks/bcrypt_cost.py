@@ -0,0 +1,44 @@
+"""Hashes per second per core for each bcrypt cost.
+
+    python -m benchmarks.bcrypt_cost --min-rounds 8 --max-rounds 14 --processes 4
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.hash import bcrypt
+
+
+def _hash_for(rounds: int, seconds: float) -> int:
+    handler = bcrypt.using(rounds=rounds)
+    hashes = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        handler.hash('benchmark-password')
+        hashes += 1
+    return hashes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--min-rounds', type=int, default=8)
+    parser.add_argument('--max-rounds', type=int, default=14)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seconds', type=float, default=3.0, help='time spent on each cost')
+    args = parser.parse_args()
+
+    print(f'{"rounds":>6} {"ms/hash":>10} {"hashes/s/core":>14} {"hashes/s total":>15}')
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        for rounds in range(args.min_rounds, args.max_rounds + 1):
+            started = time.perf_counter()
+            counts = list(pool.map(_hash_for, [rounds] * args.processes, [args.seconds] * args.processes))
+            elapsed = time.perf_counter() - started
+            total = sum(counts)
+            per_core = total / elapsed / args.processes
+            ms_per_hash = 1000 / per_core if per_core else float('inf')
+            print(f'{rounds:>6} {ms_per_hash:>10.1f} {per_core:>14.2f} {total / elapsed:>15.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Per-call Python overhead and round trip of the UserDAL methods.
+
+    python -m benchmarks.dal --calls 2000
+
+Uses the database from config.py with migrations applied and a
+`dal-bench@example.com` user it creates when missing. Every method runs
+--calls times in one transaction that is rolled back at the end, once through
+UserDAL (statements built once, values bound per call) and once with the
+statement constructed inside the call, as UserDAL used to. For each call
+the time until the driver sends the statement (construction, cache key,
+compiled cache lookup), the round trip and the time spent on the result
+afterwards are measured separately through cursor execute events. The first
+call is excluded: it compiles and prepares.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from sqlalchemy import and_, event, func, select, text, update
+
+from backend.authentication.database import async_session, engine
+from backend.authentication.manager import UserDAL
+from backend.authentication.models import User
+
+BENCH_USER = text(
+    "INSERT INTO users (id, username, email, hashed_password, is_active, role_mask) "
+    "VALUES (:id, 'dalbench', 'dal-bench@example.com', 'x', true, 1) "
+    "ON CONFLICT (email) DO UPDATE SET email = excluded.email RETURNING id"
+)
+
+_marks: dict[str, float] = {}
+
+
+@event.listens_for(engine.sync_engine, 'before_cursor_execute')
+def _sent(conn, cursor, statement, parameters, context, executemany):
+    _marks['sent'] = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, 'after_cursor_execute')
+def _received(conn, cursor, statement, parameters, context, executemany):
+    _marks['received'] = time.perf_counter()
+
+
+def _inline_calls(session, user_id: uuid.UUID, email: str) -> dict:
+    """the constructs UserDAL built on every call before its statements were prebuilt"""
+    is_target = and_(User.id == user_id, User.is_active == True)
+
+    async def fetch(query):
+        return (await session.execute(query)).fetchone()
+
+    return {
+        'get_user_by_id': lambda: fetch(select(User).where(is_target)),
+        'get_user_by_email': lambda: fetch(
+            select(User).where(and_(func.lower(User.email) == func.lower(email), User.is_active == True))
+        ),
+        'get_token_version': lambda: fetch(select(User.token_version).where(is_target)),
+        'update_user': lambda: fetch(update(User).where(is_target).values(hashed_password='x').returning(User.id)),
+        'delete_user': lambda: fetch(
+            update(User).where(and_(User.id == uuid.UUID(int=0), User.is_active == True))
+            .values(is_active=False, deactivated_at=func.now(), token_version=User.token_version + 1)
+            .returning(User.id)
+        ),
+    }
+
+
+def _dal_calls(session, user_id: uuid.UUID, email: str) -> dict:
+    users = UserDAL(session)
+    return {
+        'get_user_by_id': lambda: users.get_user_by_id(user_id),
+        'get_user_by_email': lambda: users.get_user_by_email(email),
+        'get_token_version': lambda: users.get_token_version(user_id),
+        'update_user': lambda: users.update_user(user_id, hashed_password='x'),
+        'delete_user': lambda: users.delete_user(uuid.UUID(int=0)),
+    }
+
+
+async def _measure(call, calls: int) -> tuple[float, float, float]:
+    """median microseconds before the driver, on the wire, after it"""
+    await call()
+    before, wire, after = [], [], []
+    for _ in range(calls):
+        started = time.perf_counter()
+        await call()
+        finished = time.perf_counter()
+        before.append(_marks['sent'] - started)
+        wire.append(_marks['received'] - _marks['sent'])
+        after.append(finished - _marks['received'])
+    return tuple(statistics.median(values) * 1e6 for values in (before, wire, after))
+
+
+async def main(args: argparse.Namespace):
+    async with async_session() as session:
+        async with session.begin():
+            user_id = (await session.execute(BENCH_USER, {'id': uuid.uuid4()})).scalar()
+        email = 'DAL-Bench@example.com'
+        print(f'{"method":<20} {"variant":<8} {"before us":>10} {"wire us":>10} {"after us":>10}')
+        for method in _dal_calls(session, user_id, email):
+            for variant, calls in (('dal', _dal_calls), ('inline', _inline_calls)):
+                transaction = await session.begin()
+                try:
+                    before, wire, after = await _measure(calls(session, user_id, email)[method], args.calls)
+                finally:
+                    await transaction.rollback()
+                print(f'{method:<20} {variant:<8} {before:>10.1f} {wire:>10.1f} {after:>10.1f}')
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
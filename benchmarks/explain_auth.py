@@ -0,0 +1,94 @@
+"""Check that the auth lookups of UserDAL are index scans.
+
+    python -m benchmarks.explain_auth
+    python -m benchmarks.explain_auth --seed 1000000 --inactive-every 3 --planner
+
+Uses the database from config.py with migrations applied. EXPLAINs the
+statements behind login (get_user_by_email), token auth (get_user_by_email,
+get_token_version in stateless mode) and GET /user/ (get_user_by_id), and
+exits with 1 unless each one reads the table through an Index Scan or Index
+Only Scan of one of the expected indexes.
+
+By default sequential scans are disabled for the check, so it tells whether
+an index can serve the statement even on a near empty table. With --planner
+the plans are left to the planner, meaningful on a seeded table: --seed
+inserts that many `explain*@example.com` users, every --inactive-every-th one
+soft-deleted, then ANALYZEs. tests/test_auth_plans.py runs the same checks
+under pytest.
+"""
+import argparse
+import asyncio
+import sys
+import uuid
+
+from sqlalchemy import Select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.authentication.database import async_session, engine
+from backend.authentication.manager import ACTIVE_USER_BY_EMAIL, ACTIVE_USER_BY_ID, TOKEN_VERSION, USER_BY_EMAIL
+
+SEED_USERS = text(
+    "INSERT INTO users (id, username, email, hashed_password, is_active, role_mask) "
+    "SELECT gen_random_uuid(), 'explain' || g, 'Explain' || g || '@example.com', 'x', g % :inactive_every <> 0, 1 "
+    "FROM generate_series(1, :count) AS g "
+    "ON CONFLICT DO NOTHING"
+)
+INDEX_SCANS = ('Index Scan', 'Index Only Scan')
+
+CHECKS: list[tuple[str, Select, tuple[str, ...]]] = [
+    ('get_user_by_email', ACTIVE_USER_BY_EMAIL.params(email='Explain42@Example.com'),
+     ('ix_users_active_email_lower', 'ux_users_email_lower')),
+    ('get_user_by_email inactive', USER_BY_EMAIL.params(email='Explain42@Example.com'),
+     ('ux_users_email_lower',)),
+    ('get_token_version', TOKEN_VERSION.params(user_id=uuid.uuid4()),
+     ('ix_users_active_id', 'users_pkey', 'users_id_key')),
+    ('get_user_by_id', ACTIVE_USER_BY_ID.params(user_id=uuid.uuid4()),
+     ('ix_users_active_id', 'users_pkey', 'users_id_key')),
+]
+
+
+def _scan(plan: list[str]) -> str:
+    return next((line.strip().lstrip('-> ') for line in plan if 'Scan' in line), plan[0].strip())
+
+
+async def explain(session: AsyncSession, query: Select, planner: bool = False) -> list[str]:
+    """EXPLAIN lines of query, with sequential scans disabled unless planner"""
+    compiled = query.compile(engine.sync_engine, compile_kwargs={'literal_binds': True})
+    async with session.begin():
+        if not planner:
+            await session.execute(text('SET LOCAL enable_seqscan = off'))
+        return (await session.execute(text(f'EXPLAIN {compiled}'))).scalars().all()
+
+
+def index_scan(plan: list[str], indexes: tuple[str, ...]) -> tuple[bool, str]:
+    """whether the plan reads users through an index scan of one of indexes, and that scan"""
+    scan = _scan(plan)
+    return scan.startswith(INDEX_SCANS) and any(f' using {index} ' in f'{scan} ' for index in indexes), scan
+
+
+async def main(args: argparse.Namespace) -> int:
+    failed = 0
+    async with async_session() as session:
+        if args.seed:
+            async with session.begin():
+                await session.execute(SEED_USERS, {'count': args.seed, 'inactive_every': args.inactive_every})
+            async with session.begin():
+                await session.execute(text('ANALYZE users'))
+        for label, query, indexes in CHECKS:
+            plan = await explain(session, query, args.planner)
+            ok, scan = index_scan(plan, indexes)
+            failed += not ok
+            print(f'{"ok" if ok else "FAIL":<5} {label:<28} {scan}')
+            if not ok or args.verbose:
+                print('\n'.join(f'      {line}' for line in plan))
+    await engine.dispose()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--inactive-every', type=int, default=3)
+    parser.add_argument('--planner', action='store_true', help='leave sequential scans enabled')
+    parser.add_argument('--verbose', action='store_true', help='print every plan')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,97 @@
+"""Item search latency over a synthetic corpus.
+
+    python -m benchmarks.item_search --seed 1000000 --queries 200
+
+Uses the database from config.py with migrations applied. --seed COPYs that
+many random-word items owned by a `bench-search@example.com` user, then
+ANALYZEs. Each query term is run through ItemDAL.search_items in fulltext
+and fuzzy mode, unscoped and scoped to the bench owner.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+
+from sqlalchemy import text
+
+from backend.authentication.database import async_session, engine
+from backend.items.manager import ItemDAL
+
+WORDS = [
+    'alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet',
+    'kilo', 'lima', 'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango',
+    'uniform', 'victor', 'whiskey', 'xray', 'yankee', 'zulu', 'invoice', 'report', 'draft', 'budget',
+    'meeting', 'roadmap', 'release', 'incident', 'customer', 'contract', 'design', 'review', 'launch',
+    'database', 'network', 'storage', 'payment', 'shipping', 'support', 'security', 'analytics',
+]
+BENCH_OWNER = text(
+    "INSERT INTO users (id, username, email, hashed_password, is_active, role_mask) "
+    "VALUES (:id, 'benchsearch', 'bench-search@example.com', 'x', true, 1) "
+    "ON CONFLICT (email) DO UPDATE SET email = excluded.email RETURNING id"
+)
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) + str(rng.randrange(1000)) if rng.random() < 0.2 else rng.choice(WORDS)
+                    for _ in range(words))
+
+
+async def _seed(count: int, chunk: int = 50000) -> uuid.UUID:
+    rng = random.Random(42)
+    async with async_session() as session:
+        async with session.begin():
+            owner_id = (await session.execute(BENCH_OWNER, {'id': uuid.uuid4()})).scalar_one()
+        for start in range(0, count, chunk):
+            records = [
+                (_sentence(rng, 4), _sentence(rng, 40), owner_id)
+                for _ in range(min(chunk, count - start))
+            ]
+            async with session.begin():
+                connection = await session.connection()
+                raw_connection = await connection.get_raw_connection()
+                await raw_connection.driver_connection.copy_records_to_table(
+                    'items', records=records, columns=('title', 'content', 'owner_id')
+                )
+            print(f'seeded {start + len(records)} items', flush=True)
+        async with session.begin():
+            await session.execute(text('ANALYZE items'))
+    return owner_id
+
+
+async def main(args: argparse.Namespace):
+    if args.seed:
+        await _seed(args.seed)
+    async with async_session() as session:
+        async with session.begin():
+            owner_id = (await session.execute(
+                text("SELECT id FROM users WHERE email = 'bench-search@example.com'")
+            )).scalar()
+        rng = random.Random(7)
+        terms = [rng.choice(WORDS) if rng.random() < 0.5 else f'{rng.choice(WORDS)} {rng.choice(WORDS)}'
+                 for _ in range(args.queries)]
+
+        print(f'{"mode":>9} {"scope":>6} {"p50 ms":>8} {"p95 ms":>8} {"max ms":>8} {"avg hits":>9}')
+        for mode in ('fulltext', 'fuzzy'):
+            for scope, owner in (('all', None), ('owner', owner_id)):
+                timings, hits = [], []
+                for term in terms:
+                    started = time.perf_counter()
+                    async with session.begin():
+                        rows = await ItemDAL(session).search_items(term, mode, args.limit, owner_id=owner)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    hits.append(len(rows))
+                timings.sort()
+                print(f'{mode:>9} {scope:>6} {statistics.median(timings):>8.2f} '
+                      f'{timings[int(len(timings) * 0.95) - 1]:>8.2f} {timings[-1]:>8.2f} '
+                      f'{statistics.mean(hits):>9.1f}')
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+"""Access token decode throughput with and without the verified-token cache.
+
+    python -m benchmarks.jwt_decode --algorithm HS256 --tokens 100 --iterations 100000
+
+Every iteration decodes one of --tokens distinct tokens, round robin, the way a
+worker sees the same few bearer tokens over and over. RS256 / ES256 keys are
+generated on the fly with `cryptography`.
+"""
+import argparse
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from jose import jwt
+
+from backend.secure.tokens import VerifiedTokenCache
+
+
+def _keys(algorithm: str) -> tuple[str, str]:
+    if algorithm.startswith('HS'):
+        return 'benchmark-secret', 'benchmark-secret'
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    if algorithm.startswith('RS'):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        private_key = ec.generate_private_key(ec.SECP256R1())
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    return private_pem, public_pem
+
+
+def _run(label: str, decode, tokens: list[str], iterations: int):
+    started = time.perf_counter()
+    for i in range(iterations):
+        decode(tokens[i % len(tokens)])
+    elapsed = time.perf_counter() - started
+    print(f'{label:>10}: {iterations / elapsed:>12.0f} decodes/s {elapsed / iterations * 1e6:>10.2f} us/decode')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--algorithm', default='HS256')
+    parser.add_argument('--tokens', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    signing_key, verify_key = _keys(args.algorithm)
+    expire = datetime.now(timezone.utc) + timedelta(minutes=30)
+    tokens = [
+        jwt.encode({'sub': f'user{i}@example.com', 'uid': str(uuid.uuid4()), 'exp': expire},
+                   signing_key, algorithm=args.algorithm)
+        for i in range(args.tokens)
+    ]
+
+    cache = VerifiedTokenCache(maxsize=max(args.tokens, 1), max_ttl=300)
+    print(f'{args.algorithm}, {args.tokens} distinct tokens')
+    _run('uncached', lambda token: jwt.decode(token, verify_key, algorithms=[args.algorithm]),
+         tokens, args.iterations)
+    _run('cached', lambda token: cache.decode(token, verify_key, args.algorithm), tokens, args.iterations)
+    print(f'cache: {cache.stats()}')
+
+
+if __name__ == '__main__':
+    main()
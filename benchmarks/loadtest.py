@@ -0,0 +1,396 @@
+"""Load test for the /user API with machine-readable results.
+
+    python -m benchmarks.loadtest run --users 1000 --concurrency 32 --duration 20 --output results/HEAD.json
+    python -m benchmarks.loadtest compare results/main.json results/HEAD.json
+
+`run` seeds --users accounts (load<i>@example.com / password loadpass<i>)
+through the bulk importer, starts `uvicorn backend.main:app` against the
+database from config.py (or targets --base-url) and drives one phase per
+workload:
+
+    login          POST /user/token storm over the seeded accounts
+    read_user      GET /user/?user_id=... with bearer tokens
+    auth_endpoint  GET /user/auth_endpoint with bearer tokens
+    churn          POST /user/ -> POST /user/token -> PATCH /user/ -> POST /user/token
+                   -> DELETE /user/
+    mixed          80% reads, 15% logins, 5% churn iterations
+
+For every phase it reports throughput, p50/p95/p99 latency and the SQL
+statements per request of each endpoint, read from the X-Statement-Count
+header of every response (the started app runs with SQL_COUNT_STATEMENTS;
+against --base-url they are null unless the target does too). The phase
+also reports what the whole database executed per request, background work
+included: statements from pg_stat_statements when the extension is
+installed, otherwise transactions from pg_stat_database (the `db.source`
+field says which).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from sqlalchemy import text
+
+PHASES = ('login', 'read_user', 'auth_endpoint', 'churn', 'mixed')
+
+STATEMENT_CALLS = text(
+    'SELECT coalesce(sum(calls), 0) FROM pg_stat_statements '
+    'WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())'
+)
+TRANSACTION_COUNT = text(
+    'SELECT xact_commit + xact_rollback FROM pg_stat_database WHERE datname = current_database()'
+)
+
+
+class Recorder:
+    """latencies, SQL statements and failures per endpoint for one phase"""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statements: dict[str, list[int]] = defaultdict(list)
+        self.errors: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    async def call(self, endpoint: str, request: Awaitable[httpx.Response], expected: int = 200) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as err:
+            self.errors[endpoint][type(err).__name__] += 1
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - started)
+        statements = response.headers.get('x-statement-count')
+        if statements is not None:
+            self.statements[endpoint].append(int(statements))
+        if response.status_code != expected:
+            self.errors[endpoint][str(response.status_code)] += 1
+            return None
+        return response
+
+    @property
+    def requests(self) -> int:
+        return sum(len(samples) for samples in self.latencies.values())
+
+    def summary(self, elapsed: float) -> dict:
+        endpoints = {}
+        for endpoint, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            statements = self.statements.get(endpoint)
+            endpoints[endpoint] = {
+                'count': len(samples),
+                'throughput_rps': round(len(samples) / elapsed, 2),
+                'p50_ms': round(_percentile(samples, 50) * 1000, 3),
+                'p95_ms': round(_percentile(samples, 95) * 1000, 3),
+                'p99_ms': round(_percentile(samples, 99) * 1000, 3),
+                'mean_ms': round(statistics.fmean(samples) * 1000, 3),
+                'db_calls_per_request': round(statistics.fmean(statements), 3) if statements else None,
+                'db_calls_max': max(statements) if statements else None,
+                'errors': dict(self.errors.get(endpoint, {})),
+            }
+        return {
+            'duration_seconds': round(elapsed, 3),
+            'requests': self.requests,
+            'throughput_rps': round(self.requests / elapsed, 2),
+            'errors': sum(sum(errors.values()) for errors in self.errors.values()),
+            'endpoints': endpoints,
+        }
+
+
+def _percentile(samples: list[float], percent: float) -> float:
+    if not samples:
+        return 0.0
+    index = max(int(round(percent / 100 * len(samples))) - 1, 0)
+    return samples[min(index, len(samples) - 1)]
+
+
+class Workload:
+    def __init__(self, client: httpx.AsyncClient, users: int, tokens: list[tuple[str, str]]):
+        self.client = client
+        self.users = users
+        # (user id, bearer token) of logged in seeded users
+        self.tokens = tokens
+
+    @staticmethod
+    def credentials(i: int) -> dict:
+        return {'username': f'load{i}@example.com', 'password': f'loadpass{i}'}
+
+    async def login(self, recorder: Recorder):
+        form = self.credentials(random.randrange(self.users))
+        await recorder.call('POST /user/token', self.client.post('/user/token', data=form))
+
+    async def read_user(self, recorder: Recorder):
+        user_id, token = random.choice(self.tokens)
+        await recorder.call('GET /user/', self.client.get(
+            '/user/', params={'user_id': user_id}, headers={'Authorization': f'Bearer {token}'}
+        ))
+
+    async def auth_endpoint(self, recorder: Recorder):
+        _, token = random.choice(self.tokens)
+        await recorder.call('GET /user/auth_endpoint', self.client.get(
+            '/user/auth_endpoint', headers={'Authorization': f'Bearer {token}'}
+        ))
+
+    async def churn(self, recorder: Recorder):
+        name = f'churn{uuid.uuid4().hex[:16]}'
+        email = f'{name}@example.com'
+        created = await recorder.call('POST /user/', self.client.post(
+            '/user/', json={'username': name, 'email': email, 'password': 'churnpass'}
+        ))
+        if created is None:
+            return
+        user_id = created.json()['user_id']
+        login = await recorder.call('POST /user/token', self.client.post(
+            '/user/token', data={'username': email, 'password': 'churnpass'}
+        ))
+        if login is None:
+            return
+        headers = {'Authorization': f"Bearer {login.json()['access_token']}"}
+        patched = await recorder.call('PATCH /user/', self.client.patch(
+            '/user/', params={'user_id': user_id}, json={'username': f'{name}x', 'email': None}, headers=headers
+        ))
+        if patched is None:
+            return
+        # changing a claim revokes the token, so log in again like a client would
+        login = await recorder.call('POST /user/token', self.client.post(
+            '/user/token', data={'username': email, 'password': 'churnpass'}
+        ))
+        if login is None:
+            return
+        headers = {'Authorization': f"Bearer {login.json()['access_token']}"}
+        await recorder.call('DELETE /user/', self.client.delete(
+            '/user/', params={'user_id': user_id}, headers=headers
+        ))
+
+    async def mixed(self, recorder: Recorder):
+        roll = random.random()
+        if roll < 0.4:
+            await self.read_user(recorder)
+        elif roll < 0.8:
+            await self.auth_endpoint(recorder)
+        elif roll < 0.95:
+            await self.login(recorder)
+        else:
+            await self.churn(recorder)
+
+
+async def _drive(operation: Callable[[Recorder], Awaitable[None]], concurrency: int, duration: float) -> dict:
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await operation(recorder)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return recorder.summary(time.perf_counter() - started)
+
+
+class DatabaseCounter:
+    """statements (or transactions) executed by the whole database"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.source: Optional[str] = None
+
+    async def read(self) -> int:
+        async with self.engine.connect() as connection:
+            if self.source in (None, 'pg_stat_statements'):
+                try:
+                    value = (await connection.execute(STATEMENT_CALLS)).scalar()
+                    self.source = 'pg_stat_statements'
+                    return int(value)
+                except Exception:
+                    await connection.rollback()
+                    self.source = 'pg_stat_database.transactions'
+            return int((await connection.execute(TRANSACTION_COUNT)).scalar())
+
+
+async def _seed(users: int, rounds: int):
+    from backend.authentication.bulk_import import bulk_hasher, import_users
+
+    async def rows():
+        for i in range(users):
+            yield json.dumps({'username': f'load{i}', 'email': f'load{i}@example.com',
+                              'password': f'loadpass{i}'}).encode() + b'\n'
+
+    bulk_hasher.configure(rounds)
+    try:
+        report = await import_users(rows(), 'ndjson')
+    finally:
+        bulk_hasher.shutdown()
+    print(f'seeded: {report.imported} new, {report.rejected} already present', file=sys.stderr)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(args: argparse.Namespace) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    # every request comes from one address, per IP limits would turn the run into a 429 test;
+    # statement counting reports the SQL of each request in X-Statement-Count
+    env = {**os.environ, 'BCRYPT_ROUNDS': str(args.bcrypt_rounds), 'APP_ENV': 'production', 'DB_ECHO': 'false',
+           'RATE_LIMIT_ENABLED': 'false', 'SQL_COUNT_STATEMENTS': 'true'}
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'backend.main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(args.workers), '--log-level', 'warning'],
+        env=env,
+    )
+    return process, f'http://127.0.0.1:{port}'
+
+
+async def _wait_ready(client: httpx.AsyncClient, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get('/ready')).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError('server did not become ready')
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    from backend.authentication.database import engine
+
+    random.seed(args.random_seed)
+    if args.users:
+        await _seed(args.users, args.bcrypt_rounds)
+    process = None
+    base_url = args.base_url
+    if base_url is None:
+        process, base_url = _start_server(args)
+    counter = DatabaseCounter(engine)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+            await _wait_ready(client)
+            workload = Workload(client, args.users, tokens=[])
+            for i in random.sample(range(args.users), min(args.users, args.token_pool)):
+                login = await client.post('/user/token', data=workload.credentials(i))
+                login.raise_for_status()
+                token = login.json()['access_token']
+                me = await client.get('/user/auth_endpoint', headers={'Authorization': f'Bearer {token}'})
+                workload.tokens.append((me.json()['current_user']['user_id'], token))
+
+            phases = {}
+            for phase in args.phases:
+                before = await counter.read()
+                result = await _drive(getattr(workload, phase), args.concurrency, args.duration)
+                # pg_stat_* counters are flushed by backends about once a second
+                await asyncio.sleep(args.stats_flush_delay)
+                calls = await counter.read() - before
+                result['db'] = {
+                    'source': counter.source,
+                    'calls': calls,
+                    'calls_per_request': round(calls / result['requests'], 3) if result['requests'] else None,
+                }
+                phases[phase] = result
+                print(f"{phase}: {result['throughput_rps']} rps, {result['errors']} errors, "
+                      f"{result['db']['calls_per_request']} db calls/request", file=sys.stderr)
+                for endpoint, stats in result['endpoints'].items():
+                    print(f"  {endpoint}: {stats['db_calls_per_request']} db calls/request", file=sys.stderr)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        await engine.dispose()
+
+    return {
+        'commit': _git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'settings': {
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'duration_seconds': args.duration,
+            'workers': args.workers,
+            'bcrypt_rounds': args.bcrypt_rounds,
+            'base_url': args.base_url,
+        },
+        'phases': phases,
+    }
+
+
+def compare(old: dict, new: dict):
+    print(f"{(old.get('commit') or '?')[:10]} -> {(new.get('commit') or '?')[:10]}")
+    print(f'{"phase / endpoint":<36} {"rps":>17} {"p95 ms":>19} {"p99 ms":>19} {"db calls":>15}')
+    for phase, result in new['phases'].items():
+        before = old['phases'].get(phase)
+        if before is None:
+            continue
+        for endpoint, stats in result['endpoints'].items():
+            previous = before['endpoints'].get(endpoint)
+            if previous is None:
+                continue
+            cells = [
+                f"{previous[key]:>8.1f}>{stats[key]:<8.1f}"
+                for key in ('throughput_rps', 'p95_ms', 'p99_ms')
+            ]
+            # runs recorded before per endpoint counting have no db_calls_per_request
+            calls = [previous.get('db_calls_per_request'), stats.get('db_calls_per_request')]
+            cells.append('>'.join('?' if value is None else f'{value:.2f}' for value in calls))
+            print(f'{phase + " " + endpoint:<36} {cells[0]:>17} {cells[1]:>19} {cells[2]:>19} {cells[3]:>15}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--users', type=int, default=1000)
+    run_parser.add_argument('--concurrency', type=int, default=32)
+    run_parser.add_argument('--duration', type=float, default=20, help='seconds per phase')
+    run_parser.add_argument('--phases', nargs='+', choices=PHASES, default=list(PHASES))
+    run_parser.add_argument('--workers', type=int, default=1, help='uvicorn workers when starting the app')
+    run_parser.add_argument('--base-url', help='target an already running app instead of starting one')
+    run_parser.add_argument('--bcrypt-rounds', type=int, default=10,
+                            help='cost for seeded hashes and for the started app')
+    run_parser.add_argument('--token-pool', type=int, default=200, help='logged in users used by read phases')
+    run_parser.add_argument('--timeout', type=float, default=30)
+    run_parser.add_argument('--stats-flush-delay', type=float, default=1.5)
+    run_parser.add_argument('--random-seed', type=int, default=1)
+    run_parser.add_argument('--output', help='write the JSON result here instead of stdout')
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        with open(args.old) as old, open(args.new) as new:
+            compare(json.load(old), json.load(new))
+        return
+
+    result = asyncio.run(run(args))
+    output = json.dumps(result, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Outbox dispatch throughput and queue lag against a local SMTP stand-in.
+
+    python -m benchmarks.mail --mails 2000 --pool-sizes 1 4 8 --latency 0.02
+
+Uses the database from config.py with migrations applied. Starts a minimal
+SMTP server on 127.0.0.1 that accepts and discards every mail after
+--latency seconds (roughly what a remote relay spends per message), and
+answers 451 to every --fail-every-th one. For every pool size it enqueues
+--mails rows of kind `bench` at once and runs a Dispatcher against the
+stand-in until nothing is due, then reports mails per second, SMTP
+connections opened and the queue lag (created_at to sent_at) percentiles.
+Mails that got a 451 wait for their backoff and are left out. The bench
+rows are deleted afterwards; it refuses to run while other mail is pending,
+which it would otherwise hand to the stand-in.
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from backend.authentication.database import async_session, engine
+from backend.mail.dispatcher import Dispatcher
+from backend.mail.smtp import SMTPPool
+
+ENQUEUE = text(
+    "INSERT INTO email_outbox (kind, recipient, subject, body, attempts) "
+    "SELECT 'bench', 'bench' || g || '@example.com', 'bench', repeat('x', 2000), 0 "
+    "FROM generate_series(1, :mails) g"
+)
+OTHER_PENDING = text("SELECT count(*) FROM email_outbox WHERE sent_at IS NULL AND kind <> 'bench'")
+LAG = text(
+    "SELECT count(*), "
+    "percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY extract(epoch FROM sent_at - created_at)) "
+    "FROM email_outbox WHERE kind = 'bench' AND sent_at IS NOT NULL"
+)
+CLEAN_UP = text("DELETE FROM email_outbox WHERE kind = 'bench'")
+
+
+class SMTPSink:
+    """just enough of RFC 5321 for smtplib: EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT"""
+
+    def __init__(self, latency: float, fail_every: int):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.received = 0
+        self.connections = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+
+        async def reply(line: str):
+            writer.write(line.encode() + b'\r\n')
+            await writer.drain()
+
+        await reply('220 sink ready')
+        try:
+            while line := await reader.readline():
+                command = line[:4].upper()
+                if command in (b'EHLO', b'HELO'):
+                    await reply('250 sink')
+                elif command in (b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                    await reply('250 OK')
+                elif command == b'DATA':
+                    await reply('354 end with .')
+                    while (await reader.readline()) not in (b'.\r\n', b''):
+                        pass
+                    await asyncio.sleep(self.latency)
+                    self.received += 1
+                    if self.fail_every and self.received % self.fail_every == 0:
+                        await reply('451 try again later')
+                    else:
+                        await reply('250 queued')
+                elif command == b'QUIT':
+                    await reply('221 bye')
+                    break
+                else:
+                    await reply('502 not implemented')
+        finally:
+            writer.close()
+
+
+async def _execute(statement, **params):
+    async with async_session() as session:
+        async with session.begin():
+            return (await session.execute(statement, params)).fetchone()
+
+
+async def run(args: argparse.Namespace, port: int, pool_size: int) -> dict:
+    await _execute(CLEAN_UP)
+    await _execute(ENQUEUE, mails=args.mails)
+    pool = SMTPPool('127.0.0.1', port, None, None, starttls=False, use_ssl=False, timeout=10, size=pool_size)
+    dispatcher = Dispatcher(pool, batch_size=args.batch_size, poll_interval=1, max_attempts=8,
+                            lease_seconds=300, keep_sent_days=0)
+    started = time.perf_counter()
+    while await dispatcher.run_once():
+        pass
+    elapsed = time.perf_counter() - started
+    await asyncio.to_thread(pool.close)
+    sent, (p50, p95, p99) = await _execute(LAG)
+    await _execute(CLEAN_UP)
+    return {
+        'pool_size': pool_size,
+        'sent': sent,
+        'retried': dispatcher.retried,
+        'seconds': round(elapsed, 3),
+        'mails_per_second': round(sent / elapsed, 1),
+        'connects': pool.connects,
+        'lag_p50': round(p50, 3),
+        'lag_p95': round(p95, 3),
+        'lag_p99': round(p99, 3),
+    }
+
+
+async def main(args: argparse.Namespace):
+    other, = await _execute(OTHER_PENDING)
+    if other:
+        raise SystemExit(f'{other} other mails are pending, run this against a database without them')
+    sink = SMTPSink(args.latency, args.fail_every)
+    server = await asyncio.start_server(sink.handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        for pool_size in args.pool_sizes:
+            result = await run(args, port, pool_size)
+            print('  '.join(f'{key} {value}' for key, value in result.items()), flush=True)
+    finally:
+        server.close()
+        await server.wait_closed()
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mails', type=int, default=1000)
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds the stand-in takes per mail')
+    parser.add_argument('--fail-every', type=int, default=0, help='answer 451 to every n-th mail, 0 never')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""Check that every mutating endpoint keeps its caller on the primary afterwards.
+
+    python -m benchmarks.read_your_writes
+
+Uses the database from config.py with migrations applied and a super admin
+`ryw-admin@example.com` plus a `ryw-target@example.com` user it creates
+(again) for the run. Calls each authenticated endpoint that writes through
+the app in process and exits with 1 unless the write was noticed, i.e. the
+caller's token subject is in `recent_writers` afterwards and its reads stay
+off the replicas for READ_YOUR_WRITES_SECONDS. Needs no replica: the check
+is on the bookkeeping that routing relies on.
+"""
+import asyncio
+import sys
+import uuid
+
+import httpx
+from sqlalchemy import text
+
+from backend.authentication.bulk_import import bulk_hasher
+from backend.authentication.database import async_session, engine
+from backend.authentication.replicas import recent_writers
+from backend.main import app
+from backend.secure import create_access_token, password_hasher
+
+ADMIN = 'ryw-admin@example.com'
+TARGET = 'ryw-target@example.com'
+
+CLEAN_UP = text(
+    "DELETE FROM users WHERE email IN ('ryw-admin@example.com', 'ryw-target@example.com') "
+    "OR email LIKE 'ryw-import%@example.com'"
+)
+SEED_USER = text(
+    "INSERT INTO users (id, username, email, hashed_password, is_active, role_mask) "
+    "VALUES (:id, :username, :email, 'x', true, :role_mask)"
+)
+
+
+async def _seed() -> uuid.UUID:
+    target_id = uuid.uuid4()
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(CLEAN_UP)
+            await session.execute(SEED_USER, {'id': uuid.uuid4(), 'username': 'rywadmin', 'email': ADMIN,
+                                              'role_mask': 7})
+            await session.execute(SEED_USER, {'id': target_id, 'username': 'rywtarget', 'email': TARGET,
+                                              'role_mask': 1})
+    return target_id
+
+
+async def main() -> int:
+    await password_hasher.setup()
+    await bulk_hasher.setup()
+    target_id = await _seed()
+    headers = {'Authorization': f'Bearer {create_access_token({"sub": ADMIN})}'}
+    user = {'user_id': str(target_id)}
+    item_ids: list[int] = []
+    imported = b'{"username": "rywimport1", "email": "ryw-import1@example.com", "password": "x"}\n'
+    failures = 0
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://check', headers=headers) as client:
+        calls = [
+            ('PATCH /user/', lambda: client.patch('/user/', params=user, json={'username': 'rywtarget2'})),
+            ('PATCH /user/admin', lambda: client.patch('/user/admin', params=user)),
+            ('DELETE /user/admin', lambda: client.delete('/user/admin', params=user)),
+            ('POST /user/import',
+             lambda: client.post('/user/import', params={'format': 'ndjson'}, content=imported)),
+            ('POST /items/', lambda: client.post('/items/', json=[{'title': 'ryw'}])),
+            ('PATCH /items/{item_id}',
+             lambda: client.patch(f'/items/{item_ids[0] if item_ids else 0}', json={'title': 'ryw2'})),
+            ('DELETE /items/', lambda: client.delete('/items/', params={'item_ids': item_ids})),
+            ('DELETE /user/', lambda: client.delete('/user/', params=user)),
+        ]
+        for name, call in calls:
+            recent_writers.clear()
+            response = await call()
+            pinned = recent_writers.get(ADMIN) is not None
+            ok = response.status_code == 200 and pinned
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {name:24} status {response.status_code} "
+                  f"primary {'yes' if pinned else 'no'}")
+            if name == 'POST /items/' and response.status_code == 200:
+                item_ids.extend(item['item_id'] for item in response.json())
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(CLEAN_UP)
+    password_hasher.shutdown()
+    bulk_hasher.shutdown()
+    await engine.dispose()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,115 @@
+"""Permission checks and role filtered user lookups with users.role_mask.
+
+    python -m benchmarks.roles --seed 1000000 --admin-every 1000
+
+Uses the database from config.py with migrations applied. --seed inserts that
+many synthetic `role*@example.com` users first (skipped when they already
+exist), every --admin-every-th one an admin, then ANALYZEs.
+
+Permission checks compare the bit test used now with the list scan the roles
+array needed. Lookups list and count admins through UserDAL / `has_role`,
+whose literal predicate matches the partial index ix_users_role_admin, once
+as is and once with index scans disabled for the transaction, which is what
+a role filter on the unindexed roles array amounted to.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import timeit
+from types import SimpleNamespace
+
+from sqlalchemy import func, select, text
+
+from backend.authentication.database import async_session, engine
+from backend.authentication.manager import UserDAL, has_role, is_privileged
+from backend.authentication.models import PortalRole, User
+
+SEED_USERS = text(
+    "INSERT INTO users (id, username, email, hashed_password, is_active, role_mask) "
+    "SELECT gen_random_uuid(), 'role' || g, 'role' || g || '@example.com', 'x', true, "
+    "CASE WHEN g % :admin_every = 0 THEN 3 ELSE 1 END "
+    "FROM generate_series(1, :count) AS g "
+    "ON CONFLICT DO NOTHING"
+)
+
+NO_INDEX_SCANS = [text(f'SET LOCAL {setting} = off')
+                  for setting in ('enable_indexscan', 'enable_indexonlyscan', 'enable_bitmapscan')]
+
+
+def permission_checks(number: int):
+    mask_user = SimpleNamespace(role_mask=1)
+    mask_admin = SimpleNamespace(role_mask=3)
+    list_user = SimpleNamespace(roles=['ROLE_PORTAL_USER'])
+    list_admin = SimpleNamespace(roles=['ROLE_PORTAL_USER', 'ROLE_PORTAL_ADMIN'])
+
+    def list_scan(user) -> bool:
+        return PortalRole.ROLE_PORTAL_ADMIN in user.roles or PortalRole.ROLE_PORTAL_SUPERADMIN in user.roles
+
+    print(f'{"permission check":<28} {"ns / check":>12}')
+    for label, check, user in (
+            ('list scan, user', list_scan, list_user),
+            ('list scan, admin', list_scan, list_admin),
+            ('bit test, user', is_privileged, mask_user),
+            ('bit test, admin', is_privileged, mask_admin),
+    ):
+        seconds = min(timeit.repeat(lambda: check(user), number=number, repeat=5))
+        print(f'{label:<28} {seconds / number * 1e9:>12.1f}')
+
+
+async def _timed(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+async def lookups(args: argparse.Namespace):
+    queries = {
+        'list admins': UserDAL._list_users_query(role=PortalRole.ROLE_PORTAL_ADMIN).limit(args.limit),
+        'count admins': select(func.count()).select_from(User).where(has_role(PortalRole.ROLE_PORTAL_ADMIN)),
+    }
+    async with async_session() as session:
+        print(f'\n{"lookup":<28} {"ms":>10}  plan')
+        for label, query in queries.items():
+            for indexed in (True, False):
+                async def run():
+                    async with session.begin():
+                        if not indexed:
+                            for setting in NO_INDEX_SCANS:
+                                await session.execute(setting)
+                        await session.execute(query)
+
+                async with session.begin():
+                    if not indexed:
+                        for setting in NO_INDEX_SCANS:
+                            await session.execute(setting)
+                    compiled = query.compile(engine.sync_engine, compile_kwargs={'literal_binds': True})
+                    plan = (await session.execute(text(f'EXPLAIN {compiled}'))).scalars().all()
+                scan = next((line.strip() for line in plan if 'Scan' in line), plan[0])
+                name = f'{label} ({"index" if indexed else "no index"})'
+                print(f'{name:<28} {await _timed(run, args.repeat):>10.2f}  {scan}')
+
+
+async def main(args: argparse.Namespace):
+    if args.seed:
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(SEED_USERS, {'count': args.seed, 'admin_every': args.admin_every})
+            async with session.begin():
+                await session.execute(text('ANALYZE users'))
+    permission_checks(args.checks)
+    await lookups(args)
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--admin-every', type=int, default=1000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--checks', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,90 @@
+"""Requests per second of GET /user/ and /user/auth_endpoint, legacy vs current serialization.
+
+    python -m benchmarks.serialization --requests 20000 --concurrency 50
+
+Runs in-process over httpx's ASGI transport with no database: authentication
+is overridden with a fixed user and the user lookup of GET /user/ returns that
+user. The `legacy` app serves the same endpoints the way router.py did before
+(ShowUser built field by field, re-validated through response_model and
+encoded with the stdlib JSON encoder), so the difference is serialization only.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from types import SimpleNamespace
+
+import httpx
+from fastapi import Depends, FastAPI
+from fastapi.responses import JSONResponse
+
+from backend.authentication import router as user_router_module
+from backend.authentication.router import get_current_user_from_token
+from backend.authentication.schemas import ShowUser
+from backend.main import app
+
+USER = SimpleNamespace(
+    id=uuid.uuid4(), username='benchuser', email='bench@example.com', is_active=True,
+    role_mask=1, is_admin=False, is_super_admin=False,
+)
+
+
+async def _current_user():
+    return USER
+
+
+async def _get_user_by_id(user_id, session):
+    return USER
+
+
+def legacy_app() -> FastAPI:
+    legacy = FastAPI(default_response_class=JSONResponse)
+
+    @legacy.get('/user/', response_model=ShowUser)
+    async def get_user_by_id(user_id: uuid.UUID, current_user=Depends(_current_user)) -> ShowUser:
+        user = await _get_user_by_id(user_id, None)
+        return ShowUser(user_id=user.id, username=user.username, email=user.email, is_active=user.is_active)
+
+    @legacy.get('/user/auth_endpoint')
+    async def under_jwt(current_user=Depends(_current_user)):
+        user_response = ShowUser(
+            email=current_user.email, is_active=current_user.is_active,
+            username=current_user.username, user_id=current_user.id,
+        )
+        return {'success': True, 'current_user': user_response}
+
+    return legacy
+
+
+async def _rps(target: FastAPI, path: str, requests: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=target)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        remaining = iter(range(requests))
+
+        async def worker():
+            for _ in remaining:
+                response = await client.get(path)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return requests / (time.perf_counter() - started)
+
+
+async def main(args: argparse.Namespace):
+    app.dependency_overrides[get_current_user_from_token] = _current_user
+    user_router_module._get_user_by_id = _get_user_by_id
+    legacy = legacy_app()
+    paths = [f'/user/?user_id={USER.id}', '/user/auth_endpoint']
+    print(f'{"endpoint":<24} {"legacy rps":>11} {"current rps":>12} {"speedup":>8}')
+    for path in paths:
+        before = await _rps(legacy, path, args.requests, args.concurrency)
+        after = await _rps(app, path, args.requests, args.concurrency)
+        print(f'{path.split("?")[0]:<24} {before:>11.0f} {after:>12.0f} {after / before:>7.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,101 @@
+"""Time to first request of a fresh worker, with and without warm-up.
+
+    python -m benchmarks.startup --runs 5
+
+Starts `uvicorn backend.main:app` with WARMUP=true and WARMUP=false in turn
+against the database from config.py and, for each start, records how long
+the process took until GET /ready answered and the latency of the very first
+login, GET /user/ and GET /user/auth_endpoint compared with the median of the
+same request repeated afterwards. Uses the load test account load0@example.com,
+seeded through the bulk importer when missing.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.loadtest import Workload, _free_port, _seed
+
+REQUESTS = ('POST /user/token', 'GET /user/', 'GET /user/auth_endpoint')
+
+
+async def _timed(request) -> tuple[float, httpx.Response]:
+    started = time.perf_counter()
+    response = await request
+    response.raise_for_status()
+    return time.perf_counter() - started, response
+
+
+async def _requests(client: httpx.AsyncClient) -> dict[str, float]:
+    timings = {}
+    timings['POST /user/token'], login = await _timed(client.post('/user/token', data=Workload.credentials(0)))
+    headers = {'Authorization': f"Bearer {login.json()['access_token']}"}
+    timings['GET /user/auth_endpoint'], me = await _timed(client.get('/user/auth_endpoint', headers=headers))
+    user_id = me.json()['current_user']['user_id']
+    timings['GET /user/'], _ = await _timed(client.get('/user/', params={'user_id': user_id}, headers=headers))
+    return timings
+
+
+async def _start(warmup: bool, args: argparse.Namespace) -> dict:
+    port = _free_port()
+    env = {**os.environ, 'WARMUP': str(warmup).lower(), 'BCRYPT_ROUNDS': str(args.bcrypt_rounds),
+           'APP_ENV': 'production', 'RATE_LIMIT_ENABLED': 'false'}
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'backend.main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        env=env,
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=60) as client:
+            while True:
+                try:
+                    if (await client.get('/ready')).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.perf_counter() - started > 120:
+                    raise RuntimeError('app did not become ready')
+                await asyncio.sleep(0.05)
+            ready = time.perf_counter() - started
+            first = await _requests(client)
+            repeated = [await _requests(client) for _ in range(args.repeat)]
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return {
+        'ready': ready,
+        'first': first,
+        'steady': {name: statistics.median(run[name] for run in repeated) for name in REQUESTS},
+    }
+
+
+async def main(args: argparse.Namespace):
+    await _seed(1, args.bcrypt_rounds)
+    results = {True: [], False: []}
+    for _ in range(args.runs):
+        for warmup in (True, False):
+            results[warmup].append(await _start(warmup, args))
+
+    print(f"{'':<26} {'warm-up':>12} {'cold':>12}   (median of {args.runs} starts, ms)")
+    rows = [('ready after start', lambda run: run['ready'])]
+    for name in REQUESTS:
+        rows.append((f'first {name}', lambda run, name=name: run['first'][name]))
+        rows.append((f'steady {name}', lambda run, name=name: run['steady'][name]))
+    for label, value in rows:
+        warm = statistics.median(value(run) for run in results[True]) * 1000
+        cold = statistics.median(value(run) for run in results[False]) * 1000
+        print(f'{label:<26} {warm:>12.1f} {cold:>12.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20, help='requests after the first one per start')
+    parser.add_argument('--bcrypt-rounds', type=int, default=10, help='same cost as the load test seed')
+    asyncio.run(main(parser.parse_args()))
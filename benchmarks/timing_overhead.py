@@ -0,0 +1,115 @@
+"""Per-request cost of TimingMiddleware on GET /user/auth_endpoint.
+
+    python -m benchmarks.timing_overhead --requests 20000 --rounds 5
+
+Calls the app directly over ASGI with no server, socket or database in the
+way, so the middleware is compared against the smallest request the app can
+serve. Authentication is overridden with a fixed user, but the bearer token
+is still decoded through decode_access_token so a `jwt` phase is recorded.
+Rounds alternate between the bare app and the app wrapped in TimingMiddleware;
+the median round of each is reported.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import uuid
+from types import SimpleNamespace
+
+# the middleware is applied explicitly below, keep main.py from adding it too
+os.environ['REQUEST_TIMING'] = 'false'
+
+from fastapi import Depends  # noqa: E402
+from fastapi.security import OAuth2PasswordBearer  # noqa: E402
+
+from backend.authentication.router import get_current_user_from_token  # noqa: E402
+from backend.main import app  # noqa: E402
+from backend.observability.metrics import render_metrics  # noqa: E402
+from backend.observability.middleware import TimingMiddleware  # noqa: E402
+from backend.secure import create_access_token, decode_access_token  # noqa: E402
+
+USER = SimpleNamespace(
+    id=uuid.uuid4(), username='benchuser', email='bench@example.com', is_active=True,
+    role_mask=1, is_admin=False, is_super_admin=False,
+)
+TOKEN = create_access_token({'sub': USER.email})
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/user/token')
+
+
+async def _current_user(token: str = Depends(oauth2_scheme)):
+    decode_access_token(token)
+    return USER
+
+
+SCOPE = {
+    'type': 'http',
+    'asgi': {'version': '3.0'},
+    'http_version': '1.1',
+    'method': 'GET',
+    'scheme': 'http',
+    'path': '/user/auth_endpoint',
+    'raw_path': b'/user/auth_endpoint',
+    'query_string': b'',
+    'root_path': '',
+    'headers': [(b'host', b'bench'), (b'authorization', f'Bearer {TOKEN}'.encode())],
+    'client': ('127.0.0.1', 12345),
+    'server': ('bench', 80),
+}
+
+
+async def _receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+
+async def _request(asgi_app) -> dict:
+    response = {}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = dict(message['headers'])
+
+    await asgi_app(dict(SCOPE), _receive, send)
+    return response
+
+
+async def _round(asgi_app, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        await _request(asgi_app)
+    return (time.perf_counter() - started) / requests
+
+
+async def main(requests: int, rounds: int):
+    app.dependency_overrides[get_current_user_from_token] = _current_user
+    timed_app = TimingMiddleware(app)
+
+    check = await _request(timed_app)
+    assert check['status'] == 200, check
+    print(f"server-timing: {check['headers'][b'server-timing'].decode()}")
+
+    results = {'bare': [], 'timed': []}
+    for _ in range(rounds):
+        results['bare'].append(await _round(app, requests))
+        results['timed'].append(await _round(timed_app, requests))
+
+    bare = statistics.median(results['bare'])
+    timed = statistics.median(results['timed'])
+    print(f"{'app':<8} {'us/request':>12}")
+    print(f"{'bare':<8} {bare * 1e6:>12.1f}")
+    print(f"{'timed':<8} {timed * 1e6:>12.1f}")
+    print(f'overhead: {(timed - bare) * 1e6:.1f} us/request ({(timed / bare - 1) * 100:.1f}%)')
+
+    started = time.perf_counter()
+    exposition = render_metrics()
+    print(f'/metrics: {len(exposition.splitlines())} lines rendered in '
+          f'{(time.perf_counter() - started) * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000, help='requests per round')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.rounds))
@@ -0,0 +1,81 @@
+"""Per-page latency of keyset vs OFFSET pagination over users.
+
+    python -m benchmarks.user_listing --seed 1000000 --pages 1 100 10000 --limit 100
+
+Uses the database from config.py. --seed inserts that many synthetic
+`bench*@example.com` users first (skipped when they already exist). Keyset
+pages go through UserDAL.list_users, the cursor for page N is looked up
+beforehand and is not part of the timing.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import text
+
+from backend.authentication.database import async_session, engine
+from backend.authentication.manager import UserDAL
+
+SEED_USERS = text(
+    "INSERT INTO users (id, username, email, hashed_password, is_active, role_mask) "
+    "SELECT gen_random_uuid(), 'bench' || g, 'bench' || g || '@example.com', 'x', true, 1 "
+    "FROM generate_series(1, :count) AS g "
+    "ON CONFLICT DO NOTHING"
+)
+CURSOR_AT = text('SELECT id FROM users ORDER BY id OFFSET :offset LIMIT 1')
+OFFSET_PAGE = text(
+    'SELECT id, username, email, is_active FROM users ORDER BY id OFFSET :offset LIMIT :limit'
+)
+
+
+async def _timed(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+async def main(args: argparse.Namespace):
+    async with async_session() as session:
+        if args.seed:
+            async with session.begin():
+                await session.execute(SEED_USERS, {'count': args.seed})
+            async with session.begin():
+                await session.execute(text('ANALYZE users'))
+
+        print(f'{"page":>8} {"keyset ms":>10} {"offset ms":>10}')
+        for page in args.pages:
+            offset = (page - 1) * args.limit
+            after = None
+            if page > 1:
+                async with session.begin():
+                    after = (await session.execute(CURSOR_AT, {'offset': offset - 1})).scalar()
+                if after is None:
+                    print(f'{page:>8} beyond the end of the table')
+                    continue
+
+            async def keyset():
+                async with session.begin():
+                    await UserDAL(session).list_users(
+                        limit=args.limit, after=str(after) if after else None
+                    )
+
+            async def offset_page():
+                async with session.begin():
+                    await session.execute(OFFSET_PAGE, {'offset': offset, 'limit': args.limit})
+
+            print(f'{page:>8} {await _timed(keyset, args.repeat):>10.2f} '
+                  f'{await _timed(offset_page, args.repeat):>10.2f}')
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 100, 1000, 10000])
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -1,4 +1,5 @@
 import os
+import re
 
 from dotenv import load_dotenv
 
@@ -21,5 +22,188 @@ PRIVATE_KEY = os.environ.get('PRIVATE_KEY')
 EMAIL = os.environ.get('EMAIL')
 GM_PASS = os.environ.get('GM_PASS')
 SECRET_TOKEN = os.environ.get('SECRET_TOKEN')
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES'))
-ALGORITHM = str(os.environ.get('ALGORITHM'))
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 30))
+ALGORITHM = os.environ.get('ALGORITHM', 'HS256')
+
+HASH_POOL_KIND = os.environ.get('HASH_POOL_KIND', 'thread')
+HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS', os.cpu_count() or 1))
+HASH_QUEUE_SIZE = int(os.environ.get('HASH_QUEUE_SIZE', 64))
+HASH_RETRY_AFTER = int(os.environ.get('HASH_RETRY_AFTER', 1))
+
+BCRYPT_ROUNDS = int(os.environ['BCRYPT_ROUNDS']) if os.environ.get('BCRYPT_ROUNDS') else None
+BCRYPT_TARGET_MS = float(os.environ.get('BCRYPT_TARGET_MS', 250))
+BCRYPT_MIN_ROUNDS = int(os.environ.get('BCRYPT_MIN_ROUNDS', 10))
+BCRYPT_MAX_ROUNDS = int(os.environ.get('BCRYPT_MAX_ROUNDS', 16))
+
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000))
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', 30))
+# LISTEN for invalidations from other workers, bypassing the caches while not listening
+PRINCIPAL_CACHE_BROADCAST = os.environ.get('PRINCIPAL_CACHE_BROADCAST', 'true').lower() == 'true'
+PRINCIPAL_CACHE_RECONNECT_INTERVAL = float(os.environ.get('PRINCIPAL_CACHE_RECONNECT_INTERVAL', 5))
+
+JWT_STATELESS = os.environ.get('JWT_STATELESS', 'false').lower() == 'true'
+TOKEN_VERSION_CACHE_SIZE = int(os.environ.get('TOKEN_VERSION_CACHE_SIZE', 100000))
+TOKEN_VERSION_CACHE_TTL = float(os.environ.get('TOKEN_VERSION_CACHE_TTL', 30))
+
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_MAX_TTL = float(os.environ.get('TOKEN_CACHE_MAX_TTL', 300))
+
+APP_ENV = os.environ.get('APP_ENV', 'development')
+DB_ECHO = os.environ.get('DB_ECHO', 'false').lower() == 'true'
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'false').lower() == 'true'
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 100))
+DB_QUERY_CACHE_SIZE = int(os.environ.get('DB_QUERY_CACHE_SIZE', 500))
+
+BULK_IMPORT_BATCH_SIZE = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', 1000))
+BULK_IMPORT_HASH_POOL_KIND = os.environ.get('BULK_IMPORT_HASH_POOL_KIND', 'process')
+BULK_IMPORT_HASH_WORKERS = int(os.environ.get('BULK_IMPORT_HASH_WORKERS', os.cpu_count() or 1))
+BULK_IMPORT_MAX_REPORTED_REJECTIONS = int(os.environ.get('BULK_IMPORT_MAX_REPORTED_REJECTIONS', 1000))
+# longer lines (CSV rows) are rejected without being buffered
+BULK_IMPORT_MAX_LINE_BYTES = int(os.environ.get('BULK_IMPORT_MAX_LINE_BYTES', 65536))
+
+USER_LIST_MAX_LIMIT = int(os.environ.get('USER_LIST_MAX_LIMIT', 1000))
+USER_STREAM_BATCH_SIZE = int(os.environ.get('USER_STREAM_BATCH_SIZE', 1000))
+
+ITEMS_BATCH_MAX = int(os.environ.get('ITEMS_BATCH_MAX', 500))
+ITEMS_LIST_MAX_LIMIT = int(os.environ.get('ITEMS_LIST_MAX_LIMIT', 1000))
+ITEMS_SEARCH_MAX_LIMIT = int(os.environ.get('ITEMS_SEARCH_MAX_LIMIT', 100))
+
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', 'true').lower() == 'true'
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'true').lower() == 'true'
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', 1.0))
+SLOW_QUERY_LOG_PARAMETERS = os.environ.get('SLOW_QUERY_LOG_PARAMETERS', 'false').lower() == 'true'
+SQL_COUNT_STATEMENTS = os.environ.get(
+    'SQL_COUNT_STATEMENTS', 'false' if APP_ENV == 'production' else 'true'
+).lower() == 'true'
+SQL_MAX_STATEMENTS_PER_REQUEST = int(os.environ.get('SQL_MAX_STATEMENTS_PER_REQUEST', 10))
+SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 3))
+
+# comma separated host:port of read replicas, same database name and credentials as DB_HOST
+DB_REPLICA_HOSTS = [host.strip() for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+REPLICA_CHECK_TIMEOUT = float(os.environ.get('REPLICA_CHECK_TIMEOUT', 2))
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', REPLICA_MAX_LAG_SECONDS))
+
+WARMUP = os.environ.get('WARMUP', 'true').lower() == 'true'
+DB_POOL_WARM_CONNECTIONS = int(os.environ.get('DB_POOL_WARM_CONNECTIONS', DB_POOL_SIZE))
+WARMUP_TIMEOUT = float(os.environ.get('WARMUP_TIMEOUT', 30))
+READY_CHECK_TIMEOUT = float(os.environ.get('READY_CHECK_TIMEOUT', 2))
+
+WEB_BIND = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+# unset: WEB_WORKERS_PER_CPU per CPU available to the container
+WEB_WORKERS = int(os.environ['WEB_WORKERS']) if os.environ.get('WEB_WORKERS') else None
+WEB_WORKERS_PER_CPU = int(os.environ.get('WEB_WORKERS_PER_CPU', 1))
+WEB_BACKLOG = int(os.environ.get('WEB_BACKLOG', 2048))
+WEB_KEEPALIVE = int(os.environ.get('WEB_KEEPALIVE', 5))
+WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 60))
+WEB_GRACEFUL_TIMEOUT = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+WEB_MAX_REQUESTS = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+WEB_MAX_REQUESTS_JITTER = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 0))
+WEB_PRELOAD = os.environ.get('WEB_PRELOAD', 'false').lower() == 'true'
+WEB_LOOP = os.environ.get('WEB_LOOP', 'auto')
+WEB_HTTP = os.environ.get('WEB_HTTP', 'auto')
+WEB_LIMIT_CONCURRENCY = int(os.environ['WEB_LIMIT_CONCURRENCY']) if os.environ.get('WEB_LIMIT_CONCURRENCY') else None
+WEB_LOG_LEVEL = os.environ.get('WEB_LOG_LEVEL', 'info')
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+# memory (per worker) or postgres (shared, on top of the per worker limits)
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+LOGIN_LIMIT_PER_IP = os.environ.get('LOGIN_LIMIT_PER_IP', '30/minute')
+LOGIN_LIMIT_PER_ACCOUNT = os.environ.get('LOGIN_LIMIT_PER_ACCOUNT', '10/minute')
+SIGNUP_LIMIT_PER_IP = os.environ.get('SIGNUP_LIMIT_PER_IP', '10/minute')
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', 30))
+REVOCATION_FILTER_CAPACITY = int(os.environ.get('REVOCATION_FILTER_CAPACITY', 100000))
+REVOCATION_FILTER_FP_RATE = float(os.environ.get('REVOCATION_FILTER_FP_RATE', 0.001))
+REVOCATION_REFRESH_INTERVAL = float(os.environ.get('REVOCATION_REFRESH_INTERVAL', 30))
+
+# periodic archival of soft-deleted users inside every worker, the CLI works regardless
+ARCHIVE_ENABLED = os.environ.get('ARCHIVE_ENABLED', 'false').lower() == 'true'
+ARCHIVE_RETENTION_DAYS = float(os.environ.get('ARCHIVE_RETENTION_DAYS', 30))
+ARCHIVE_INTERVAL = float(os.environ.get('ARCHIVE_INTERVAL', 3600))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+# seconds to sleep between batches, leaves room to vacuum and to concurrent writers
+ARCHIVE_BATCH_PAUSE = float(os.environ.get('ARCHIVE_BATCH_PAUSE', 0.1))
+ARCHIVE_LOCK_TIMEOUT_MS = int(os.environ.get('ARCHIVE_LOCK_TIMEOUT_MS', 2000))
+
+# links in verification / password reset mail point here
+APP_BASE_URL = os.environ.get('APP_BASE_URL', 'http://localhost:8000')
+VERIFY_TOKEN_EXPIRE_HOURS = int(os.environ.get('VERIFY_TOKEN_EXPIRE_HOURS', 48))
+RESET_TOKEN_EXPIRE_MINUTES = int(os.environ.get('RESET_TOKEN_EXPIRE_MINUTES', 60))
+PASSWORD_RESET_LIMIT_PER_IP = os.environ.get('PASSWORD_RESET_LIMIT_PER_IP', '10/hour')
+PASSWORD_RESET_LIMIT_PER_ACCOUNT = os.environ.get('PASSWORD_RESET_LIMIT_PER_ACCOUNT', '3/hour')
+
+MAIL_HOST = os.environ.get('MAIL_HOST', 'smtp.gmail.com')
+MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+MAIL_STARTTLS = os.environ.get('MAIL_STARTTLS', 'true').lower() == 'true'
+MAIL_SSL = os.environ.get('MAIL_SSL', 'false').lower() == 'true'
+MAIL_FROM = os.environ.get('MAIL_FROM', EMAIL)
+# login is skipped without a password, e.g. against a local SMTP stand-in
+MAIL_USER = os.environ.get('MAIL_USER', EMAIL)
+MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', GM_PASS)
+MAIL_TIMEOUT = float(os.environ.get('MAIL_TIMEOUT', 10))
+# outbox rows are always written, this runs the dispatcher inside every worker
+MAIL_DISPATCHER_ENABLED = os.environ.get('MAIL_DISPATCHER_ENABLED', 'true' if EMAIL else 'false').lower() == 'true'
+# SMTP connections per dispatcher, also the number of mails sent at once
+MAIL_POOL_SIZE = int(os.environ.get('MAIL_POOL_SIZE', 4))
+MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 50))
+MAIL_POLL_INTERVAL = float(os.environ.get('MAIL_POLL_INTERVAL', 1))
+MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', 8))
+MAIL_BACKOFF_BASE = float(os.environ.get('MAIL_BACKOFF_BASE', 30))
+MAIL_BACKOFF_MAX = float(os.environ.get('MAIL_BACKOFF_MAX', 3600))
+# a claimed mail is offered again after this long when its dispatcher died while sending
+MAIL_LEASE_SECONDS = float(os.environ.get('MAIL_LEASE_SECONDS', 300))
+MAIL_KEEP_SENT_DAYS = float(os.environ.get('MAIL_KEEP_SENT_DAYS', 7))
+
+REQUIRED_SETTINGS = ('DB_CLIENT', 'DB_DRIVER', 'DB_HOST', 'DB_PORT', 'DB_NAME', 'DB_USER', 'DB_PASS', 'SECRET_TOKEN')
+SUPPORTED_ALGORITHMS = ('HS256', 'HS384', 'HS512')
+
+
+def validate_config() -> list[str]:
+    """every problem with the settings above, empty when the app can start"""
+    problems = [f'{name} is not set' for name in REQUIRED_SETTINGS if not globals()[name]]
+    if ALGORITHM not in SUPPORTED_ALGORITHMS:
+        problems.append(f'ALGORITHM must be one of {", ".join(SUPPORTED_ALGORITHMS)}, got {ALGORITHM}')
+    if ACCESS_TOKEN_EXPIRE_MINUTES <= 0:
+        problems.append('ACCESS_TOKEN_EXPIRE_MINUTES must be positive')
+    if HASH_POOL_KIND not in ('thread', 'process') or BULK_IMPORT_HASH_POOL_KIND not in ('thread', 'process'):
+        problems.append('HASH_POOL_KIND and BULK_IMPORT_HASH_POOL_KIND must be thread or process')
+    if BULK_IMPORT_MAX_LINE_BYTES < 1:
+        problems.append('BULK_IMPORT_MAX_LINE_BYTES must be positive')
+    if BCRYPT_ROUNDS is not None and not 4 <= BCRYPT_ROUNDS <= 31:
+        problems.append('BCRYPT_ROUNDS must be between 4 and 31')
+    if not 4 <= BCRYPT_MIN_ROUNDS <= BCRYPT_MAX_ROUNDS <= 31:
+        problems.append('BCRYPT_MIN_ROUNDS and BCRYPT_MAX_ROUNDS must satisfy 4 <= min <= max <= 31')
+    if DB_POOL_SIZE < 1 or DB_MAX_OVERFLOW < 0:
+        problems.append('DB_POOL_SIZE must be at least 1 and DB_MAX_OVERFLOW not negative')
+    if not 0 <= DB_POOL_WARM_CONNECTIONS <= DB_POOL_SIZE + DB_MAX_OVERFLOW:
+        problems.append('DB_POOL_WARM_CONNECTIONS must be between 0 and DB_POOL_SIZE + DB_MAX_OVERFLOW')
+    if not 0 <= SLOW_QUERY_SAMPLE_RATE <= 1:
+        problems.append('SLOW_QUERY_SAMPLE_RATE must be between 0 and 1')
+    if RATE_LIMIT_BACKEND not in ('memory', 'postgres'):
+        problems.append('RATE_LIMIT_BACKEND must be memory or postgres')
+    for name in ('LOGIN_LIMIT_PER_IP', 'LOGIN_LIMIT_PER_ACCOUNT', 'SIGNUP_LIMIT_PER_IP',
+                 'PASSWORD_RESET_LIMIT_PER_IP', 'PASSWORD_RESET_LIMIT_PER_ACCOUNT'):
+        if not re.fullmatch(r'[1-9][0-9]*/(second|minute|hour|day)', globals()[name]):
+            problems.append(f'{name} must look like 10/minute, got {globals()[name]}')
+    if WEB_LOOP not in ('auto', 'asyncio', 'uvloop') or WEB_HTTP not in ('auto', 'h11', 'httptools'):
+        problems.append('WEB_LOOP must be auto, asyncio or uvloop and WEB_HTTP auto, h11 or httptools')
+    if REFRESH_TOKEN_EXPIRE_DAYS <= 0:
+        problems.append('REFRESH_TOKEN_EXPIRE_DAYS must be positive')
+    if not 0 < REVOCATION_FILTER_FP_RATE < 1 or REVOCATION_FILTER_CAPACITY < 1:
+        problems.append('REVOCATION_FILTER_FP_RATE must be between 0 and 1 and REVOCATION_FILTER_CAPACITY positive')
+    if ARCHIVE_BATCH_SIZE < 1 or ARCHIVE_RETENTION_DAYS < 0 or ARCHIVE_BATCH_PAUSE < 0:
+        problems.append('ARCHIVE_BATCH_SIZE must be positive, ARCHIVE_RETENTION_DAYS and ARCHIVE_BATCH_PAUSE not negative')
+    if MAIL_DISPATCHER_ENABLED and not MAIL_FROM:
+        problems.append('MAIL_FROM (or EMAIL) must be set when MAIL_DISPATCHER_ENABLED')
+    if MAIL_POOL_SIZE < 1 or MAIL_BATCH_SIZE < 1 or MAIL_MAX_ATTEMPTS < 1:
+        problems.append('MAIL_POOL_SIZE, MAIL_BATCH_SIZE and MAIL_MAX_ATTEMPTS must be positive')
+    return problems
@@ -1,7 +1,9 @@
 #!/bin/bash
 
-alembic upgrade head
+# migrations are better run once per deploy (e.g. `docker compose run app alembic upgrade head`)
+# than by every container; RUN_MIGRATIONS=false leaves them out of the start-up
+if [ "${RUN_MIGRATIONS:-true}" = "true" ]; then
+    alembic upgrade head
+fi
 
-cd backend
-
-gunicorn main:app --workers 2 --worker-class uvicorn.workers.UvicornWorker --bind=0.0.0.0:8000
\ No newline at end of file
+exec python -m backend.launcher
@@ -0,0 +1,41 @@
+"""items search
+
+Revision ID: 2ed737e0278d
+Revises: c486d37aa57d
+Create Date: 2026-10-18 13:02:57.114805
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '2ed737e0278d'
+down_revision: Union[str, None] = 'c486d37aa57d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ITEM_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(content, '')), 'B')"
+)
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.add_column('items', sa.Column(
+        'search_vector', postgresql.TSVECTOR(), sa.Computed(ITEM_SEARCH_VECTOR, persisted=True), nullable=True
+    ))
+    op.create_index('ix_items_search_vector', 'items', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index(
+        'ix_items_title_trgm', 'items', ['title'], unique=False,
+        postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_items_title_trgm', table_name='items')
+    op.drop_index('ix_items_search_vector', table_name='items')
+    op.drop_column('items', 'search_vector')
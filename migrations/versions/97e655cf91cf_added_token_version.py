@@ -0,0 +1,25 @@
+"""added token version
+
+Revision ID: 97e655cf91cf
+Revises: 8914601d7f4f
+Create Date: 2026-10-18 09:12:41.305517
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '97e655cf91cf'
+down_revision: Union[str, None] = '8914601d7f4f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
@@ -0,0 +1,41 @@
+"""active user indexes
+
+Revision ID: a861bc1607a1
+Revises: fc0febf0b697
+Create Date: 2026-10-18 18:31:09.402716
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a861bc1607a1'
+down_revision: Union[str, None] = 'fc0febf0b697'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT lower(email) FROM users GROUP BY lower(email) HAVING count(*) > 1 LIMIT 10'
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(
+            'emails differing only in case must be merged before this migration: ' + ', '.join(duplicates)
+        )
+    op.create_index('ux_users_email_lower', 'users', [sa.text('lower(email)')], unique=True)
+    op.create_index(
+        'ix_users_active_email_lower', 'users', [sa.text('lower(email)')], postgresql_where=sa.text('is_active'),
+    )
+    op.create_index(
+        'ix_users_active_id', 'users', ['id'], postgresql_include=['token_version'],
+        postgresql_where=sa.text('is_active'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_active_id', table_name='users')
+    op.drop_index('ix_users_active_email_lower', table_name='users')
+    op.drop_index('ux_users_email_lower', table_name='users')
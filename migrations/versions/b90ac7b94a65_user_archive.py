@@ -0,0 +1,57 @@
+"""user archive
+
+Revision ID: b90ac7b94a65
+Revises: a861bc1607a1
+Create Date: 2026-10-18 19:04:51.238817
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'b90ac7b94a65'
+down_revision: Union[str, None] = 'a861bc1607a1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('deactivated_at', sa.DateTime(timezone=True), nullable=True))
+    # deactivation time of existing soft-deleted users is unknown, their retention starts now
+    op.execute('UPDATE users SET deactivated_at = now() WHERE is_active = false')
+    op.create_index(
+        'ix_users_deactivated_at', 'users', ['deactivated_at'], postgresql_where=sa.text('deactivated_at IS NOT NULL'),
+    )
+    op.create_table(
+        'users_archive',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('username', sa.String(), nullable=True),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('hashed_password', sa.String(), nullable=True),
+        sa.Column('role_mask', sa.SmallInteger(), nullable=False),
+        sa.Column('token_version', sa.Integer(), nullable=False),
+        sa.Column('deactivated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'items_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(), nullable=True),
+        sa.Column('content', sa.String(), nullable=True),
+        sa.Column('owner_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_items_archive_owner_id', 'items_archive', ['owner_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_items_archive_owner_id', table_name='items_archive')
+    op.drop_table('items_archive')
+    op.drop_table('users_archive')
+    op.drop_index('ix_users_deactivated_at', table_name='users')
+    op.drop_column('users', 'deactivated_at')
@@ -0,0 +1,26 @@
+"""rate limits
+
+Revision ID: bfc3d246f589
+Revises: 2ed737e0278d
+Create Date: 2026-10-18 16:20:41.532108
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bfc3d246f589'
+down_revision: Union[str, None] = '2ed737e0278d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # unlogged: no WAL for every login attempt, losing the limits on a crash is fine
+    op.execute('CREATE UNLOGGED TABLE rate_limits (key bytea PRIMARY KEY, tat double precision NOT NULL)')
+
+
+def downgrade() -> None:
+    op.drop_table('rate_limits')
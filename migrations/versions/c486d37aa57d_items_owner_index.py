@@ -0,0 +1,31 @@
+"""items owner index
+
+Revision ID: c486d37aa57d
+Revises: 97e655cf91cf
+Create Date: 2026-10-18 11:40:03.918224
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c486d37aa57d'
+down_revision: Union[str, None] = '97e655cf91cf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # ix_items_id duplicates the primary key, title / content btrees serve no query
+    op.drop_index('ix_items_title', table_name='items')
+    op.drop_index('ix_items_content', table_name='items')
+    op.drop_index('ix_items_id', table_name='items')
+    op.create_index('ix_items_owner_id_id', 'items', ['owner_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_items_owner_id_id', table_name='items')
+    op.create_index('ix_items_id', 'items', ['id'], unique=False)
+    op.create_index('ix_items_content', 'items', ['content'], unique=False)
+    op.create_index('ix_items_title', 'items', ['title'], unique=False)
@@ -0,0 +1,40 @@
+"""role mask
+
+Revision ID: fc0febf0b697
+Revises: c09c143f333e
+Create Date: 2026-10-18 18:02:37.114520
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'fc0febf0b697'
+down_revision: Union[str, None] = 'c09c143f333e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# same bits as models.ROLE_BITS, spelled out so this revision never changes
+ROLE_BITS = {'ROLE_PORTAL_USER': 1, 'ROLE_PORTAL_ADMIN': 2, 'ROLE_PORTAL_SUPERADMIN': 4}
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('role_mask', sa.SmallInteger(), server_default='1', nullable=False))
+    mask = ' | '.join(f"CASE WHEN '{role}' = ANY(roles) THEN {bit} ELSE 0 END" for role, bit in ROLE_BITS.items())
+    op.execute(f'UPDATE users SET role_mask = {mask}')
+    op.drop_column('users', 'roles')
+    op.create_index('ix_users_role_admin', 'users', ['id'], postgresql_where=sa.text('(role_mask & 2) <> 0'))
+    op.create_index('ix_users_role_superadmin', 'users', ['id'], postgresql_where=sa.text('(role_mask & 4) <> 0'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_role_superadmin', table_name='users')
+    op.drop_index('ix_users_role_admin', table_name='users')
+    op.add_column('users', sa.Column('roles', postgresql.ARRAY(sa.String()), nullable=True))
+    names = ', '.join(f"CASE WHEN role_mask & {bit} <> 0 THEN '{role}' END" for role, bit in ROLE_BITS.items())
+    op.execute(f'UPDATE users SET roles = array_remove(ARRAY[{names}]::varchar[], NULL)')
+    op.alter_column('users', 'roles', nullable=False)
+    op.drop_column('users', 'role_mask')
@@ -0,0 +1,16 @@
+import os
+
+# config.py reads these at import time; a .env or the environment wins
+for name, value in {
+    'DB_CLIENT': 'postgresql',
+    'DB_DRIVER': 'asyncpg',
+    'DB_HOST': 'localhost',
+    'DB_PORT': '5432',
+    'DB_NAME': 'postgres',
+    'DB_USER': 'postgres',
+    'DB_PASS': 'postgres',
+    'SECRET_KEY': 'test',
+    'SECRET_AUTH': 'test',
+    'SECRET_TOKEN': 'test',
+}.items():
+    os.environ.setdefault(name, value)
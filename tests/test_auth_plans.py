@@ -0,0 +1,39 @@
+"""
+The auth lookups must keep using the lower(email) and partial active-user
+indexes. Needs the database from config.py with migrations applied, skipped
+when it cannot be reached.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from backend.authentication.database import async_session, engine
+from benchmarks.explain_auth import CHECKS, explain, index_scan
+
+
+async def _plans() -> dict:
+    try:
+        async with engine.connect():
+            pass
+    except (OSError, DBAPIError) as err:
+        await engine.dispose()
+        pytest.skip(f'database not reachable: {err}')
+    try:
+        async with async_session() as session:
+            return {label: await explain(session, query) for label, query, _ in CHECKS}
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture(scope='module')
+def plans() -> dict:
+    # one event loop for every plan, the engine's connections are bound to it
+    return asyncio.run(_plans())
+
+
+@pytest.mark.parametrize('label, indexes', [(label, indexes) for label, _, indexes in CHECKS])
+def test_auth_lookup_uses_index(plans: dict, label: str, indexes: tuple[str, ...]):
+    plan = plans[label]
+    ok, scan = index_scan(plan, indexes)
+    assert ok, f'{label} no longer uses {" / ".join(indexes)}: {scan}\n' + '\n'.join(plan)
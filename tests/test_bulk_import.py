@@ -0,0 +1,56 @@
+import asyncio
+
+from backend.authentication.bulk_import import iter_records
+
+
+def _records(data: bytes, fmt: str = 'csv', chunk_size: int = 7, max_line_bytes: int = 1000) -> list:
+    async def chunks():
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    async def collect():
+        return [record async for record in iter_records(chunks(), fmt, max_line_bytes)]
+
+    return asyncio.run(collect())
+
+
+def test_csv_rows():
+    data = b'username,email,password\r\nann,ann@x.com,pw\r\nbob,bob@x.com,pw\r\n'
+    assert _records(data) == [
+        (2, {'username': 'ann', 'email': 'ann@x.com', 'password': 'pw'}),
+        (3, {'username': 'bob', 'email': 'bob@x.com', 'password': 'pw'}),
+    ]
+
+
+def test_csv_quoted_field_spans_lines():
+    data = b'username,email,password\n"ann\n""a""",ann@x.com,pw\nbob,bob@x.com,pw\n'
+    assert _records(data) == [
+        (2, {'username': 'ann\n"a"', 'email': 'ann@x.com', 'password': 'pw'}),
+        (4, {'username': 'bob', 'email': 'bob@x.com', 'password': 'pw'}),
+    ]
+
+
+def test_csv_stray_quote_in_unquoted_field():
+    data = b'username,email,password\nab"c,a@x.com,pw\nann,ann@x.com,pw\nbob,bob@x.com,pw\n'
+    assert _records(data) == [
+        (2, {'username': 'ab"c', 'email': 'a@x.com', 'password': 'pw'}),
+        (3, {'username': 'ann', 'email': 'ann@x.com', 'password': 'pw'}),
+        (4, {'username': 'bob', 'email': 'bob@x.com', 'password': 'pw'}),
+    ]
+
+
+def test_csv_quoted_field_not_closed():
+    data = b'username,email,password\nann,ann@x.com,pw\n"bob,bob@x.com,pw\n'
+    assert _records(data) == [
+        (2, {'username': 'ann', 'email': 'ann@x.com', 'password': 'pw'}),
+        (3, 'quoted field not closed at the end of the input'),
+    ]
+
+
+def test_over_long_line_is_rejected():
+    data = b'{"username": "ann"}\n' + b'x' * 50 + b'\n{"username": "bob"}\n'
+    assert _records(data, 'ndjson', max_line_bytes=30) == [
+        (1, {'username': 'ann'}),
+        (2, 'line longer than 30 bytes'),
+        (3, {'username': 'bob'}),
+    ]
@@ -0,0 +1,17 @@
+import pytest
+from fastapi import HTTPException
+
+from backend.secure.hashing import PasswordHasher
+
+
+def test_queue_size_does_not_count_running_work():
+    hasher = PasswordHasher(kind='thread', workers=2, max_queue=1, retry_after=1)
+    # both workers busy, nothing waiting
+    hasher._pending = 2
+    hasher.admit()
+    # one waiting, the queue is full
+    hasher._pending = 3
+    with pytest.raises(HTTPException) as raised:
+        hasher.admit()
+    assert raised.value.status_code == 503
+    assert hasher.rejected == 1